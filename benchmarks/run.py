@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+"""
+Benchmarks for expressionizer, using synthetic workloads that scale the
+expression length, nesting depth, operator mix, number of sub expressions,
+flat dict size, rule count and set cardinality.
+
+Everything runs offline with the standard library. Results are written as
+JSON, and can be compared against a stored baseline to catch regressions.
+
+Usage:
+    Run everything and print the results:
+        python benchmarks/run.py
+    Only run the benchmarks with a name containing "tokenizer":
+        python benchmarks/run.py --filter tokenizer
+    Store a baseline:
+        python benchmarks/run.py --output benchmarks/baseline.json
+    Compare against a baseline, exits with 1 when anything is more than 20%
+    slower:
+        python benchmarks/run.py --baseline benchmarks/baseline.json --threshold 0.2
+
+The baseline in benchmarks/baseline.json is compared against with
+"make bench-compare". Timings only compare on the same machine, so refresh it
+with "make bench-baseline" on the machine the comparison runs on, and commit
+it along with any change that deliberately makes things faster or slower.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import expressionizer
+from expressionizer import FlatDictExpression, RuleSet
+from expressionizer.base import BaseSetExpression
+from expressionizer.bitmap import BitmapSetExpression, MemberIndex
+
+_clock=time.perf_counter
+
+SEED=1234
+
+##-Workload generators-##
+
+def gen_leaf(rnd,keys):
+    """
+    Returns:
+        String with a random FlatDictExpression noun over keys
+    """
+    key=rnd.choice(keys)
+    op=rnd.choice(['','=','!=','>=','<','/','~'])
+    if not op:
+        return key+'.enabled'
+    if op == '~':
+        return '{}~^v{}'.format(key,rnd.randint(0,9))
+    return '{}{}v{}'.format(key,op,rnd.randint(0,9))
+
+def gen_expression(rnd,terms,keys,depth=0,ops='&|',not_ratio=0.1):
+    """
+    Generate an expression with a number of terms, nested in groups up to
+    depth levels deep.
+
+    Returns:
+        String
+    """
+    parts=[]
+    for i in range(terms):
+        if i:
+            parts.append(rnd.choice(ops))
+        leaf=gen_leaf(rnd,keys)
+        if rnd.random() < not_ratio:
+            leaf='!'+leaf
+        parts.append(leaf)
+    expression=''.join(parts)
+    for d in range(depth):
+        expression='({})&{}'.format(expression,gen_leaf(rnd,keys))
+    return expression
+
+def gen_keys(count):
+    return [ 'key{}.sub{}'.format(i//10,i%10) for i in range(count) ]
+
+def gen_flat_dict(rnd,size,keys):
+    """
+    Returns:
+        Dict with a string value for each of the first size keys, and a bool
+        value for some of their ".enabled" keys
+    """
+    flat_dict={}
+    for k in keys[:size]:
+        flat_dict[k]='v{}'.format(rnd.randint(0,9))
+        if rnd.random() < 0.5:
+            flat_dict[k+'.enabled']=rnd.random() < 0.5
+    return flat_dict
+
+class DictSetExpression(BaseSetExpression):
+    """
+    Set expression where every noun is looked up in a dict of sets
+    """
+    def __init__(self,sets):
+        BaseSetExpression.__init__(self)
+        self.sets=sets
+    def getSet(self,name):
+        return self.sets.get(name,set())
+
+class DictBitmapSetExpression(BitmapSetExpression):
+    """
+    Bitmap set expression where every noun is looked up in a dict of bitmaps
+    """
+    def __init__(self,bitmaps,index):
+        BitmapSetExpression.__init__(self,index=index)
+        self.bitmaps=bitmaps
+    def getSet(self,name):
+        if name == self.all_name:
+            return self.index.universe()
+        return self.bitmaps[name]
+
+##-Benchmarks-##
+#Each benchmark function takes its parameters and returns a function to time
+
+def bench_tokenizer(terms):
+    rnd=random.Random(SEED)
+    expression=gen_expression(rnd,terms,gen_keys(100),not_ratio=0.2)
+    expr=FlatDictExpression()
+    return lambda: expr._tokenizer(expression)
+
+def bench_compile(terms,depth):
+    rnd=random.Random(SEED)
+    expression=gen_expression(rnd,terms,gen_keys(100),depth=depth)
+    expr=FlatDictExpression()
+    return lambda: expr.compile(expression)
+
+def bench_process_expression(terms,depth,ops):
+    rnd=random.Random(SEED)
+    keys=gen_keys(100)
+    expression=gen_expression(rnd,terms,keys,depth=depth,ops=ops)
+    expr=FlatDictExpression(gen_flat_dict(rnd,100,keys))
+    return lambda: expr.processExpression(expression)
+
+def bench_evaluate_compiled(terms,depth,ops):
+    rnd=random.Random(SEED)
+    keys=gen_keys(100)
+    compiled=expressionizer.compile(gen_expression(rnd,terms,keys,depth=depth,ops=ops))
+    flat_dict=gen_flat_dict(rnd,100,keys)
+    return lambda: compiled.evaluate(flat_dict)
+
+def bench_evaluate_function(terms,depth,ops):
+    rnd=random.Random(SEED)
+    keys=gen_keys(100)
+    function=expressionizer.compile(gen_expression(rnd,terms,keys,depth=depth,ops=ops)).as_function()
+    flat_dict=gen_flat_dict(rnd,100,keys)
+    return lambda: function(flat_dict)
+
+def bench_get_val(dict_size):
+    rnd=random.Random(SEED)
+    keys=gen_keys(dict_size)
+    expr=FlatDictExpression(gen_flat_dict(rnd,dict_size,keys))
+    names=[ gen_leaf(rnd,keys) for i in range(100) ]
+    def run():
+        for name in names:
+            expr.getVal(name)
+    return run
+
+def bench_sub_expressions(sub_expressions):
+    rnd=random.Random(SEED)
+    keys=gen_keys(100)
+    expr=FlatDictExpression(gen_flat_dict(rnd,100,keys))
+    parts=[]
+    for i in range(sub_expressions):
+        #Multi character start/end operators, so any number of them can exist
+        start_char,end_char='#{}['.format(i),'#{}]'.format(i)
+        expr.addSubExpression('sub{}'.format(i),start_char,end_char,lambda n: len(n)%2 == 0,'all')
+        parts.append('{}{}|{}{}'.format(start_char,gen_leaf(rnd,keys),gen_leaf(rnd,keys),end_char))
+    expression='|'.join(parts)
+    return lambda: expr.processExpression(expression)
+
+def bench_rule_set(rules):
+    rnd=random.Random(SEED)
+    keys=gen_keys(1000)
+    rule_set=RuleSet([ (i,gen_expression(rnd,rnd.randint(1,5),keys)) for i in range(rules) ])
+    flat_dict=gen_flat_dict(rnd,50,rnd.sample(keys,50))
+    return lambda: rule_set.match(flat_dict)
+
+def bench_set_expression(cardinality):
+    rnd=random.Random(SEED)
+    universe=list(range(cardinality))
+    sets={'all': set(universe)}
+    for name in 'abcdef':
+        sets[name]=set(rnd.sample(universe,cardinality//4))
+    expr=DictSetExpression(sets)
+    return lambda: expr.processExpression('(a|b)&c&!d|(e&!f)')
+
+def bench_bitmap_set_expression(cardinality):
+    rnd=random.Random(SEED)
+    universe=list(range(cardinality))
+    index=MemberIndex(universe)
+    bitmaps={}
+    for name in 'abcdef':
+        bitmaps[name]=index.bitmap(rnd.sample(universe,cardinality//4))
+    expr=DictBitmapSetExpression(bitmaps,index)
+    return lambda: expr.processExpressionBitmap('(a|b)&c&!d|(e&!f)')
+
+BENCHMARKS=[
+    ('tokenizer',bench_tokenizer,[ {'terms': t} for t in (10,100,1000) ]),
+    ('compile',bench_compile,[ {'terms': t,'depth': d} for t in (10,100,1000) for d in (0,50) ]),
+    ('process_expression',bench_process_expression,[ {'terms': t,'depth': d,'ops': o} for t in (10,100) for d in (0,50) for o in ('&','|','&|') ]),
+    ('evaluate_compiled',bench_evaluate_compiled,[ {'terms': t,'depth': d,'ops': o} for t in (10,100) for d in (0,50) for o in ('&','|','&|') ]),
+    ('evaluate_function',bench_evaluate_function,[ {'terms': t,'depth': d,'ops': o} for t in (10,100) for d in (0,50) for o in ('&','|','&|') ]),
+    ('get_val',bench_get_val,[ {'dict_size': s} for s in (10,1000,100000) ]),
+    ('sub_expressions',bench_sub_expressions,[ {'sub_expressions': s} for s in (1,5,20) ]),
+    ('rule_set',bench_rule_set,[ {'rules': r} for r in (100,1000,10000) ]),
+    ('set_expression',bench_set_expression,[ {'cardinality': c} for c in (100,10000,100000) ]),
+    ('bitmap_set_expression',bench_bitmap_set_expression,[ {'cardinality': c} for c in (100,10000,100000,1000000) ]),
+]
+
+##-Runner-##
+
+def bench_name(name,params):
+    return '{}[{}]'.format(name,','.join('{}={}'.format(k,params[k]) for k in sorted(params)))
+
+def measure(func,min_time,repeat):
+    """
+    Time a function, calibrating the number of calls per run so each run
+    takes at least min_time seconds.
+
+    Returns:
+        Dict with the best seconds per call and the number of calls per run
+    """
+    number=1
+    while True:
+        start=_clock()
+        for i in range(number):
+            func()
+        elapsed=_clock()-start
+        if elapsed >= min_time:
+            break
+        number*=10 if elapsed < min_time/10 else 2
+    best=elapsed/number
+    for r in range(repeat-1):
+        start=_clock()
+        for i in range(number):
+            func()
+        best=min(best,(_clock()-start)/number)
+    return {'seconds_per_op': best,'number': number}
+
+def run(name_filter=None,min_time=0.05,repeat=3):
+    results={}
+    for name,bench,param_sets in BENCHMARKS:
+        for params in param_sets:
+            full_name=bench_name(name,params)
+            if name_filter and name_filter not in full_name:
+                continue
+            result=measure(bench(**params),min_time,repeat)
+            result['params']=params
+            results[full_name]=result
+            sys.stderr.write('{:<70} {:>12.2f} us\n'.format(full_name,result['seconds_per_op']*1e6))
+    return {
+        'meta': {
+            'expressionizer': expressionizer.__version__,
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+def compare(results,baseline,threshold):
+    """
+    Compare results against a baseline.
+
+    Returns:
+        List of names that are more than threshold slower than the baseline
+    """
+    regressions=[]
+    for name,result in sorted(results['results'].items()):
+        try:
+            base=baseline['results'][name]['seconds_per_op']
+        except KeyError:
+            continue
+        ratio=result['seconds_per_op']/base
+        flag=''
+        if ratio > 1+threshold:
+            flag='REGRESSION'
+            regressions.append(name)
+        elif ratio < 1-threshold:
+            flag='faster'
+        sys.stderr.write('{:<70} {:>7.2f}x {}\n'.format(name,ratio,flag))
+    return regressions
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Run the expressionizer benchmarks')
+    parser.add_argument('--filter',help='Only run benchmarks with a name containing this')
+    parser.add_argument('--output',help='File to write the JSON results to, default is stdout')
+    parser.add_argument('--baseline',help='JSON results to compare against')
+    parser.add_argument('--threshold',type=float,default=0.2,help='Fraction slower than the baseline that counts as a regression (default: 0.2)')
+    parser.add_argument('--min-time',type=float,default=0.05,help='Minimum seconds per timing run (default: 0.05)')
+    parser.add_argument('--repeat',type=int,default=3,help='Timing runs per benchmark, the best is kept (default: 3)')
+    args=parser.parse_args(argv)
+    results=run(args.filter,args.min_time,args.repeat)
+    if args.output:
+        with open(args.output,'w') as f:
+            json.dump(results,f,indent=2,sort_keys=True)
+    else:
+        json.dump(results,sys.stdout,indent=2,sort_keys=True)
+        sys.stdout.write('\n')
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline=json.load(f)
+        regressions=compare(results,baseline,args.threshold)
+        if regressions:
+            sys.stderr.write('{} benchmark(s) regressed\n'.format(len(regressions)))
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
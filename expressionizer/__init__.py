@@ -1,5 +1,29 @@
 from .base import BaseExpression
 from .base import BaseConditionalExpression
+from .base import BaseSetExpression
+from .bitmap import BitmapSetExpression
 from .expressions import FlatDictExpression
-__all__ = [ 'BaseExpression', 'BaseConditionalExpression', 'FlatDictExpression' ]
+from .expressions import NestedDictExpression
+from .expressions import compile
+from .expressions import compile_function
+from .expressions import evaluate_many
+from .expressions import filter_many
+from .compiled import CompiledExpression
+from .rules import RuleSet
+from .rules import WatchedRuleSet
+from .cache import LookupCache
+from .trie import IndexedFlatDict
+from .budget import Budget
+from .budget import EvaluationTimeout
+from .bundle import save_bundle
+from .bundle import load_bundle
+__all__ = [ 'BaseExpression', 'BaseConditionalExpression', 'BaseSetExpression', 'BitmapSetExpression', 'FlatDictExpression', 'NestedDictExpression', 'CompiledExpression', 'compile_function', 'evaluate_many', 'filter_many', 'RuleSet', 'WatchedRuleSet', 'LookupCache', 'IndexedFlatDict', 'ParallelEvaluator', 'Budget', 'EvaluationTimeout', 'save_bundle', 'load_bundle' ]
 __version__ = '0.2.1'
+
+def __getattr__(name):
+    #ParallelEvaluator pulls in concurrent.futures and multiprocessing, so it
+    #is only imported once it is used
+    if name == 'ParallelEvaluator':
+        from .parallel import ParallelEvaluator
+        return ParallelEvaluator
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__,name))
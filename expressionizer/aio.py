@@ -0,0 +1,106 @@
+"""
+Asyncio evaluation of compiled expressions.
+
+Every lookup an expression needs (getVal, getSet and sub expression
+functions) is resolved concurrently, with a limit on how many run at once,
+and the results are then combined exactly like a normal evaluation. Lookup
+functions can be coroutine functions, or plain functions returning a value.
+Sub expressions with a batch function get a single call for all of their
+nouns.
+
+For example:
+    class RemoteHosts(BaseSetExpression):
+        async def getSet(self,name):
+            return set(await inventory.query(name))
+
+    hosts=await RemoteHosts().processExpressionAsync('web&!maintenance')
+"""
+import asyncio
+import inspect
+
+async def resolve_lookups(expression,keys,concurrency=None):
+    """
+    Resolve lookups concurrently, through the cache of the expression when
+    it has one.
+
+    Args:
+        expression      Expression object the lookups belong to
+        keys            List of (lookup function, sub expression name, noun)
+                        tuples, IE from _prefetchKeys
+        concurrency     Int with the max number of lookups to run at once,
+                        defaults to async_concurrency of the expression
+
+    Returns:
+        Dict of (sub expression name, noun) to the lookup result
+    """
+    if concurrency is None:
+        concurrency=expression.async_concurrency
+    semaphore=asyncio.Semaphore(concurrency)
+    cache=expression.cache
+    async def resolve(lookup,subExprName,name):
+        key=(subExprName,name)
+        if cache is not None:
+            try:
+                return cache[key]
+            except KeyError:
+                pass
+        async with semaphore:
+            value=lookup(subExprName,name)
+            if inspect.isawaitable(value):
+                value=await value
+        value=expression._convertLookup(value)
+        if cache is not None:
+            cache[key]=value
+        return value
+    async def resolve_batch(subExprName,names):
+        values={}
+        missing=[]
+        for name in names:
+            if cache is not None:
+                try:
+                    values[(subExprName,name)]=cache[(subExprName,name)]
+                    continue
+                except KeyError:
+                    pass
+            missing.append(name)
+        if missing:
+            async with semaphore:
+                results=expression._lookupBatch(subExprName,missing)
+                if inspect.isawaitable(results):
+                    results=await results
+            values.update(expression._batchResults(subExprName,missing,results))
+        return values
+    #Nouns of sub expressions with a batch function are resolved with a
+    #single call per sub expression
+    s_exprs=expression.operators['sub_expressions']
+    batches={}
+    single=[]
+    for k in keys:
+        if k[1] and s_exprs[k[1]].get('batch'):
+            batches.setdefault(k[1],[]).append(k[2])
+        else:
+            single.append(k)
+    tasks=[ resolve(*k) for k in single ]+[ resolve_batch(*b) for b in batches.items() ]
+    results=await asyncio.gather(*tasks)
+    values=dict(zip([ (k[1],k[2]) for k in single ],results))
+    for batch_values in results[len(single):]:
+        values.update(batch_values)
+    return values
+
+async def evaluate_async(compiled,data=None,concurrency=None):
+    """
+    Evaluate a compiled expression, resolving all of its lookups
+    concurrently first.
+
+    Args:
+        compiled        CompiledExpression
+        data            Data the leaves are evaluated against, IE a flat dict
+        concurrency     Int with the max number of lookups to run at once
+
+    Returns:
+        The same result processExpression would
+    """
+    expression=compiled.evaluator
+    keys=expression._prefetchKeys(compiled.root)
+    values=await resolve_lookups(expression,keys,concurrency)
+    return expression._result(expression._evalPrefetched(compiled.root,values,data))
@@ -1,5 +1,13 @@
 import re
 import logging
+import contextvars
+from .compiled import Leaf, Not, And, Or, CompiledExpression, iter_leaves, fold
+from .trace import TracerChain, traced, _clock
+
+#Compiled _tokenizer regular expressions, keyed by the operators they split on
+_lexers={}
+#Lookup results resolved ahead of evaluation, see BaseExpression._evalPrefetched
+_prefetched=contextvars.ContextVar('expressionizer_prefetched',default=None)
 
 class BaseExpression:
     """
@@ -13,6 +21,20 @@ class BaseExpression:
             'or_operators': ['|'],
             'sub_expressions': {},
     }
+    #Estimated cost of resolving a noun without a sub expression cost hint
+    default_leaf_cost=1
+    #Max number of compiled expressions processExpression keeps around
+    compile_cache_size=1024
+    _lexer=None
+    tracer=None
+    cache=None
+    #Default max number of concurrent lookups for processExpressionAsync
+    async_concurrency=10
+    #Whether any sub expression has a batch function
+    _batching=False
+    #Trees deeper than this are evaluated by _evalIterative, instead of the
+    #recursive _evalNode
+    max_recursion_depth=200
     def __init__(self,operators=None,logger=None):
         """
         Initialize the expression with the given operators. The "operators"
@@ -28,6 +50,15 @@ class BaseExpression:
             self.operators=self.default_operators
         else:
             self.operators=operators
+    def __getstate__(self):
+        """
+        Compiled expression caches, the lexer and any tracer are left out when
+        pickling, IE to send the expression to worker processes.
+        """
+        state=self.__dict__.copy()
+        for k in ('_compile_cache','_batch_plans','_lexer','_evalNode','tracer'):
+            state.pop(k,None)
+        return state
     def _indent_lvl(self,lvl):
         """
         This is a helper function that generates a string of spaces based.
@@ -157,6 +188,41 @@ class BaseExpression:
                 break
             count+=1
         return (nop, loc)
+    def _nounOps(self):
+        """
+        Returns:
+            List of operators that are part of a noun, like comparison
+            operators. These are never split out by the _tokenizer, even if
+            they contain an expression operator.
+        """
+        return []
+    def _buildLexer(self):
+        """
+        Build the regular expression used by _tokenizer to split an expression
+        in a single pass. Lexers are shared between all expressions that use
+        the same operators.
+
+        Returns:
+            Compiled regular expression. When noun operators need protecting,
+            group 1 is the expression operator matched, otherwise the pattern
+            is suitable for re.split()
+        """
+        ops=self._allOps()
+        protect=[ n_op for n_op in self._nounOps() if any(op in n_op for op in ops) ]
+        key=(tuple(ops),tuple(protect))
+        try:
+            lexer=_lexers[key]
+        except KeyError:
+            #Longest first, so multi character operators win over their prefixes
+            op_re='|'.join(re.escape(op) for op in sorted(set(ops),key=len,reverse=True))
+            if protect:
+                protect_re='|'.join(re.escape(op) for op in sorted(set(protect),key=len,reverse=True))
+                lexer=re.compile('(?:{})|({})'.format(protect_re,op_re))
+            else:
+                lexer=re.compile('({})'.format(op_re))
+            _lexers[key]=lexer
+        self._lexer=lexer
+        return lexer
     def _tokenizer(self,expression):
         """
         Take an expression and split it into nouns and verbs(operators)
@@ -167,20 +233,594 @@ class BaseExpression:
         Returns:
             List where each element is either a noun or an operator
         """
-        cur_expression=expression
+        lexer=self._lexer
+        if lexer is None:
+            lexer=self._buildLexer()
+        if not lexer.groups:
+            #No noun operators to protect, the whole thing can be split at once
+            return [ t for t in lexer.split(expression) if t ]
         lhs=[]
-        while cur_expression:
-            next_op=self._nextOp(cur_expression)
-            if not next_op[0]:
-                lhs.append(cur_expression)
-                cur_expression=''
-            else:
-                noun=cur_expression[:next_op[1]]
-                cur_expression=cur_expression[next_op[1]+next_op[2]:]
-                if noun:
-                    lhs.append(noun)
-                lhs.append(next_op[0])
+        pos=0
+        for m in lexer.finditer(expression):
+            op=m.group(1)
+            if op is None:
+                #Matched a noun operator, leave it as part of the noun
+                continue
+            if m.start() > pos:
+                lhs.append(expression[pos:m.start()])
+            lhs.append(op)
+            pos=m.end()
+        if pos < len(expression):
+            lhs.append(expression[pos:])
         return (lhs)
+    def _compileLeaf(self,name,subExprName=None):
+        """
+        Turn a noun into a Leaf node. Subclasses can override this to do any
+        parsing of the noun up front, so it doesn't have to happen on every
+        evaluation.
+
+        Args:
+            name            String with the noun
+            subExprName     String with the name of the sub expression the
+                            noun was found in, or None
+
+        Returns:
+            Leaf
+        """
+        return Leaf(name,subexpr=subExprName)
+    def _parseTokens(self,tokens,subExprName=None,end_char=None):
+        """
+        Parse tokens from the _tokenizer into a tree of nodes, in a single
+        pass. Expressions are evaluated left to right, so a run of the same
+        operator is collected into a single node. Groups and sub expressions
+        are kept on a stack rather than recursing, so there is no limit on how
+        deeply they can be nested.
+
+        Args:
+            tokens          Iterator of tokens
+            subExprName     String that is the 'name' of the sub expression
+                            being parsed
+            end_char        String of the operator that ends the group or sub
+                            expression being parsed
+
+        Returns:
+            Node, or None if there was nothing to parse
+        """
+        ops=self._allOps()
+        s_exprs=self.operators['sub_expressions']
+        not_ops=self.operators['not_operators']
+        and_ops=self.operators['and_operators']
+        or_ops=self.operators['or_operators']
+        group_start=self.operators['group_start_char']
+        group_end=self.operators['group_end_char']
+        #State of every group or sub expression the current one is nested in
+        stack=[]
+        #Operands of the current run of the chain operator (And or Or)
+        operands=[]
+        chain=None
+        pending_op=None
+        negate=False
+        for t in tokens:
+            if t not in ops:
+                t=t.strip()
+                if not t:
+                    continue
+                operand=self._compileLeaf(t,subExprName)
+            elif t == end_char:
+                if pending_op is not None or negate:
+                    raise ValueError("Expression ends with an operator")
+                if not stack:
+                    break
+                #The group is done, and is an operand of the one it is in
+                if not operands:
+                    raise ValueError("Empty group in expression")
+                group=(operands,chain)
+                operands,chain,pending_op,negate,subExprName,end_char=stack.pop()
+                if not operands and not negate:
+                    #The group starts the one it is in, which carries on with
+                    #its operands, so "(a&b)&c" is a single And without
+                    #copying the children of one for every group
+                    operands,chain=group
+                    continue
+                operand=group[0][0] if group[1] is None else group[1](group[0])
+            elif t in not_ops:
+                if operands and pending_op is None:
+                    #"a ! b" is the same as "a & !b"
+                    pending_op=And
+                negate=not negate
+                continue
+            elif t in and_ops or t in or_ops:
+                op=And if t in and_ops else Or
+                if not operands:
+                    raise ValueError("Missing operand before: {}".format(t))
+                if negate or pending_op not in (None,op):
+                    #"a&&b" is allowed, "a&|b" and "a!&b" aren't
+                    raise ValueError("Unexpected operator: {}".format(t))
+                pending_op=op
+                continue
+            elif t == group_start:
+                stack.append((operands,chain,pending_op,negate,subExprName,end_char))
+                operands,chain,pending_op,negate,end_char=[],None,None,False,group_end
+                continue
+            else:
+                for sek in s_exprs:
+                    if t == s_exprs[sek]['start_char']:
+                        stack.append((operands,chain,pending_op,negate,subExprName,end_char))
+                        operands,chain,pending_op,negate,subExprName,end_char=[],None,None,False,sek,s_exprs[sek]['end_char']
+                        break
+                else:
+                    raise ValueError("Unexpected operator: {}".format(t))
+                continue
+            if negate:
+                operand=Not(operand,subexpr=subExprName)
+                negate=False
+            if not operands:
+                operands.append(operand)
+            elif pending_op is None:
+                raise ValueError("Missing operator before: {!r}".format(operand))
+            elif pending_op is chain:
+                operands.append(operand)
+            else:
+                if chain is not None:
+                    #Everything so far is the left hand side of the new operator
+                    operands=[chain(operands)]
+                chain=pending_op
+                operands.append(operand)
+            pending_op=None
+        else:
+            if end_char is not None:
+                raise ValueError("Missing closing: {}".format(end_char))
+        if pending_op is not None or negate:
+            raise ValueError("Expression ends with an operator")
+        if not operands:
+            return None
+        if chain is None:
+            return operands[0]
+        return chain(operands)
+    def _parse(self,expression,subExprName=None):
+        """
+        Parse an expression into a tree of nodes.
+
+        Args:
+            expression      String or List representing the expression to parse
+            subExprName     String that is the 'name' of the sub expression
+                            the expression belongs to.
+
+        Returns:
+            Node that is the root of the tree
+        """
+        if isinstance(expression,str):
+            tokens=self._tokenizer(expression)
+        else:
+            #Assume a List was passed
+            tokens=expression
+        root=self._parseTokens(iter(tokens),subExprName=subExprName)
+        if root is None:
+            raise ValueError("Empty expression")
+        return self._costOrder(root)[0]
+    def _leafCost(self,leaf):
+        """
+        Args:
+            leaf    Leaf node
+
+        Returns:
+            Number with the estimated cost of resolving the leaf
+        """
+        if leaf.subexpr:
+            cost=self.operators['sub_expressions'][leaf.subexpr].get('cost')
+            if cost is not None:
+                return cost
+        return self.default_leaf_cost
+    def _costOrder(self,node):
+        """
+        Reorder the children of And/Or nodes so the cheapest are evaluated
+        first. Both are commutative, and evaluation stops as soon as the
+        result is known, so expensive operands are often skipped entirely.
+        Operands with the same cost keep the order from the expression.
+
+        Args:
+            node    Node to reorder
+
+        Returns:
+            Tuple, first element is the reordered Node, second is the
+            estimated cost of evaluating it
+        """
+        return fold(node,self._costOrderNode)
+    def _costOrderNode(self,node,costed):
+        """
+        Reorder a single node for _costOrder.
+
+        Args:
+            node    Node to reorder
+            costed  List of the _costOrder results of its children
+
+        Returns:
+            Tuple of the reordered Node and its estimated cost
+        """
+        if isinstance(node,Leaf):
+            return (node,self._leafCost(node))
+        if isinstance(node,Not):
+            child,cost=costed[0]
+            return (Not(child,node.subexpr),cost)
+        costed.sort(key=lambda nc: nc[1])
+        return (node.__class__([ nc[0] for nc in costed ]),sum(nc[1] for nc in costed))
+    def compile(self,expression):
+        """
+        Parse an expression once into a CompiledExpression that can be
+        evaluated over and over again without re-parsing the expression.
+
+        Args:
+            expression      String representing an expression to compile
+
+        Returns:
+            CompiledExpression
+        """
+        return CompiledExpression(expression,self._parse(expression),self)
+    def _compileCached(self,expression):
+        """
+        Same as compile, but keeps the compiled expressions around so
+        processing the same expression again skips parsing.
+
+        Args:
+            expression      String representing an expression to compile
+
+        Returns:
+            CompiledExpression
+        """
+        try:
+            cache=self._compile_cache
+        except AttributeError:
+            cache=self._compile_cache={}
+        try:
+            return cache[expression]
+        except KeyError:
+            pass
+        if len(cache) >= self.compile_cache_size:
+            cache.clear()
+        compiled=cache[expression]=self.compile(expression)
+        return compiled
+    def _evalNode(self,node,data=None):
+        """
+        Evaluate a node from a compiled expression tree
+
+        Args:
+            node    Node to evaluate
+            data    Data the leaves are evaluated against
+
+        Returns:
+            Result of the evaluation
+        """
+        raise NotImplementedError
+    def _evalIterative(self,node,data=None,tracer=None):
+        """
+        Same as _evalNode, but keeps the nodes being evaluated on a stack
+        instead of recursing, so there is no limit on the depth of the tree.
+
+        Args:
+            node    Node to evaluate
+            data    Data the leaves are evaluated against
+            tracer  Tracer to record every node with, defaults to self.tracer
+
+        Returns:
+            Result of the evaluation
+        """
+        raise NotImplementedError
+    def _evalBudgeted(self,node,data,budget):
+        """
+        Evaluate the root node of a compiled expression, charging a Budget
+        for every node evaluated. The tracer attached with setTracer still
+        gets every node, after the budget has been charged for it.
+
+        Args:
+            node    Node to evaluate
+            data    Data the leaves are evaluated against
+            budget  Budget (see expressionizer.budget)
+
+        Returns:
+            Result of the evaluation
+
+        Raises:
+            EvaluationTimeout when the budget runs out
+        """
+        budget.start()
+        tracer=budget
+        if self.tracer is not None:
+            tracer=TracerChain(budget,self.tracer)
+        values=None
+        if self._batching:
+            values=self._resolveBatches(node)
+        if not values:
+            return self._evalIterative(node,data,tracer)
+        token=_prefetched.set(values)
+        try:
+            return self._evalIterative(node,data,tracer)
+        finally:
+            _prefetched.reset(token)
+    def _evalRoot(self,node,data=None):
+        """
+        Evaluate the root node of a tree, with _evalIterative when the tree is
+        too deep to recurse through.
+
+        Args:
+            node    Node to evaluate
+            data    Data the leaves are evaluated against
+
+        Returns:
+            Result of the evaluation
+        """
+        if node.depth > self.max_recursion_depth:
+            return self._evalIterative(node,data)
+        return self._evalNode(node,data)
+    def setCache(self,cache):
+        """
+        Cache lookups that only depend on the noun across calls, IE sub
+        expression functions, getSet, and getVal of expressions that don't
+        evaluate against data like a flat dict.
+
+        Args:
+            cache       LookupCache (see expressionizer.cache), or any mapping
+                        keyed by (sub expression name, noun). None to stop
+                        caching.
+        """
+        self.cache=cache
+    def _cached(self,lookup,subExprName,name):
+        """
+        Call lookup(subExprName,name) through self.cache, when there is one.
+
+        Args:
+            lookup          Function taking the sub expression name and noun
+            subExprName     String with the name of the sub expression, or None
+            name            String with the noun
+
+        Returns:
+            Result of lookup
+        """
+        key=(subExprName,name)
+        prefetched=_prefetched.get()
+        if prefetched is not None and key in prefetched:
+            return prefetched[key]
+        cache=self.cache
+        if cache is None:
+            return lookup(subExprName,name)
+        try:
+            return cache[key]
+        except KeyError:
+            value=cache[key]=lookup(subExprName,name)
+            return value
+    def _convertLookup(self,value):
+        """
+        Convert the result of a lookup function into the form the evaluator
+        works with. Subclasses can override this, IE to turn Sets into
+        Bitmaps.
+
+        Args:
+            value   Result of a lookup function
+
+        Returns:
+            The converted value
+        """
+        return value
+    def _leafLookup(self,leaf):
+        """
+        Args:
+            leaf    Leaf node
+
+        Returns:
+            Function taking the sub expression name and noun, that resolves
+            the leaf before _convertLookup. None when the leaf is resolved
+            locally from the data instead.
+        """
+        if leaf.subexpr:
+            return self._lookupSubExpr
+        return None
+    def _prefetchKeys(self,node):
+        """
+        Find every lookup needed to evaluate a node, so they can be resolved
+        ahead of time.
+
+        Args:
+            node    Node to find the lookups of
+
+        Returns:
+            List of unique (lookup function, sub expression name, noun) tuples
+        """
+        keys={}
+        for leaf in iter_leaves(node):
+            lookup=self._leafLookup(leaf)
+            if lookup is not None:
+                keys.setdefault((leaf.subexpr,leaf.name),lookup)
+        return [ (lookup,key[0],key[1]) for key,lookup in keys.items() ]
+    def _evalPrefetched(self,node,values,data=None):
+        """
+        Evaluate a node using lookup results that were resolved ahead of time,
+        instead of calling the lookup functions.
+
+        Args:
+            node    Node to evaluate
+            values  Dict of (sub expression name, noun) to the lookup result
+            data    Data the leaves are evaluated against
+
+        Returns:
+            Result of the evaluation
+        """
+        token=_prefetched.set(values)
+        try:
+            return self._evalRoot(node,data)
+        finally:
+            _prefetched.reset(token)
+    def _batchKeys(self,node):
+        """
+        Find the nouns of sub expressions that have a batch function.
+
+        Args:
+            node    Node to find the nouns of
+
+        Returns:
+            Dict of sub expression name to a List of unique nouns
+        """
+        try:
+            plans=self._batch_plans
+        except AttributeError:
+            plans=self._batch_plans={}
+        try:
+            return plans[node]
+        except KeyError:
+            pass
+        s_exprs=self.operators['sub_expressions']
+        batches={}
+        for lookup,subExprName,name in self._prefetchKeys(node):
+            if subExprName and s_exprs[subExprName].get('batch'):
+                batches.setdefault(subExprName,[]).append(name)
+        if len(plans) >= self.compile_cache_size:
+            plans.clear()
+        plans[node]=batches
+        return batches
+    def _lookupBatch(self,subExprName,names):
+        """
+        Args:
+            subExprName     String with the name of the sub expression
+            names           List of nouns
+
+        Returns:
+            Result of passing the nouns to the batch function of the sub
+            expression, a Dict of noun to result
+        """
+        return self.operators['sub_expressions'][subExprName]['batch'](names)
+    def _batchResults(self,subExprName,names,results):
+        """
+        Pick the result of every noun out of what a batch function returned.
+
+        Args:
+            subExprName     String with the name of the sub expression
+            names           List of the nouns passed to the batch function
+            results         Dict the batch function returned
+
+        Returns:
+            Dict of (sub expression name, noun) to the converted result
+        """
+        values={}
+        cache=self.cache
+        for name in names:
+            try:
+                value=results[name]
+            except KeyError:
+                raise ValueError("Batch function of sub expression {} returned no result for: {}".format(subExprName,name))
+            key=(subExprName,name)
+            value=values[key]=self._convertLookup(value)
+            if cache is not None:
+                cache[key]=value
+        return values
+    def _resolveBatches(self,node):
+        """
+        Resolve the nouns of every sub expression with a batch function, with
+        a single call per sub expression. Nouns already in self.cache are not
+        passed to the batch function again.
+
+        Args:
+            node    Node to resolve the batched nouns of
+
+        Returns:
+            Dict of (sub expression name, noun) to the lookup result, empty
+            when nothing is batched
+        """
+        values={}
+        if not self._batching:
+            return values
+        cache=self.cache
+        for subExprName,names in self._batchKeys(node).items():
+            missing=[]
+            for name in names:
+                if cache is not None:
+                    try:
+                        values[(subExprName,name)]=cache[(subExprName,name)]
+                        continue
+                    except KeyError:
+                        pass
+                missing.append(name)
+            if missing:
+                values.update(self._batchResults(subExprName,missing,self._lookupBatch(subExprName,missing)))
+        return values
+    def _evaluate(self,node,data=None):
+        """
+        Evaluate the root node of a compiled expression, resolving batched
+        sub expression nouns first.
+
+        Args:
+            node    Node to evaluate
+            data    Data the leaves are evaluated against
+
+        Returns:
+            Result of the evaluation
+        """
+        if not self._batching:
+            if node.depth > self.max_recursion_depth:
+                return self._evalIterative(node,data)
+            return self._evalNode(node,data)
+        return self._evalPrefetched(node,self._resolveBatches(node),data)
+    def _result(self,value):
+        """
+        Turn the result of evaluating a compiled expression into what
+        processExpression returns.
+
+        Args:
+            value   Result of _evalNode
+
+        Returns:
+            The result
+        """
+        return value
+    def processExpressionAsync(self,expression,concurrency=None):
+        """
+        Asyncio version of processExpression. Lookup functions (getVal,
+        getSet, sub expression functions) may be coroutine functions, and the
+        lookups of every noun are resolved concurrently before the results are
+        combined. Because every noun is resolved up front, nothing is skipped
+        by short-circuiting.
+
+        Args:
+            expression      String representing an expression to process
+            concurrency     Int with the max number of lookups to run at
+                            once, defaults to async_concurrency
+
+        Returns:
+            Coroutine that returns the same as processExpression
+        """
+        from .aio import evaluate_async
+        return evaluate_async(self._compileCached(expression),concurrency=concurrency)
+    def _lookupSubExpr(self,subExprName,name):
+        """
+        Args:
+            subExprName     String with the name of the sub expression
+            name            String with the noun
+
+        Returns:
+            Result of passing the noun to the function of the sub expression
+        """
+        s_expr=self.operators['sub_expressions'][subExprName]
+        if s_expr['func'] is None:
+            #Only has a batch function, IE the noun wasn't resolved up front
+            results=s_expr['batch']([name])
+            try:
+                return results[name]
+            except KeyError:
+                raise ValueError("Batch function of sub expression {} returned no result for: {}".format(subExprName,name))
+        return s_expr['func'](name)
+    def setTracer(self,tracer):
+        """
+        Attach a tracer (see expressionizer.trace) that is told about every
+        node evaluated in compiled expressions. Evaluation is left untouched
+        when there is no tracer.
+
+        Args:
+            tracer      Tracer object, or None to stop tracing
+        """
+        self.tracer=tracer
+        if tracer is None:
+            self.__dict__.pop('_evalNode',None)
+        else:
+            #Nodes evaluate their children through self._evalNode, so this
+            #traces every level
+            self._evalNode=traced(self.__class__._evalNode.__get__(self),tracer)
     def _evalExpression(expression,subExprName=None,recurse_lvl=0):
         """
         Returns a Set with the give name as the argument
@@ -189,7 +829,7 @@ class BaseExpression:
             name    Name that gets translated into a set, the expression uses
         """
         raise NotImplementedError
-    def addSubExpression(self,name,start_char,end_char,func,all_name):
+    def addSubExpression(self,name,start_char,end_char,func,all_name,cost=None,estimate=None,batch=None):
         """
         Add a new subexpression group to the operators dictionary. This allows
         different kinds of nouns to be retrieved and combined with.
@@ -205,16 +845,37 @@ class BaseExpression:
             func        Function to pass nouns to.
             all_name    String that is a noun to indicate the whole superset. 
                         Used when using the _notWrapGrouper function.
+            cost        Optional number hinting how expensive calling func
+                        is compared to other nouns (default_leaf_cost).
+                        Cheaper operands are evaluated first.
+            estimate    Optional function that takes a noun and returns the
+                        estimated size of the set func would return for it,
+                        or None when unknown. Only used by set expressions.
+            batch       Optional function that takes a List of nouns and
+                        returns a Dict of each noun to what func would return
+                        for it. Every noun of the sub expression is then
+                        resolved with a single call before evaluating, and
+                        func can be None.
         Returns:
             None
         """
         if start_char == end_char:
             raise ValueError("start_char cannot be the same as end_char: %s == %s" %(start_char,end_char))
+        if func is None and batch is None:
+            raise ValueError("Sub expression {} needs a func or a batch function".format(name))
         self.operators['sub_expressions'][name]={}
         self.operators['sub_expressions'][name]['start_char']=start_char
         self.operators['sub_expressions'][name]['end_char']=end_char
         self.operators['sub_expressions'][name]['func']=func
         self.operators['sub_expressions'][name]['all_name']=all_name
+        self.operators['sub_expressions'][name]['cost']=cost
+        self.operators['sub_expressions'][name]['estimate']=estimate
+        self.operators['sub_expressions'][name]['batch']=batch
+        #Lexer and compiled expressions depend on the operators in use
+        self._lexer=None
+        self._compile_cache={}
+        self._batch_plans={}
+        self._batching=any(s_expr.get('batch') for s_expr in self.operators['sub_expressions'].values())
     def processExpression(self,expression):
         """
         This uses _evalExpression to return the resulting Set. This is the
@@ -243,7 +904,7 @@ class BaseSetExpression(BaseExpression):
     combining lists into Sets.
     """
     default_all_name='all'
-    def __init__(self,operators=None,all_name=None):
+    def __init__(self,operators=None,all_name=None,logger=None):
         """
         Initialize the expression with the given operators. The "operators"
         argument is a dictionary. The not_operators,and_operators, and
@@ -252,6 +913,8 @@ class BaseSetExpression(BaseExpression):
 
         Args:
             operators       Dict of operators
+            all_name        String that is the noun for the whole superset
+            logger          Logger to use
         """
         self.logger = logger or logging.getLogger(self.__class__.__name__)
         if not operators:
@@ -289,7 +952,8 @@ class BaseSetExpression(BaseExpression):
     def _notWrapGrouper(self,expression,subExprName=None):
         """
         Take an expression and wrap parts that have the "not" operator with
-        grouping chars against the 'all' operator for getSet functions.
+        grouping chars against the 'all' operator for getSet functions. The
+        tokens are read in a single pass, with nested groups kept on a stack.
 
         Args:
             expression      String or List with the expression to process
@@ -297,237 +961,438 @@ class BaseSetExpression(BaseExpression):
         Returns:
             Tuple, where the first element is a List that is a the processed 
             expression, and the second is a List with remaining expression
-            to process (Only really useful when recursing, otherwise is empty)
+            to process (Only really useful when a sub expression name is
+            given, otherwise is empty)
         """
         lhs=[]
         ops=self._allOps()
-        all_name=self.all_name
+        s_exprs=self.operators['sub_expressions']
+        group_start=self.operators['group_start_char']
+        group_end=self.operators['group_end_char']
         if isinstance(expression,str):
             tokens=self._tokenizer(expression)
         else:
             #Assume a List was passed
             tokens=expression
-        sub_expression_ops=self._subExprOps()
-        not_op_set=False
+        all_name=self.all_name
+        s_expr_end=None
         if subExprName:
-            cur_s_expr=self._getSubExprDetail(name=subExprName)
-            all_name=cur_s_expr[3]
-        while tokens:
-            t=tokens.pop(0)
+            all_name=s_exprs[subExprName]['all_name']
+            s_expr_end=s_exprs[subExprName]['end_char']
+        not_op_set=False
+        #all_name, sub expression end and not_op_set of every enclosing group
+        stack=[]
+        pos=0
+        while pos < len(tokens):
+            t=tokens[pos]
+            pos+=1
             if t not in ops:
                 lhs.append(t)
-            else:
-                if t in self.operators['not_operators']:
-                    lhs.append(self.operators['group_start_char'])
-                    lhs.append(all_name)
-                    lhs.append(self.operators['and_operators'][0])
-                    not_op_set=True
-                if t in sub_expression_ops:
-                    #token is part of a sub expression, look up its details
-                    s_expr=self._getSubExprDetail(t)
-                    s_expr_start=s_expr[0]
-                    s_expr_end=s_expr[1]
-                    s_expr_allname=s_expr[3]
-                    s_expr_name=s_expr[4]
-                    #Check if we are currently withing a sub expression:
-                    if subExprName:
-                        s_expr_end=cur_s_expr[1]
-                    if t == s_expr_start:
-                        #Recursion!
-                        lhs.append(t)
-                        rec_result=self._notWrapGrouper(''.join(tokens),subExprName=s_expr_name)
-                        lhs+=rec_result[0]
-                        tokens=rec_result[1]
-                        if not_op_set:
-                            lhs.append(self.operators['group_end_char'])
-                            not_op_set=False
-                        continue
-                    if t == s_expr_end:
-                        lhs.append(t)
-                        break
-                elif t == self.operators['group_start_char']:
-                    #Recursion!
-                    lhs.append(t)
-                    rec_result=self._notWrapGrouper(''.join(tokens),subExprName=subExprName)
-                    lhs+=rec_result[0]
-                    tokens=rec_result[1]
-                    if not_op_set:
-                        lhs.append(self.operators['group_end_char'])
-                        not_op_set=False
-                elif t == self.operators['group_end_char']:
+                continue
+            if t in self.operators['not_operators']:
+                lhs.append(group_start)
+                lhs.append(all_name)
+                lhs.append(self.operators['and_operators'][0])
+                not_op_set=True
+            ends_group=False
+            for sek in s_exprs:
+                if t == s_exprs[sek]['start_char']:
                     lhs.append(t)
+                    stack.append((all_name,s_expr_end,not_op_set))
+                    all_name=s_exprs[sek]['all_name']
+                    s_expr_end=s_exprs[sek]['end_char']
+                    not_op_set=False
                     break
-                else:
-                    lhs.append(t)
+            else:
+                lhs.append(t)
+                if t == group_start:
+                    stack.append((all_name,s_expr_end,not_op_set))
+                    not_op_set=False
+                elif t == group_end or t == s_expr_end:
+                    ends_group=True
+            if not ends_group:
+                continue
+            if not_op_set:
+                lhs.append(group_end)
+            if not stack:
+                return (lhs,tokens[pos:])
+            all_name,s_expr_end,not_op_set=stack.pop()
+            if not_op_set:
+                lhs.append(group_end)
+                not_op_set=False
+        #Close anything left open
+        while stack:
+            if not_op_set:
+                lhs.append(group_end)
+            all_name,s_expr_end,not_op_set=stack.pop()
         if not_op_set:
-            lhs.append(self.operators['group_end_char'])
-            not_op_set=False
-        return(lhs,tokens)
-    def _evalExpression(self,expression,wrap_grouper=True,subExprName=None,recurse_lvl=0):
+            lhs.append(group_end)
+        return (lhs,[])
+    def _leafSet(self,leaf):
         """
-        Evaluate an expression and pass to _combineSets etc...
-        This does all of the heavy lifting and parsing etc...
+        Resolve a Leaf into a Set using getSet, or the function of the sub
+        expression the leaf belongs to.
 
         Args:
-            expresssion     String or List representing the expression to process
-            wrap_grouper    Bool indicating whether or not the expression
-                            should be run through _notWrapGrouper
-            subExprName     String that is the 'name' of the subexpression
-                            to use for getSet function. Mostly used internally
-                            when recursing
-            recurse_lvl     This indicates the depth of the recusion. Only used
-                            internally.
+            leaf    Leaf node
 
         Returns:
-            Tuple, first element is the resulting Set object, second element is
-            a String of any remaning bits of a expression that needs to be
-            processed (only used when recursing because of group operators)
+            Set
         """
-        wrap_group=wrap_grouper
-        sub_expression_ops=self._subExprOps()
-        ops=self._allOps()
-        #indent_str=self._indent_lvl(recurse_lvl)
-        #Convert expression from string to token List if passed as a String
-        if isinstance(expression,str):
-            tokens=self._tokenizer(expression)
+        return self._cached(self._lookupSet,leaf.subexpr,leaf.name)
+    def _leafLookup(self,leaf):
+        return self._rawLookupSet
+    def _prefetchKeys(self,node):
+        """
+        Same as BaseExpression._prefetchKeys, but also includes the whole
+        superset of sub expressions where a negation needs it, IE it isn't
+        part of an intersection with something else to remove it from.
+        """
+        keys=BaseExpression._prefetchKeys(self,node)
+        contexts=set()
+        stack=[(node,None)]
+        while stack:
+            n,parent=stack.pop()
+            if isinstance(n,Not):
+                #In an And the negation is removed from the children before
+                #it, which are already within the superset when one of them
+                #is in the same sub expression
+                if not isinstance(parent,And) or not any(isinstance(s,(Leaf,Not)) and s.subexpr == n.subexpr for s in parent.children[:parent.children.index(n)]):
+                    contexts.add(n.subexpr)
+                stack.append((n.child,n))
+            elif not isinstance(n,Leaf):
+                stack.extend((c,n) for c in n.children)
+        for subExprName in contexts:
+            if subExprName:
+                all_name=self.operators['sub_expressions'][subExprName]['all_name']
+            else:
+                all_name=self.all_name
+            if not any(k[1] == subExprName and k[2] == all_name for k in keys):
+                keys.append((self._rawLookupSet,subExprName,all_name))
+        return keys
+    def _universe(self,subExprName=None):
+        """
+        Args:
+            subExprName     String with the name of the sub expression to get
+                            the whole superset of, or None
+
+        Returns:
+            Set with everything, IE getSet(all_name)
+        """
+        if subExprName:
+            all_name=self.operators['sub_expressions'][subExprName]['all_name']
         else:
-            #Assume a List was passed
-            tokens=expression
-        #Wrap expression in group chars when not operator found
-        if wrap_group:
-            tokens=self._notWrapGrouper(tokens)[0]
-            wrap_group=False
-        lhs=set()
-        last_op=''
-        #Load up subexpression information within recursion
+            all_name=self.all_name
+        return self._cached(self._lookupSet,subExprName,all_name)
+    def _lookupSet(self,subExprName,name):
+        """
+        Look up the Set of a noun, without any caching.
+
+        Args:
+            subExprName     String with the name of the sub expression the
+                            noun belongs to, or None to use getSet
+            name            String with the noun
+
+        Returns:
+            Set
+        """
+        return self._convertLookup(self._rawLookupSet(subExprName,name))
+    def _rawLookupSet(self,subExprName,name):
+        """
+        Same as _lookupSet, without _convertLookup
+        """
         if subExprName:
-            cur_s_expr=self._getSubExprDetail(name=subExprName)
-            getSetFunc=cur_s_expr[2]
-            name_pref=subExprName
+            return self._lookupSubExpr(subExprName,name)
+        return self.getSet(name)
+    def _leafEstimate(self,leaf):
+        """
+        Args:
+            leaf    Leaf node
+
+        Returns:
+            Estimated size of the set of the leaf, or None when unknown
+        """
+        if leaf.subexpr:
+            estimate=self.operators['sub_expressions'][leaf.subexpr].get('estimate')
+            if estimate is None:
+                return None
+            return estimate(leaf.name)
+        return self.estimateSetSize(leaf.name)
+    def _costOrder(self,node):
+        """
+        Plan the evaluation of a set expression. The children of And/Or nodes
+        are reordered so the smallest estimated sets come first, sets without
+        an estimate next, and negations last. That way intersections start
+        from the smallest set, and negations are evaluated as a difference
+        against an already narrowed set, instead of against the whole
+        superset.
+
+        Args:
+            node    Node to plan
+
+        Returns:
+            Tuple, first element is the reordered Node, second is the
+            estimated size of its set or None when unknown
+        """
+        return fold(node,self._costOrderNode)
+    def _costOrderNode(self,node,planned):
+        """
+        Plan a single node for _costOrder.
+
+        Args:
+            node    Node to plan
+            planned List of the _costOrder results of its children
+
+        Returns:
+            Tuple of the reordered Node and its estimated size
+        """
+        if isinstance(node,Leaf):
+            return (node,self._leafEstimate(node))
+        if isinstance(node,Not):
+            return (Not(planned[0][0],node.subexpr),None)
+        planned.sort(key=lambda ne: (isinstance(ne[0],Not),ne[1] is None,ne[1] or 0))
+        estimates=[ ne[1] for ne in planned if not isinstance(ne[0],Not) ]
+        if isinstance(node,And):
+            #An intersection is no bigger than its smallest set
+            known=[ e for e in estimates if e is not None ]
+            estimate=min(known) if known else None
+        elif None in estimates or len(estimates) < len(planned):
+            estimate=None
         else:
-            getSetFunc=self.getSet
-            name_pref='Base'
-        #print("%s%s:tokens=%s" %(indent_str,name_pref,''.join(tokens)))
-        #Loop through all our items
-        while tokens:
-            t=tokens.pop(0)
-            if t not in ops:
-                #token is a name/noun, so convert it to a list, and combine if needed
-                if last_op:
-                    #print("%s%s:Combining left hand side. op=%s, noun=%s" % (indent_str,name_pref,last_op,t))
-                    lhs=self._combineSets(lhs,last_op,getSetFunc(t))
+            estimate=sum(estimates)
+        return (node.__class__([ ne[0] for ne in planned ]),estimate)
+    def _evalNode(self,node,data=None):
+        """
+        Evaluate a node from a compiled expression tree. A negation is the
+        difference between the whole superset and the negated node, unless it
+        is part of an intersection, in which case it is removed directly from
+        the rest of the intersection. Intersections stop as soon as they are
+        empty.
+
+        Args:
+            node    Node to evaluate
+            data    Unused, sets are looked up with getSet
+
+        Returns:
+            Set
+        """
+        if isinstance(node,Leaf):
+            return self._leafSet(node)
+        if isinstance(node,Not):
+            return self._universe(node.subexpr) - self._evalNode(node.child)
+        result=None
+        if isinstance(node,And):
+            #Sub expressions whose superset the result is already within
+            within=set()
+            for c in node.children:
+                if isinstance(c,Not):
+                    if result is None:
+                        result=self._universe(c.subexpr)
+                    elif c.subexpr not in within:
+                        result=result & self._universe(c.subexpr)
+                    within.add(c.subexpr)
+                    result=result - self._evalNegated(c)
+                elif result is None:
+                    result=self._evalNode(c)
                 else:
-                    #print("%s%s:Setting empty left hand side to result of: %s" % (indent_str,name_pref,t))
-                    lhs=getSetFunc(t)
-                continue
+                    result=result & self._evalNode(c)
+                if isinstance(c,Leaf):
+                    within.add(c.subexpr)
+                if not result:
+                    break
+            return result
+        #Intersection of the negated children, by sub expression. !a|!b is
+        #everything but a&b, so each superset is only needed once.
+        negated={}
+        for c in node.children:
+            if isinstance(c,Not):
+                n_result=self._evalNegated(c)
+                if c.subexpr in negated:
+                    n_result=negated[c.subexpr] & n_result
+                negated[c.subexpr]=n_result
+            elif result is None:
+                result=self._evalNode(c)
+            else:
+                result=result | self._evalNode(c)
+        for subExprName,n_result in negated.items():
+            n_result=self._universe(subExprName) - n_result
+            result=n_result if result is None else result | n_result
+        return result
+    def _evalNegated(self,node):
+        """
+        Evaluate the child of a Not that is combined with the other children
+        of an And or Or directly, rather than through the whole superset. The
+        Not is still reported to the tracer, with the Set it stands for.
+
+        Args:
+            node    Not node
+
+        Returns:
+            Set of the child of the Not
+        """
+        tracer=self.tracer
+        if tracer is None:
+            return self._evalNode(node.child)
+        start=_clock()
+        result=self._evalNode(node.child)
+        tracer.record(node,self._universe(node.subexpr) - result,_clock()-start)
+        return result
+    def _evalIterative(self,node,data=None,tracer=None):
+        if tracer is None:
+            tracer=self.tracer
+        timed=tracer is not None
+        #Frames of [node, index of the next child, result, state, start time].
+        #The state is what _evalNode keeps in "within" for an And, and
+        #"negated" for an Or. For a Not that is a child of an And or Or it is
+        #True, and the parent gets the Set of the child of the Not, see
+        #_evalNegated.
+        stack=[[node,0,None,None,timed and _clock()]]
+        value=None
+        while stack:
+            frame=stack[-1]
+            n=frame[0]
+            if isinstance(n,Leaf):
+                value=self._leafSet(n)
+            elif isinstance(n,Not):
+                if not frame[1]:
+                    frame[1]=1
+                    stack.append([n.child,0,None,None,timed and _clock()])
+                    continue
+                if frame[3]:
+                    stack.pop()
+                    if timed:
+                        tracer.record(n,self._universe(n.subexpr) - value,_clock()-frame[4])
+                    continue
+                value=self._universe(n.subexpr) - value
             else:
-                #token is an operator, determine next action
-                if t in sub_expression_ops:
-                    #token is part of a sub expression, look up its details
-                    s_expr=self._getSubExprDetail(t)
-                    s_expr_start=s_expr[0]
-                    s_expr_end=s_expr[1]
-                    s_expr_func=s_expr[2]
-                    s_expr_allname=s_expr[4]
-                    s_expr_name=s_expr[4]
-                    #Check if we are currently withing a sub expression:
-                    if subExprName:
-                        s_expr_end=cur_s_expr[1]
-                    if t == s_expr_start:
-                        #We are at the start of a new sub expression, so recurse appropriately
-                        #print("%s%s:Recursing on subexpression: %s=%s" % (indent_str,name_pref,s_expr_name,t))
-                        rec_result=self._evalExpression(tokens,wrap_grouper=False,subExprName=s_expr_name,recurse_lvl=recurse_lvl+1)
-                        tokens=rec_result[1]
-                        if not lhs:
-                            #print("%s%s:Setting empty left hand side to: %s" % (indent_str,name_pref,rec_result[0]))
-                            lhs=rec_result[0]
-                        elif last_op:
-                            #print("%s%s:Combining left hand side. op=%s, rec_result=%s" % (indent_str,name_pref,last_op,rec_result[0]))
-                            lhs=self._combineSets(lhs,last_op,rec_result[0])
-                            last_op=''
+                i=frame[1]
+                children=n.children
+                if isinstance(n,And):
+                    if i:
+                        #value is the result of the previous child
+                        c=children[i-1]
+                        result=frame[2]
+                        within=frame[3]=frame[3] or set()
+                        if isinstance(c,Not):
+                            if result is None:
+                                result=self._universe(c.subexpr)
+                            elif c.subexpr not in within:
+                                result=result & self._universe(c.subexpr)
+                            within.add(c.subexpr)
+                            result=result - value
+                        elif result is None:
+                            result=value
                         else:
-                            raise RuntimeError("Unknown error after sub expression recursing: cur_tokens %s lhs: %s last_op: %s" % (''.join(tokens),str(lhs),last_op))
-                    if t == s_expr_end:
-                        #Next Operator is the ending of the sub expression
-                        #print("%s%s:Exiting Recursion on subexpression: %s=%s" % (indent_str,name_pref,s_expr_name,t))
-                        return (lhs,tokens)
-                elif t == self.operators['group_start_char']:
-                    #We are at the start of a grouping, begin recursing
-                    #print("%s%s:Recursing on Group operator: %s" % (indent_str,name_pref,t))
-                    rec_result=self._evalExpression(tokens,wrap_grouper=False,subExprName=subExprName,recurse_lvl=recurse_lvl+1)
-                    tokens=rec_result[1]
-                    if not lhs:
-                        #print("%s%s:Setting empty left hand side to: %s" % (indent_str,name_pref,rec_result[0]))
-                        lhs=rec_result[0]
-                    elif last_op:
-                        #print("%s%s:Combining left hand side. op=%s, rec_result=%s" % (indent_str,name_pref,last_op,rec_result[0]))
-                        lhs=self._combineSets(lhs,last_op,rec_result[0])
-                        last_op=''
+                            result=result & value
+                        if isinstance(c,Leaf):
+                            within.add(c.subexpr)
+                        frame[2]=result
+                        if not result:
+                            i=len(children)
+                elif i:
+                    c=children[i-1]
+                    if isinstance(c,Not):
+                        negated=frame[3]=frame[3] or {}
+                        if c.subexpr in negated:
+                            value=negated[c.subexpr] & value
+                        negated[c.subexpr]=value
+                    elif frame[2] is None:
+                        frame[2]=value
                     else:
-                        raise RuntimeError("Unknown error after group recursing: cur_tokens %s lhs: %s last_op: %s" % (''.join(tokens),str(lhs),last_op))
-                elif t == self.operators['group_end_char']:
-                    #Next token is the ending of a group
-                    #print("%s%s:Exiting recursion on Group operator: %s" % (indent_str,name_pref,t))
-                    return(lhs,tokens)
-                else:
-                    #Token is a verb operator
-                    last_op=t
+                        frame[2]=frame[2] | value
+                if i < len(children):
+                    frame[1]=i+1
+                    c=children[i]
+                    stack.append([c,0,None,isinstance(c,Not),timed and _clock()])
                     continue
-        return (lhs,tokens)
+                value=frame[2]
+                if isinstance(n,Or) and frame[3]:
+                    for subExprName,n_result in frame[3].items():
+                        n_result=self._universe(subExprName) - n_result
+                        value=n_result if value is None else value | n_result
+            stack.pop()
+            if timed:
+                tracer.record(n,value,_clock()-frame[4])
+        return value
+    def _evalExpression(self,expression,wrap_grouper=True,subExprName=None,recurse_lvl=0):
+        """
+        Evaluate an expression. This compiles the expression and evaluates the
+        result, use compile() directly to avoid parsing the same expression
+        multiple times.
+
+        Args:
+            expresssion     String or List representing the expression to process
+            wrap_grouper    Unused, kept for backwards compatibility
+            subExprName     String that is the 'name' of the subexpression
+                            to use for getSet function.
+            recurse_lvl     Unused, kept for backwards compatibility
+
+        Returns:
+            Tuple, first element is the resulting Set object, second element is
+            an empty list of remaining tokens
+        """
+        root=self._parse(expression,subExprName=subExprName)
+        return (self._evaluate(root),[])
+    def processExpression(self,expression):
+        """
+        Compiles the expression (reusing an earlier compile of the same
+        expression when possible) and returns the resulting Set. This is the
+        primary function that should be used.
+
+        Args:
+            expression      String representing an expression to process
+
+        Returns:
+            Set from the results of processing.
+        """
+        return self._result(self._compileCached(expression).evaluate())
     def extractNames(self,expression,wrap_grouper=True,subexpr=None,recurse_leaf=False):
         """
-        Take an expression and extract all the nouns out of it
+        Take an expression and extract all the nouns out of it, grouped by
+        the sub expression they belong to. This is the same grouping batch
+        functions of sub expressions are called with.
 
         Args:
             expression      String or List with the expression to extract nouns
                             from
+            wrap_grouper    Unused, kept for backwards compatibility
+            subexpr         String with the start or end operator of the sub
+                            expression the expression belongs to, or None
+            recurse_leaf    Unused, kept for backwards compatibility
 
         Returns:
-            List where each element is a noun
+            Dict of sub expression name to a List of nouns, in the order they
+            appear in the expression. Nouns that are not in a sub expression
+            are under 'def'.
         """
-        nouns={}
-        ops=self._allOps()
-        subexp_ops=self._subExprOps()
-        sub_expr_detail=None
+        subExprName=None
+        if subexpr:
+            subExprName=self._getSubExprDetail(subexpr)[3]
         #Convert expression from string to token List if passed as a String
         if isinstance(expression,str):
             tokens=self._tokenizer(expression)
         else:
             #Assume a List was passed
             tokens=expression
-        if not recurse_leaf:
-            cur_name='def'
-            nouns[cur_name]=[]
-        if subexpr:
-            sub_expr_detail=self._getSubExprDetail(subexpr)
-            cur_name=sub_expr_detail[4]
-            nouns[cur_name]=[]
-        if wrap_grouper:
-            tokens=self._notWrapGrouper(tokens)[0]
-        while tokens:
-            t=tokens.pop(0)
-            if t not in ops:
-                nouns[cur_name].append(t)
-            else:
-                if t not in subexp_ops:
-                    continue
-                else:
-                    if subexpr:
-                        #We are inside a subexpr check if we are at the end of our recursion
-                        if t == sub_expr_detail[1]: #second elem is the end char
-                            #End of expression, return
-                            return (nouns,tokens)
-                    #Must be at a new subexpression, recurse
-                    results=self.extractNames(tokens,wrap_grouper=False,subexpr=t,recurse_leaf=True)
-                    #Add in the found noun to our master list
-                    for kn in results[0].keys():
-                        try:
-                            nouns[kn]+=results[0][kn]
-                        except KeyError:
-                            nouns[kn]=[]
-                            nouns[kn]+=results[0][kn]
-                    tokens=results[1]
+        nouns={'def': []}
+        root=self._parseTokens(iter(tokens),subExprName=subExprName)
+        if root is not None:
+            for leaf in iter_leaves(root):
+                nouns.setdefault(leaf.subexpr or 'def',[]).append(leaf.name)
         return nouns
+    def estimateSetSize(self,name):
+        """
+        Optional hook for subclasses, used to plan the order sets are
+        combined in.
+
+        Args:
+            name    Name that would be passed to getSet
+
+        Returns:
+            Int with the estimated size of the set getSet would return, or
+            None when unknown
+        """
+        return None
     def getSet(self,name):
         """
         Returns a Set with the give name as the argument
@@ -555,7 +1420,9 @@ class BaseConditionalExpression(BaseExpression):
         Returns:
             Bool that is the result combining the two values.
         """
-        self.logger.debug("_combineVals opts: {} {} {}".format(left,op,right))
+        debug=self.logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            self.logger.debug("_combineVals opts: {} {} {}".format(left,op,right))
         if op in self.operators['and_operators']:
             result=left and right
         elif op in self.operators['or_operators']:
@@ -564,125 +1431,280 @@ class BaseConditionalExpression(BaseExpression):
             result=left != right
         else:
             raise ValueError("Unknown operator: {}".format(op))
-        self.logger.debug("_combineVals returning: {}".format(result))
+        if debug:
+            self.logger.debug("_combineVals returning: {}".format(result))
+        return result
+    def _leafVal(self,leaf,data=None):
+        """
+        Resolve the value of a Leaf, using getVal or the function of the sub
+        expression the leaf belongs to.
+
+        Args:
+            leaf    Leaf node
+            data    Data the expression is being evaluated against
+
+        Returns:
+            Bool
+        """
+        if leaf.subexpr:
+            return self._cached(self._lookupSubExpr,leaf.subexpr,leaf.name)
+        return self._cached(self._lookupVal,None,leaf.name)
+    def _lookupVal(self,subExprName,name):
+        """
+        Args:
+            subExprName     Unused, always None
+            name            String with the noun
+
+        Returns:
+            Result of getVal
+        """
+        return self.getVal(name)
+    def _leafLookup(self,leaf):
+        if leaf.subexpr:
+            return self._lookupSubExpr
+        return self._lookupVal
+    def _result(self,value):
+        return bool(value)
+    def _leafKey(self,leaf):
+        """
+        Args:
+            leaf    Leaf node
+
+        Returns:
+            The key that must be present in the data for the leaf to be
+            true, or None when it isn't known
+        """
+        return None
+    def _leafDependsOn(self,leaf,key):
+        """
+        Args:
+            leaf    Leaf node that has no single key (see _leafKey)
+            key     Key of the data that changed
+
+        Returns:
+            Bool, False only when the change can't affect the result of the
+            leaf
+        """
+        return not leaf.subexpr
+    def requiredKeys(self,node):
+        """
+        Work out the keys that must be present in the data for a compiled
+        expression to have any chance of being true. Every key of an And is
+        required, only the keys shared by all children of an Or are, and a
+        Not can be true without any keys.
+
+        Args:
+            node    Node or CompiledExpression
+
+        Returns:
+            Frozenset of keys
+        """
+        if isinstance(node,CompiledExpression):
+            node=node.root
+        return fold(node,self._requiredKeysNode)
+    def _requiredKeysNode(self,node,keys):
+        """
+        Args:
+            node    Node
+            keys    List of the required keys of its children
+
+        Returns:
+            Frozenset of the keys the node requires
+        """
+        if isinstance(node,Leaf):
+            key=self._leafKey(node)
+            if key is None:
+                return frozenset()
+            return frozenset((key,))
+        if isinstance(node,Not):
+            return frozenset()
+        if isinstance(node,And):
+            return frozenset().union(*keys)
+        return frozenset.intersection(*keys)
+    def _evalNode(self,node,data=None):
+        """
+        Evaluate a node from a compiled expression tree
+
+        Args:
+            node    Node to evaluate
+            data    Data the leaves are evaluated against
+
+        Returns:
+            Bool
+        """
+        if isinstance(node,Leaf):
+            return self._leafVal(node,data)
+        if isinstance(node,Not):
+            return not self._evalNode(node.child,data)
+        #Stop as soon as the result can't change
+        if isinstance(node,And):
+            for c in node.children:
+                if not self._evalNode(c,data):
+                    return False
+            return True
+        for c in node.children:
+            if self._evalNode(c,data):
+                return True
+        return False
+    def _sourceName(self,namespace,value):
+        """
+        Add a value to the namespace generated source is run in.
+
+        Args:
+            namespace   Dict of the globals for the generated source
+            value       Object the source needs to refer to
+
+        Returns:
+            String with the name of the value in the namespace
+        """
+        name='_c{}'.format(len(namespace))
+        namespace[name]=value
+        return name
+    def _leafSource(self,leaf,namespace):
+        """
+        Generate the Python source of a leaf for _function. Subclasses can
+        override this to inline the work of _leafVal. The data is in the
+        variable "d".
+
+        Args:
+            leaf        Leaf node
+            namespace   Dict of the globals for the generated source
+
+        Returns:
+            String with a Python expression that evaluates to a Bool
+        """
+        return 'bool({}({},d))'.format(self._sourceName(namespace,self._leafVal),self._sourceName(namespace,leaf))
+    def _nodeSource(self,node,namespace):
+        """
+        Generate the Python source of a node and everything under it.
+
+        Args:
+            node        Node
+            namespace   Dict of the globals for the generated source
+
+        Returns:
+            String with a Python expression that evaluates to a Bool
+        """
+        def source(n,children):
+            if isinstance(n,Leaf):
+                return self._leafSource(n,namespace)
+            if isinstance(n,Not):
+                return '(not {})'.format(children[0])
+            if isinstance(n,And):
+                return '({})'.format(' and '.join(children))
+            return '({})'.format(' or '.join(children))
+        return fold(node,source)
+    def _function(self,node):
+        """
+        Generate the source of a Python function that evaluates a node, with
+        native and/or/not short-circuiting, and compile it. Trees deeper than
+        max_recursion_depth, or too deep for the Python compiler, fall back to
+        a function using _evalRoot. Building the source takes memory that
+        grows with the square of the depth, so deep trees skip it entirely.
+
+        Args:
+            node    Node to generate the function of
+
+        Returns:
+            Function taking the data to evaluate against and returning a Bool.
+            The generated source is in its "source" attribute, None for the
+            fallback.
+        """
+        if node.depth <= self.max_recursion_depth:
+            namespace={}
+            try:
+                source='def expression(d):\n    return {}\n'.format(self._nodeSource(node,namespace))
+                code=compile(source,'<expressionizer>','exec')
+            except (SyntaxError,RecursionError,MemoryError):
+                pass
+            else:
+                exec(code,namespace)
+                function=namespace['expression']
+                function.source=source
+                return function
+        evalRoot=self._evalRoot
+        function=lambda d: bool(evalRoot(node,d))
+        function.source=None
+        return function
+    def compileFunction(self,expression):
+        """
+        Compile an expression into a generated Python function, the fastest
+        way to evaluate it over and over again. Functions are cached per
+        expression string. Tracers are not called by generated functions.
+
+        Args:
+            expression      String representing an expression to compile
+
+        Returns:
+            Function taking the data to evaluate against, IE a flat dict, and
+            returning a Bool
+        """
+        return self._compileCached(expression).as_function()
+    def _evalIterative(self,node,data=None,tracer=None):
+        if tracer is None:
+            tracer=self.tracer
+        timed=tracer is not None
+        #Frames of [node, index of the next child, start time]
+        stack=[[node,0,timed and _clock()]]
+        result=None
+        while stack:
+            frame=stack[-1]
+            n=frame[0]
+            if isinstance(n,Leaf):
+                result=self._leafVal(n,data)
+            elif isinstance(n,Not):
+                if not frame[1]:
+                    frame[1]=1
+                    stack.append([n.child,0,timed and _clock()])
+                    continue
+                result=not result
+            else:
+                i=frame[1]
+                is_and=isinstance(n,And)
+                if i and bool(result) != is_and:
+                    #A false child of an And, or a true child of an Or
+                    result=not is_and
+                elif i < len(n.children):
+                    frame[1]=i+1
+                    stack.append([n.children[i],0,timed and _clock()])
+                    continue
+                else:
+                    result=is_and
+            stack.pop()
+            if timed:
+                tracer.record(n,result,_clock()-frame[2])
         return result
     def _evalExpression(self,expression,subExprName=None,recurse_lvl=0):
         """
-        Evaluate an expression and pass to _combineVals etc...
-        This does all of the heavy lifting and parsing etc...
+        Evaluate an expression. This compiles the expression and evaluates the
+        result, use compile() directly to avoid parsing the same expression
+        multiple times.
 
         Args:
             expresssion     String or List representing the expression to process
             subExprName     String that is the 'name' of the subexpression
-                            to use for getVal function. Mostly used internally
-                            when recursing
-            recurse_lvl     This indicates the depth of the recusion. Only used
-                            internally.
+                            to use for getVal function.
+            recurse_lvl     Unused, kept for backwards compatibility
 
         Returns:
             Tuple, first element is the resulting Bool object, second element is
-            a String of any remaning bits of an expression that needs to be
-            processed (only used when recursing because of group operators)
+            an empty list of remaining tokens
         """
-        sub_expression_ops=self._subExprOps()
-        ops=self._allOps()
-        indent_str=self._indent_lvl(recurse_lvl)
-        #Convert expression from string to token List if passed as a String
-        if isinstance(expression,str):
-            tokens=self._tokenizer(expression)
-        else:
-            #Assume a List was passed
-            tokens=expression
-        lhs=None
-        last_op=''
-        #Load up subexpression information within recursion
-        if subExprName:
-            cur_s_expr=self._getSubExprDetail(name=subExprName)
-            getValFunc=cur_s_expr[2]
-            name_pref=subExprName
-        else:
-            getValFunc=self.getVal
-            name_pref='Base'
-        #self.logger.debug("{}{}:tokens={}".format(indent_str,name_pref,tokens))
-        #Loop through all our items
-        while tokens:
-            t=tokens.pop(0)
-            if t not in ops:
-                #token is a name/noun, so get the value, and combine if needed
-                if last_op:
-                    self.logger.debug("{}{}:Combining left hand side. lhs={}, op={}, noun={}".format(indent_str,name_pref,lhs,last_op,t))
-                    lhs=self._combineVals(lhs,last_op,getValFunc(t))
-                else:
-                    self.logger.debug("{}{}:Setting empty left hand side to result of: {}".format(indent_str,name_pref,t))
-                    lhs=getValFunc(t)
-                continue
-            else:
-                #token is an operator, determine next action
-                if t in sub_expression_ops:
-                    #token is part of a sub expression, look up its details
-                    s_expr=self._getSubExprDetail(t)
-                    s_expr_start=s_expr[0]
-                    s_expr_end=s_expr[1]
-                    s_expr_func=s_expr[2]
-                    s_expr_allname=s_expr[4]
-                    s_expr_name=s_expr[4]
-                    #Check if we are currently withing a sub expression:
-                    if subExprName:
-                        s_expr_end=cur_s_expr[1]
-                    if t == s_expr_start:
-                        #We are at the start of a new sub expression, so recurse appropriately
-                        self.logger.debug("{}{}: Recursing on subexpression: {}={}".format(indent_str,name_pref,s_expr_name,t))
-                        rec_result=self._evalExpression(tokens,subExprName=s_expr_name,recurse_lvl=recurse_lvl+1)
-                        tokens=rec_result[1]
-                        if not lhs:
-                            self.logger.debug("{}{}: Setting empty left hand side to: {}".format(indent_str,name_pref,rec_result[0]))
-                            lhs=rec_result[0]
-                        elif last_op:
-                            self.logger.debug("{}{}: Combining left hand side. op={}, rec_result={}".format(indent_str,name_pref,last_op,rec_result[0]))
-                            lhs=self._combineVals(lhs,last_op,rec_result[0])
-                            last_op=None
-                        else:
-                            raise RuntimeError("Unknown error after sub expression recursing: cur_tokens {} lhs: {} last_op: {}".format(tokens,lhs,last_op))
-                    if t == s_expr_end:
-                        #Next Operator is the ending of the sub expression
-                        self.logger.debug("{}{}: Exiting Recursion on subexpression: {}={}".format(indent_str,name_pref,s_expr_name,t))
-                        return (lhs,tokens)
-                elif t == self.operators['group_start_char']:
-                    #We are at the start of a grouping, begin recursing
-                    self.logger.debug("{}{}: Recursing on Group operator: {}".format(indent_str,name_pref,t))
-                    rec_result=self._evalExpression(tokens,subExprName=subExprName,recurse_lvl=recurse_lvl+1)
-                    tokens=rec_result[1]
-                    if not lhs:
-                        self.logger.debug("{}{}:Setting empty left hand side to: {}".format(indent_str,name_pref,rec_result[0]))
-                        lhs=rec_result[0]
-                    elif last_op:
-                        self.logger.debug("{}{}:Combining left hand side. op={}, rec_result={}".format(indent_str,name_pref,last_op,rec_result[0]))
-                        lhs=self._combineVals(lhs,last_op,rec_result[0])
-                        last_op=None
-                    else:
-                        raise RuntimeError("Unknown error after group recursing: cur_tokens {} lhs: {} last_op: {}".format(tokens,lhs,last_op))
-                elif t == self.operators['group_end_char']:
-                    #Next token is the ending of a group
-                    self.logger.debug("{}{}: Exiting recursion on Group operator: {}".format(indent_str,name_pref,t))
-                    return(lhs,tokens)
-                else:
-                    #Token is a verb operator
-                    last_op=t
-                    continue
-        return (lhs,tokens)
+        root=self._parse(expression,subExprName=subExprName)
+        return (bool(self._evaluate(root)),[])
     def processExpression(self,expression):
         """
-        This uses _evalExpression to return the resulting Set. This is the
-        primary function that should be used.
+        Compiles the expression (reusing an earlier compile of the same
+        expression when possible) and returns the result of evaluating it.
+        This is the primary function that should be used.
 
         Args:
             expression      String representing an expression to process
 
         Returns:
-            Set from the results of processing.
+            Bool from the results of processing.
         """
-        result=self._evalExpression(expression)
-        return result[0]
+        return self._result(self._compileCached(expression).evaluate())
     def getVal(self,name):
         """
         Returns a Set with the give name as the argument
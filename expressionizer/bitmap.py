@@ -0,0 +1,203 @@
+"""
+Bitmap backed set expressions, for universes too big to handle as Python
+sets.
+
+Members are given an integer id by a MemberIndex, and a set of members is
+stored as a Bitmap where bit N is set when the member with id N is in the
+set. AND, OR and NOT are done a machine word at a time on the bitmaps, and
+only the final result is turned back into member names.
+"""
+from .base import BaseSetExpression
+
+try:
+    _popcount=int.bit_count
+except AttributeError:
+    def _popcount(bits):
+        return bin(bits).count('1')
+
+class Bitmap(object):
+    """
+    An immutable set of integer ids, stored as the bits of a single integer.
+
+    Args:
+        bits        Int where bit N is set when id N is in the set
+    """
+    __slots__=('bits',)
+    def __init__(self,bits=0):
+        self.bits=bits
+    @classmethod
+    def fromIds(cls,ids):
+        """
+        Args:
+            ids     Iterable of non negative Ints
+
+        Returns:
+            Bitmap with every id set
+        """
+        data=bytearray()
+        for i in ids:
+            byte=i >> 3
+            if byte >= len(data):
+                data.extend(bytes(byte-len(data)+1))
+            data[byte]|=1 << (i & 7)
+        return cls(int.from_bytes(bytes(data),'little'))
+    def __and__(self,other):
+        return Bitmap(self.bits & other.bits)
+    def __or__(self,other):
+        return Bitmap(self.bits | other.bits)
+    def __sub__(self,other):
+        return Bitmap(self.bits & ~other.bits)
+    def __xor__(self,other):
+        return Bitmap(self.bits ^ other.bits)
+    def __len__(self):
+        return _popcount(self.bits)
+    def __bool__(self):
+        return self.bits != 0
+    def __contains__(self,i):
+        return (self.bits >> i) & 1 == 1
+    def __iter__(self):
+        """
+        Yields the ids in the set, lowest first
+        """
+        #Least significant bit first, without the '0b' prefix
+        bit_str=bin(self.bits)[:1:-1]
+        i=bit_str.find('1')
+        while i >= 0:
+            yield i
+            i=bit_str.find('1',i+1)
+    def __eq__(self,other):
+        return isinstance(other,Bitmap) and self.bits == other.bits
+    def __ne__(self,other):
+        return not self.__eq__(other)
+    def __hash__(self):
+        return hash(self.bits)
+    def __repr__(self):
+        return "Bitmap(len={})".format(len(self))
+
+class MemberIndex(object):
+    """
+    A dictionary of member names to integer ids, used to translate between
+    sets of members and Bitmaps.
+
+    Args:
+        members     Iterable of member names to add up front
+    """
+    def __init__(self,members=None):
+        self._ids={}
+        self._members=[]
+        if members:
+            for m in members:
+                self.add(m)
+    def __len__(self):
+        return len(self._members)
+    def __contains__(self,member):
+        return member in self._ids
+    def add(self,member):
+        """
+        Give a member an id, if it doesn't have one already.
+
+        Args:
+            member      Hashable member name
+
+        Returns:
+            Int id of the member
+        """
+        try:
+            return self._ids[member]
+        except KeyError:
+            i=self._ids[member]=len(self._members)
+            self._members.append(member)
+            return i
+    def bitmap(self,members):
+        """
+        Args:
+            members     Iterable of member names. Members without an id are
+                        added to the index.
+
+        Returns:
+            Bitmap of the members
+        """
+        return Bitmap.fromIds(self.add(m) for m in members)
+    def names(self,bitmap):
+        """
+        Args:
+            bitmap      Bitmap of member ids
+
+        Returns:
+            Set of the member names in the bitmap
+        """
+        members=self._members
+        return set(members[i] for i in bitmap)
+    def universe(self):
+        """
+        Returns:
+            Bitmap of every member in the index
+        """
+        return Bitmap((1 << len(self._members))-1)
+
+class BitmapSetExpression(BaseSetExpression):
+    """
+    Extends BaseSetExpression to combine Bitmaps instead of Python sets.
+
+    getSet (and sub expression functions) can return either a Bitmap of ids
+    from the index, or any iterable of member names which is converted with
+    the index. processExpression returns a Set of member names, and
+    processExpressionBitmap returns the Bitmap without converting it.
+
+    For example:
+        class Hosts(BitmapSetExpression):
+            def getSet(self,name):
+                if name == self.all_name:
+                    return self.index.universe()
+                return self.index.bitmap(lookup_hosts(name))
+
+    Args:
+        index           MemberIndex to translate member names with, a new
+                        empty one is used by default
+        operators       Dict of operators
+        all_name        String that is the noun for the whole superset
+        logger          Logger to use
+    """
+    def __init__(self,index=None,operators=None,all_name=None,logger=None):
+        BaseSetExpression.__init__(self,operators=operators,all_name=all_name,logger=logger)
+        if index is None:
+            index=MemberIndex()
+        self.index=index
+    def _asBitmap(self,value):
+        """
+        Args:
+            value       Bitmap, or iterable of member names
+
+        Returns:
+            Bitmap
+        """
+        if isinstance(value,Bitmap):
+            return value
+        return self.index.bitmap(value)
+    def _convertLookup(self,value):
+        return self._asBitmap(value)
+    def processExpressionBitmap(self,expression):
+        """
+        Same as processExpression, but returns the resulting Bitmap instead
+        of converting it to member names.
+
+        Args:
+            expression      String representing an expression to process
+
+        Returns:
+            Bitmap
+        """
+        return self._compileCached(expression).evaluate()
+    def _result(self,value):
+        return self.index.names(value)
+    def processExpression(self,expression):
+        """
+        Process an expression and convert the result to member names.
+
+        Args:
+            expression      String representing an expression to process
+
+        Returns:
+            Set of member names
+        """
+        return self._result(self.processExpressionBitmap(expression))
@@ -0,0 +1,69 @@
+"""
+Limits on how long a single evaluation may take.
+
+A Budget is passed to CompiledExpression.evaluate or RuleSet.match, and is
+charged for every node evaluated. Once it runs out, EvaluationTimeout is
+raised instead of a result.
+
+For example:
+    budget=Budget(seconds=0.01,operations=10000)
+    try:
+        result=compiled.evaluate(flat_dict,budget=budget)
+    except EvaluationTimeout as e:
+        log.warning("Gave up on %s: %s",compiled,e)
+
+The budget is only checked between nodes, so it can't interrupt a single slow
+lookup or regular expression. See FlatDictExpression.safe_regex for keeping
+"~" comparisons fast.
+"""
+from .trace import Tracer, _clock
+
+class EvaluationTimeout(Exception):
+    """
+    Raised when an evaluation runs out of its Budget.
+
+    Args:
+        operations  Int with the number of nodes evaluated
+        elapsed     Float with the seconds the evaluation ran for
+    """
+    def __init__(self,operations,elapsed):
+        Exception.__init__(self,"Evaluation ran out of its budget after {} operations and {:.6f} seconds".format(operations,elapsed))
+        self.operations=operations
+        self.elapsed=elapsed
+
+class Budget(Tracer):
+    """
+    A time limit and/or a limit on the number of nodes evaluated, for one
+    evaluation at a time. The budget starts over at the beginning of every
+    evaluation it is given to, so it can be reused, but not shared between
+    threads.
+
+    Args:
+        seconds     Number of seconds an evaluation may take, or None
+        operations  Int with the max number of nodes an evaluation may
+                    evaluate, or None
+        clock       Function returning the current time in seconds, mostly
+                    useful for testing
+    """
+    def __init__(self,seconds=None,operations=None,clock=None):
+        self.seconds=seconds
+        self.operations=operations
+        self.clock=clock or _clock
+        self.start()
+    def start(self):
+        """
+        Start a new evaluation, with the whole budget available
+        """
+        self.spent=0
+        self.started=self.clock()
+        self.deadline=None
+        if self.seconds is not None:
+            self.deadline=self.started+self.seconds
+    def record(self,node,result,elapsed):
+        self.spent+=1
+        if self.operations is not None and self.spent > self.operations:
+            raise EvaluationTimeout(self.spent,self.clock()-self.started)
+        if self.deadline is not None:
+            now=self.clock()
+            if now > self.deadline:
+                raise EvaluationTimeout(self.spent,now-self.started)
@@ -0,0 +1,252 @@
+"""
+Bundles of precompiled expressions, saved to a binary file so processes can
+load their rules at startup without parsing them again.
+
+For example:
+    #At build time
+    rules=RuleSet(load_rule_catalogue())
+    save_bundle(rules,'rules.bundle')
+    #In every worker
+    rules=load_bundle('rules.bundle')
+
+A bundle holds the parsed trees, including the precompiled comparison
+operands of the leaves, but not the expression object. It is given to
+load_bundle instead, and must be of the same class the bundle was saved
+with, since the class decides how the leaves were parsed.
+
+Bundles start with a header carrying a format number, the version of
+expressionizer that wrote them, the attributes of every class of node in
+them and a checksum of the contents. Bundles from another version, with
+nodes laid out differently than the classes now are, or that are damaged,
+are rejected with a ValueError rather than misread. The contents are
+pickled, so only load bundles from a trusted source.
+
+A WatchedRuleSet is saved along with the dict it watches, and is evaluated
+against it again when loaded.
+"""
+import importlib
+import json
+import pickle
+import struct
+import zlib
+from .compiled import CompiledExpression, Leaf, Not, iter_leaves, _flatten, _unflatten
+from .rules import RuleSet, WatchedRuleSet
+
+#Magic bytes every bundle starts with, and the version of the layout after it
+BUNDLE_MAGIC=b'EXPRBNDL'
+BUNDLE_FORMAT=3
+#Format number, length of the JSON metadata and CRC32 of the pickled contents
+_header=struct.Struct('>HII')
+
+def _className(obj):
+    cls=obj.__class__
+    return '{}.{}'.format(cls.__module__,cls.__name__)
+
+def _slots(cls):
+    """
+    Args:
+        cls     Node class
+
+    Returns:
+        List of the attributes of the class and the classes it inherits from
+    """
+    slots=[]
+    for c in reversed(cls.__mro__):
+        slots.extend(c.__dict__.get('__slots__',()))
+    return slots
+
+def _layout(roots):
+    """
+    Args:
+        roots       Iterable of root nodes
+
+    Returns:
+        Dict of the name of every class of node under the roots to the List
+        of its attributes
+    """
+    classes=set()
+    seen=set()
+    stack=list(roots)
+    while stack:
+        node=stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        classes.add(node.__class__)
+        if isinstance(node,Not):
+            stack.append(node.child)
+        elif not isinstance(node,Leaf):
+            stack.extend(node.children)
+    return dict(('{}.{}'.format(cls.__module__,cls.__name__),_slots(cls)) for cls in classes)
+
+def _checkLayout(layout):
+    """
+    Check that the node classes of a bundle still have the attributes they
+    were saved with.
+
+    Args:
+        layout      Dict from _layout
+    """
+    for name,slots in sorted(layout.items()):
+        module,cls_name=name.rsplit('.',1)
+        try:
+            cls=getattr(importlib.import_module(module),cls_name)
+        except (ImportError,AttributeError):
+            raise ValueError("Bundle uses the node class {}, which can't be imported".format(name))
+        if _slots(cls) != slots:
+            raise ValueError("Bundle was saved with a different layout of {}, it has to be saved again".format(name))
+
+def _recompileRegexes(expression,roots):
+    """
+    Compile the "~" operands of a bundle again, when the expression has
+    safe_regex set. They were pickled already compiled, so they haven't been
+    checked for it.
+
+    Args:
+        expression  Expression object the bundle is loaded with
+        roots       Iterable of root nodes
+
+    Raises:
+        ValueError when one of the regular expressions isn't safe
+    """
+    if not getattr(expression,'safe_regex',False):
+        return
+    for root in roots:
+        for leaf in iter_leaves(root):
+            if getattr(leaf,'op',None) == '~':
+                leaf.operand=expression._compileOperand(leaf.op,leaf.value)
+
+def save_bundle(target,dest):
+    """
+    Save parsed expressions to a bundle file.
+
+    Args:
+        target      RuleSet, CompiledExpression, or a Dict of names to
+                    CompiledExpressions. Every CompiledExpression must have
+                    the same evaluator class.
+        dest        String with the path to write to, or a binary file object
+    """
+    from . import __version__
+    if isinstance(target,RuleSet):
+        kind='rules'
+        expression=target.expression
+        rules=target.rules
+        order=sorted(rules,key=target._order.__getitem__)
+        #Arguments the RuleSet is created with again when loading
+        state={}
+        if isinstance(target,WatchedRuleSet):
+            state['data']=target.data
+        #The shared nodes are saved once each as a flat list, which trees of
+        #any depth can be pickled as, and the required keys are saved as
+        #well, so loading doesn't have to work them out again
+        records,indexes=_flatten([ rules[rule_id] for rule_id in order ])
+        contents=(target.__class__,state,records,[ (rule_id,index,target._required[rule_id]) for rule_id,index in zip(order,indexes) ])
+        roots=rules.values()
+    elif isinstance(target,CompiledExpression):
+        kind='compiled'
+        expression=target.evaluator
+        contents=(target.expression,target.root)
+        roots=[target.root]
+    elif isinstance(target,dict):
+        kind='compiled_dict'
+        expression=None
+        contents=[]
+        for name,compiled in target.items():
+            if not isinstance(compiled,CompiledExpression):
+                raise TypeError("Can only bundle CompiledExpressions: {!r}".format(compiled))
+            if expression is None:
+                expression=compiled.evaluator
+            elif _className(compiled.evaluator) != _className(expression):
+                raise ValueError("Compiled expressions in a bundle must have the same evaluator class, {} is a {}".format(name,_className(compiled.evaluator)))
+            contents.append((name,compiled.expression,compiled.root))
+        roots=[ root for name,s,root in contents ]
+    else:
+        raise TypeError("Can only bundle a RuleSet, CompiledExpression or Dict of CompiledExpressions: {!r}".format(target))
+    meta={
+        'version': __version__,
+        'kind': kind,
+        'expression': _className(expression) if expression is not None else None,
+        'layout': _layout(roots),
+    }
+    meta=json.dumps(meta,sort_keys=True).encode('utf-8')
+    payload=pickle.dumps(contents,pickle.HIGHEST_PROTOCOL)
+    data=BUNDLE_MAGIC+_header.pack(BUNDLE_FORMAT,len(meta),zlib.crc32(payload) & 0xffffffff)+meta+payload
+    if isinstance(dest,str):
+        with open(dest,'wb') as f:
+            f.write(data)
+    else:
+        dest.write(data)
+
+def _readHeader(data):
+    """
+    Check the header of a bundle.
+
+    Args:
+        data        Bytes of the whole bundle
+
+    Returns:
+        Tuple of the metadata Dict and the pickled contents
+    """
+    from . import __version__
+    start=len(BUNDLE_MAGIC)
+    if data[:start] != BUNDLE_MAGIC or len(data) < start+_header.size:
+        raise ValueError("Not an expressionizer bundle")
+    bundle_format,meta_len,checksum=_header.unpack_from(data,start)
+    if bundle_format != BUNDLE_FORMAT:
+        raise ValueError("Unsupported bundle format {}, expected {}".format(bundle_format,BUNDLE_FORMAT))
+    start+=_header.size
+    try:
+        meta=json.loads(data[start:start+meta_len].decode('utf-8'))
+    except ValueError:
+        raise ValueError("Bundle metadata is damaged")
+    if meta.get('version') != __version__:
+        raise ValueError("Bundle was saved by expressionizer {}, this is {}".format(meta.get('version'),__version__))
+    payload=data[start+meta_len:]
+    if zlib.crc32(payload) & 0xffffffff != checksum:
+        raise ValueError("Bundle contents are damaged, the checksum doesn't match")
+    return (meta,payload)
+
+def load_bundle(source,expression=None):
+    """
+    Load the parsed expressions of a bundle file.
+
+    Args:
+        source      String with the path to read from, or a binary file
+                    object
+        expression  Expression object to evaluate with, of the class the
+                    bundle was saved with. Defaults to a FlatDictExpression.
+
+    Returns:
+        What was saved: a RuleSet (of the same class), CompiledExpression, or
+        Dict of names to CompiledExpressions
+    """
+    if isinstance(source,str):
+        with open(source,'rb') as f:
+            data=f.read()
+    else:
+        data=source.read()
+    meta,payload=_readHeader(data)
+    if expression is None:
+        from .expressions import FlatDictExpression
+        expression=FlatDictExpression()
+    if meta['expression'] is not None and meta['expression'] != _className(expression):
+        raise ValueError("Bundle was saved for a {}, can't load it with a {}".format(meta['expression'],_className(expression)))
+    _checkLayout(meta['layout'])
+    contents=pickle.loads(payload)
+    kind=meta['kind']
+    if kind == 'rules':
+        cls,state,records,rules=contents
+        nodes=_unflatten(records)
+        _recompileRegexes(expression,[ nodes[index] for rule_id,index,required in rules ])
+        rule_set=cls(expression=expression,**state)
+        rule_set._setNodes(nodes)
+        for rule_id,index,required in rules:
+            rule_set._addRoot(rule_id,nodes[index],required)
+        return rule_set
+    if kind == 'compiled':
+        _recompileRegexes(expression,[contents[1]])
+        return CompiledExpression(contents[0],contents[1],expression)
+    if kind == 'compiled_dict':
+        _recompileRegexes(expression,[ root for name,s,root in contents ])
+        return dict((name,CompiledExpression(s,root,expression)) for name,s,root in contents)
+    raise ValueError("Unknown kind of bundle: {}".format(kind))
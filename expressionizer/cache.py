@@ -0,0 +1,131 @@
+"""
+Caching of getSet and sub expression lookups across processExpression calls.
+
+For example:
+    cache=LookupCache(maxsize=10000,ttl=300)
+    expression.setCache(cache)
+    expression.processExpression('webservers&!maintenance')
+    #A host was put into maintenance, so forget the old set
+    cache.invalidate('maintenance')
+    print(cache.stats())
+
+Cached values are shared between every expression that looks them up, so
+they must not be modified by the caller.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+_clock=time.monotonic
+
+class LookupCache(object):
+    """
+    Least recently used cache of lookup results, keyed by a tuple of the sub
+    expression name (None for getSet) and the noun.
+
+    Args:
+        maxsize     Int with the max number of entries to keep, the least
+                    recently used is evicted first
+        ttl         Number of seconds an entry is kept for, or None to keep
+                    entries until they are evicted
+        clock       Function returning the current time in seconds, mostly
+                    useful for testing
+    """
+    def __init__(self,maxsize=1024,ttl=None,clock=None):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1: {}".format(maxsize))
+        self.maxsize=maxsize
+        self.ttl=ttl
+        self.clock=clock or _clock
+        self._data=OrderedDict()
+        self._lock=threading.Lock()
+        self.resetStats()
+    def __getstate__(self):
+        state=self.__dict__.copy()
+        del state['_lock']
+        return state
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self._lock=threading.Lock()
+    def __len__(self):
+        return len(self._data)
+    def __contains__(self,key):
+        entry=self._data.get(key)
+        return entry is not None and (entry[1] is None or entry[1] > self.clock())
+    def __getitem__(self,key):
+        with self._lock:
+            try:
+                value,expires=self._data[key]
+            except KeyError:
+                self.misses+=1
+                raise
+            if expires is not None and expires <= self.clock():
+                del self._data[key]
+                self.expirations+=1
+                self.misses+=1
+                raise KeyError(key)
+            self._data.move_to_end(key)
+            self.hits+=1
+            return value
+    def __setitem__(self,key,value):
+        expires=None
+        if self.ttl is not None:
+            expires=self.clock()+self.ttl
+        with self._lock:
+            self._data[key]=(value,expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions+=1
+    def invalidate(self,name,subexpr=None):
+        """
+        Forget the result of a single lookup.
+
+        Args:
+            name        String with the noun
+            subexpr     String with the name of the sub expression the noun
+                        belongs to, or None for getSet
+        """
+        with self._lock:
+            self._data.pop((subexpr,name),None)
+    def invalidateSubExpression(self,subexpr):
+        """
+        Forget the results of every lookup for a sub expression.
+
+        Args:
+            subexpr     String with the name of the sub expression, or None
+                        for getSet
+        """
+        with self._lock:
+            for key in [ k for k in self._data if k[0] == subexpr ]:
+                del self._data[key]
+    def clear(self):
+        """
+        Forget every cached result. Statistics are kept.
+        """
+        with self._lock:
+            self._data.clear()
+    def resetStats(self):
+        """
+        Set all of the statistics back to zero
+        """
+        self.hits=0
+        self.misses=0
+        self.evictions=0
+        self.expirations=0
+    def stats(self):
+        """
+        Returns:
+            Dict with the hits, misses, evictions, expirations, current size,
+            max size and hit rate of the cache
+        """
+        lookups=self.hits+self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hit_rate': float(self.hits)/lookups if lookups else 0.0,
+        }
@@ -0,0 +1,220 @@
+"""
+Command line filter for NDJSON (one JSON document per line) streams.
+
+Usage:
+    Print the lines of a log that match an expression:
+        expressionizer 'level=error&service.name=api' app.log
+    Count the matches of compressed logs read from stdin, with 8 workers:
+        zcat app.log.gz | expressionizer --count --jobs 8 'level=error'
+    Print throughput stats to stderr:
+        expressionizer --count --stats 'level=error' app.log
+
+Documents are evaluated as nested dictionaries (see NestedDictExpression),
+or as flat dictionaries with --flat. Matching lines are written out exactly
+as they were read. Numbers are compared as they are written in the
+document, IE status=500 and status>=500 match {"status": 500}. true and
+false are kept as booleans, and are tested with the key on its own, IE
+enabled or !enabled. Lines that are not valid JSON objects, or that can't be
+evaluated, are skipped and counted as invalid.
+
+Like grep, the exit status is 0 when anything matched, 1 when nothing did
+and 2 on errors.
+"""
+import argparse
+import json
+import mmap
+import sys
+import time
+from .expressions import FlatDictExpression, NestedDictExpression
+from .parallel import ParallelEvaluator
+
+_clock=time.perf_counter
+
+#Size of the read buffer for streams that can't be memory mapped
+READ_BUFFER=1 << 20
+
+def _loadLine(line):
+    """
+    Args:
+        line    Bytes with a line of NDJSON
+
+    Returns:
+        Dict parsed from the line, or None when it isn't a JSON object, or
+        is nested too deep for the json module to parse. Numbers are kept as
+        the String they are written as, since expressions compare Strings.
+    """
+    try:
+        data=json.loads(line,parse_int=str,parse_float=str)
+    except (ValueError,RecursionError):
+        return None
+    if not isinstance(data,dict):
+        return None
+    return data
+
+def _readLines(path):
+    """
+    Read the lines of a file, memory mapping it when possible.
+
+    Args:
+        path    String with the path of the file, '-' for stdin
+
+    Returns:
+        Generator of Bytes, one per line
+    """
+    if path == '-':
+        f=sys.stdin.buffer
+    else:
+        f=open(path,'rb',buffering=READ_BUFFER)
+    try:
+        try:
+            mm=mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        except (ValueError,OSError,AttributeError):
+            #Pipes and empty files can't be mapped
+            mm=None
+        if mm is None:
+            for line in f:
+                yield line
+        else:
+            try:
+                for line in iter(mm.readline,b''):
+                    yield line
+            finally:
+                mm.close()
+    finally:
+        if f is not sys.stdin.buffer:
+            f.close()
+
+def _writeLine(out,line):
+    out.write(line)
+    if not line.endswith(b'\n'):
+        #Last line of a file without a line ending
+        out.write(b'\n')
+
+class Stats(object):
+    """
+    Counts of the lines processed, for the --stats output
+    """
+    def __init__(self):
+        self.lines=0
+        self.matched=0
+        self.invalid=0
+        self.bytes=0
+        self.start=_clock()
+    def report(self,stream):
+        elapsed=max(_clock()-self.start,1e-9)
+        stream.write("lines={} matched={} invalid={} bytes={} seconds={:.3f} lines/s={:.0f} MB/s={:.2f}\n".format(
+            self.lines,self.matched,self.invalid,self.bytes,elapsed,self.lines/elapsed,self.bytes/elapsed/1e6))
+
+def _filterSerial(compiled,lines,stats,out=None):
+    """
+    Evaluate every line in this process.
+
+    Args:
+        compiled    CompiledExpression to evaluate
+        lines       Iterable of Bytes lines
+        stats       Stats to count into
+        out         Binary stream to write the matching lines to, or None
+                    to only count them
+    """
+    evaluate=compiled._evaluator()
+    lines_seen=matched=invalid=size=0
+    for line in lines:
+        lines_seen+=1
+        size+=len(line)
+        data=_loadLine(line)
+        try:
+            result=data is not None and evaluate(data)
+        except Exception:
+            #IE a list compared with "<", one document can't stop the rest
+            data=None
+        if data is None:
+            if line.strip():
+                invalid+=1
+            continue
+        if result:
+            matched+=1
+            if out is not None:
+                _writeLine(out,line)
+    stats.lines+=lines_seen
+    stats.matched+=matched
+    stats.invalid+=invalid
+    stats.bytes+=size
+
+def _filterParallel(pool,lines,stats,out=None):
+    """
+    Same as _filterSerial, but parses and evaluates the lines in the worker
+    processes of a ParallelEvaluator.
+
+    Args:
+        pool        ParallelEvaluator created with _loadLine as the loader,
+                    and skip_errors
+        lines       Iterable of Bytes lines
+        stats       Stats to count into
+        out         Binary stream to write the matching lines to, or None
+    """
+    for chunk,results in pool.evaluate_chunks(lines):
+        stats.lines+=len(chunk)
+        for line,result in zip(chunk,results):
+            stats.bytes+=len(line)
+            if result is None:
+                if line.strip():
+                    stats.invalid+=1
+            elif result:
+                stats.matched+=1
+                if out is not None:
+                    _writeLine(out,line)
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(prog='expressionizer',description='Filter NDJSON documents with an expression')
+    parser.add_argument('expression',help='Expression to evaluate against every document')
+    parser.add_argument('files',nargs='*',default=['-'],help="NDJSON files to read, default is stdin ('-')")
+    parser.add_argument('-c','--count',action='store_true',help='Only print the number of matching documents')
+    parser.add_argument('--flat',action='store_true',help='Documents are flat dictionaries with dotted keys, instead of nested')
+    parser.add_argument('-j','--jobs',type=int,default=1,help='Number of worker processes (default: 1, no workers)')
+    parser.add_argument('--chunksize',type=int,default=10000,help='Lines sent to a worker at a time (default: 10000)')
+    parser.add_argument('--unordered',action='store_true',help='With --jobs, print matches as soon as they are found instead of in input order')
+    parser.add_argument('--stats',action='store_true',help='Print throughput stats to stderr')
+    args=parser.parse_args(argv)
+
+    if args.flat:
+        expression=FlatDictExpression()
+    else:
+        expression=NestedDictExpression()
+    try:
+        compiled=expression.compile(args.expression)
+    except ValueError as e:
+        parser.error('Invalid expression: {}'.format(e))
+
+    out=None
+    if not args.count:
+        out=sys.stdout.buffer
+    stats=Stats()
+    pool=None
+    if args.jobs > 1:
+        pool=ParallelEvaluator(compiled,processes=args.jobs,chunksize=args.chunksize,ordered=not (args.count or args.unordered),loader=_loadLine,skip_errors=True)
+    try:
+        for path in args.files:
+            try:
+                lines=_readLines(path)
+                if pool is None:
+                    _filterSerial(compiled,lines,stats,out)
+                else:
+                    _filterParallel(pool,lines,stats,out)
+            except BrokenPipeError:
+                #Output closed early, IE piped into head
+                return 0
+            except IOError as e:
+                sys.stderr.write('expressionizer: {}\n'.format(e))
+                return 2
+    finally:
+        if pool is not None:
+            pool.close()
+    if args.count:
+        sys.stdout.write('{}\n'.format(stats.matched))
+    try:
+        sys.stdout.flush()
+    except BrokenPipeError:
+        return 0
+    if args.stats:
+        stats.report(sys.stderr)
+    return 0 if stats.matched else 1
@@ -0,0 +1,370 @@
+"""
+Evaluate FlatDictExpression expressions against columns of records instead
+of one flat dict at a time. Requires numpy.
+
+For example:
+    Given columns of:
+        {
+            'key2.foo.version': numpy.array(['0.0.4','0.0.10','0.0.1']),
+            'key2.foo.enabled': numpy.array([True,False,True]),
+        }
+    The expression: "key2.foo.version>0.0.3&key2.foo.enabled" would result in
+    the mask [True, False, False]
+
+Rows missing a key can be given as a numpy.ma.MaskedArray, where masked
+entries are treated the same as a key missing from a flat dict.
+"""
+from .compiled import Leaf, Not, And, CompiledExpression, fold
+from .expressions import WildcardLeaf, compile, _human_keys
+
+try:
+    import numpy
+except ImportError:
+    numpy=None
+
+def _factorize(values):
+    """
+    Split an array into its distinct values and the index of each row's value
+    in them.
+
+    Args:
+        values      1 dimensional numpy array
+
+    Returns:
+        Tuple, first element is a List of the distinct values, second is an
+        array with the index into the first element for every row
+    """
+    try:
+        uniq,inverse=numpy.unique(values,return_inverse=True)
+        return (uniq.tolist(),inverse.reshape(-1))
+    except TypeError:
+        #Values that can't be sorted, IE mixed types in an object array
+        seen={}
+        inverse=numpy.empty(len(values),dtype=numpy.intp)
+        for i,v in enumerate(values.tolist()):
+            inverse[i]=seen.setdefault(v,len(seen))
+        return (list(seen),inverse)
+
+class ColumnarEvaluator(object):
+    """
+    Evaluates a compiled FlatDictExpression against a mapping of flat dict
+    key names to numpy arrays, producing one boolean mask for all of the rows.
+
+    Comparisons give the same results as compare_val of the expression the
+    tree was compiled with, so the results match evaluating each row on its
+    own. Columns of Strings are compared with numpy all at once, anything
+    else once per distinct value in the column.
+
+    Args:
+        compiled    CompiledExpression from a FlatDictExpression
+        columns     Dict of flat dict key name to 1 dimensional array
+        size        Number of rows, only needed when columns is empty
+    """
+    def __init__(self,compiled,columns,size=None):
+        if numpy is None:
+            raise ImportError("numpy is required for columnar evaluation")
+        self.compiled=compiled
+        self.expression=compiled.evaluator
+        self.columns=columns
+        if size is None:
+            sizes=set(len(c) for c in columns.values())
+            if len(sizes) != 1:
+                raise ValueError("Columns must all have the same number of rows, found: {}".format(sorted(sizes)))
+            size=sizes.pop()
+        self.size=size
+        #Values, number keys and human_keys of the columns, by id
+        self._values={}
+        self._number_keys={}
+        self._human_keys={}
+    def _leafMask(self,leaf):
+        """
+        Args:
+            leaf    Leaf node
+
+        Returns:
+            Bool array, True for every row the leaf is true for
+        """
+        if leaf.subexpr:
+            expression=self.expression
+            value=expression._cached(expression._lookupSubExpr,leaf.subexpr,leaf.name)
+            return numpy.full(self.size,bool(value))
+        if isinstance(leaf,WildcardLeaf):
+            return self._wildcardMask(leaf)
+        try:
+            column=self.columns[leaf.key]
+        except KeyError:
+            return numpy.zeros(self.size,dtype=bool)
+        return self._columnMask(leaf,column)
+    def _wildcardMask(self,leaf):
+        """
+        Args:
+            leaf    WildcardLeaf node
+
+        Returns:
+            Bool array, True for every row where any (or all) of the present
+            matching columns are true
+        """
+        found=numpy.zeros(self.size,dtype=bool)
+        if leaf.quantifier == 'any':
+            for key in self.expression._wildcardKeys(leaf,self.columns):
+                found|=self._columnMask(leaf,self.columns[key])
+            return found
+        failed=numpy.zeros(self.size,dtype=bool)
+        for key in self.expression._wildcardKeys(leaf,self.columns):
+            column=self.columns[key]
+            present=~numpy.ma.getmaskarray(column)
+            found|=present
+            failed|=present & ~self._columnMask(leaf,column)
+        return found & ~failed
+    def _columnValues(self,column):
+        """
+        Args:
+            column  Array with the values of a key
+
+        Returns:
+            Tuple, first element is a Bool array that is True for every row
+            the key is present in, second is an array of the values of those
+            rows. Object arrays that only hold Strings are converted to
+            string arrays, so they can be compared in bulk.
+        """
+        try:
+            return self._values[id(column)][1:]
+        except KeyError:
+            pass
+        present=~numpy.ma.getmaskarray(column)
+        values=numpy.asarray(numpy.ma.getdata(column))
+        if not present.all():
+            values=values[present]
+        if values.dtype.kind == 'O' and len(values) and all(type(v) is str for v in values.tolist()):
+            values=values.astype(str)
+        #The column is kept as well, so its id isn't reused while cached
+        self._values[id(column)]=(column,present,values)
+        return (present,values)
+    def _numberKeys(self,values,separator):
+        """
+        Args:
+            values      String array
+            separator   String between the numbers in the values, IE "." for
+                        versions, or None for plain numbers
+
+        Returns:
+            Int array with a row of the numbers in each value, padded with -1,
+            so rows sort the same way as the human_keys of the values. None
+            when some values aren't just numbers with the separator between
+            them.
+        """
+        try:
+            return self._number_keys[(id(values),separator)][1]
+        except KeyError:
+            pass
+        keys=None
+        if len(values) and values.dtype.itemsize and (separator is None or len(separator) == 1):
+            #The characters of every value, padded with 0
+            codes=numpy.ascontiguousarray(values,dtype=values.dtype.newbyteorder('=')).view(numpy.uint32).reshape(len(values),-1)
+            digits=(codes >= 48) & (codes <= 57)
+            ends=codes == 0
+            if separator is None:
+                separators=numpy.zeros(codes.shape,dtype=bool)
+            else:
+                separators=codes == ord(separator)
+            #Values have to start with a digit, have a digit after every
+            #separator, and be nothing else
+            if (digits[:,0].all() and (digits | separators | ends).all() and (~ends[:,:-1] | ends[:,1:]).all()
+                    and not (separators[:,:-1] & ~digits[:,1:]).any() and not separators[:,-1].any()):
+                segments=numpy.cumsum(separators,axis=1)
+                keys=numpy.full((len(values),segments[:,-1].max()+1),-1,dtype=numpy.int64)
+                rows=numpy.arange(len(values))
+                run=numpy.zeros(len(values),dtype=numpy.int64)
+                for i in range(codes.shape[1]):
+                    found=digits[:,i]
+                    run=numpy.where(found,run+1,0)
+                    if run.max() > 18:
+                        #Too long for an int64
+                        keys=None
+                        break
+                    r=rows[found]
+                    segment=segments[found,i]
+                    keys[r,segment]=numpy.maximum(keys[r,segment],0)*10+(codes[found,i]-48)
+        self._number_keys[(id(values),separator)]=(values,keys)
+        return keys
+    def _humanKeys(self,values):
+        """
+        Args:
+            values  String array
+
+        Returns:
+            Tuple, first element is a List of the human_keys of the distinct
+            values, second is an array with the index into the first element
+            for every row
+        """
+        try:
+            return self._human_keys[id(values)][1:]
+        except KeyError:
+            pass
+        uniq,inverse=numpy.unique(values,return_inverse=True)
+        keys=[ _human_keys(v) for v in uniq.tolist() ]
+        self._human_keys[id(values)]=(values,keys,inverse.reshape(-1))
+        return (keys,inverse.reshape(-1))
+    def _orderedMask(self,leaf,values):
+        """
+        Compare a string array with one of the ordered operators, the same
+        way _compareOperand does.
+
+        Args:
+            leaf    FlatDictLeaf node with an ordered operator
+            values  String array
+
+        Returns:
+            Bool array
+        """
+        equal=values == leaf.value
+        operand=leaf.operand
+        keys=None
+        separators=set(operand[2:-1:2])
+        if operand[0] == operand[-1] == '' and len(operand) > 1 and len(separators) <= 1:
+            #Numbers or versions, compared in bulk
+            separator=separators.pop() if separators else None
+            if separator is None or separator.swapcase() == separator:
+                keys=self._numberKeys(values,separator)
+        if keys is not None:
+            numbers=list(operand[1::2])
+            width=max(keys.shape[1],len(numbers))
+            numbers+=[-1]*(width-len(numbers))
+            #Compare the rows to the numbers one column at a time, until
+            #every row is decided
+            lower=numpy.ones(len(values),dtype=bool)
+            undecided=numpy.ones(len(values),dtype=bool)
+            for i,number in enumerate(numbers):
+                column=keys[:,i] if i < keys.shape[1] else numpy.full(len(values),-1,dtype=numpy.int64)
+                lower[undecided & (column > number)]=False
+                undecided&=column == number
+                if not undecided.any():
+                    break
+        else:
+            keys,inverse=self._humanKeys(values)
+            lower=numpy.array([ k <= operand for k in keys ],dtype=bool)[inverse]
+        if leaf.op == '<':
+            return ~equal & lower
+        if leaf.op == '<=':
+            return equal | lower
+        if leaf.op == '>':
+            return ~equal & ~lower
+        return equal | ~lower
+    def _columnMask(self,leaf,column):
+        """
+        Args:
+            leaf    FlatDictLeaf node
+            column  Array with the values of the key of the leaf
+
+        Returns:
+            Bool array, True for every row the comparison of the leaf is
+            true for
+        """
+        present,values=self._columnValues(column)
+        kind=values.dtype.kind
+        if leaf.op is None:
+            #No comparison, the value has to be a bool that is True
+            if kind == 'b':
+                found=values
+            elif kind == 'O':
+                found=numpy.array([ v is True for v in values.tolist() ],dtype=bool)
+            else:
+                found=numpy.zeros(len(values),dtype=bool)
+        elif leaf.op in ('=','!='):
+            if kind in 'UO':
+                found=numpy.asarray(values == leaf.value,dtype=bool)
+            else:
+                #Numbers, bools and bytes never equal a String
+                found=numpy.zeros(len(values),dtype=bool)
+            if leaf.op == '!=':
+                found=~found
+        elif leaf.op == '/' and kind == 'U':
+            found=numpy.char.find(values,leaf.value) >= 0
+        elif leaf.op in ('<','<=','>','>=') and kind == 'U':
+            found=self._orderedMask(leaf,values)
+        else:
+            #Regular expressions, and values that aren't all Strings
+            uniq,inverse=_factorize(values)
+            compare=self.expression._compareOperand
+            results=numpy.array([ bool(compare(v,leaf.op,leaf.value,leaf.operand)) for v in uniq ],dtype=bool)
+            found=results[inverse]
+        if present.all():
+            return numpy.asarray(found,dtype=bool)
+        mask=numpy.zeros(self.size,dtype=bool)
+        mask[present]=found
+        return mask
+    def _evalNode(self,node):
+        """
+        Args:
+            node    Node to evaluate
+
+        Returns:
+            Bool array
+        """
+        if isinstance(node,Leaf):
+            return self._leafMask(node)
+        if isinstance(node,Not):
+            return ~self._evalNode(node.child)
+        children=iter(node.children)
+        mask=self._evalNode(next(children))
+        if isinstance(node,And):
+            for c in children:
+                if not mask.any():
+                    #Nothing left that could be true
+                    break
+                mask=mask & self._evalNode(c)
+        else:
+            for c in children:
+                if mask.all():
+                    break
+                mask=mask | self._evalNode(c)
+        return mask
+    def _foldMask(self,node,masks):
+        """
+        Args:
+            node    Node to evaluate
+            masks   List of the Bool arrays of its children
+
+        Returns:
+            Bool array
+        """
+        if isinstance(node,Leaf):
+            return self._leafMask(node)
+        if isinstance(node,Not):
+            return ~masks[0]
+        mask=masks[0]
+        for m in masks[1:]:
+            if isinstance(node,And):
+                mask=mask & m
+            else:
+                mask=mask | m
+        return mask
+    def evaluate(self):
+        """
+        Returns:
+            Bool array with one element per row
+        """
+        root=self.compiled.root
+        if root.depth > self.expression.max_recursion_depth:
+            #Too deep to recurse, every node is evaluated instead
+            return fold(root,self._foldMask)
+        return self._evalNode(root)
+
+def evaluate_columns(expression,columns,size=None):
+    """
+    Evaluate an expression against columns of values, IE one array per flat
+    dict key.
+
+    Args:
+        expression      String or CompiledExpression from a FlatDictExpression
+        columns         Dict of flat dict key name to 1 dimensional array.
+                        Masked entries of numpy.ma.MaskedArray columns are
+                        treated as missing keys.
+        size            Number of rows, only needed when columns is empty
+
+    Returns:
+        numpy array of Bools, True for every row the expression is true for
+    """
+    if not isinstance(expression,CompiledExpression):
+        expression=compile(expression)
+    return ColumnarEvaluator(expression,columns,size=size).evaluate()
@@ -0,0 +1,413 @@
+import sys
+
+#Nodes at every multiple of this depth are hashed when they are built, so
+#hashing a deep tree never recurses further than this
+_hash_interval=100
+#Trees up to this deep are folded by recursing, which is faster than a stack
+_fold_recursion_depth=100
+#Trees up to this deep are pickled by pickle itself, which recurses into the
+#children of every node. Deeper trees are pickled as a flat list of their
+#nodes, see _flatten.
+_pickle_recursion_depth=100
+
+def _intern(value):
+    """
+    Args:
+        value       Any value
+
+    Returns:
+        The value, or the interned copy of it for Strings, so the names and
+        values repeated across many expressions are only stored once
+    """
+    if type(value) is str:
+        return sys.intern(value)
+    return value
+
+class Node(object):
+    """
+    This is a base class for the nodes that make up a compiled expression
+    tree. Nodes use __slots__ instead of a __dict__ to keep large numbers of
+    compiled expressions small, so subclasses should declare __slots__ for
+    the attributes they add.
+    """
+    __slots__=('_hash',)
+    #Number of nodes below this one on the longest path to a leaf
+    depth=0
+    def __eq__(self,other):
+        if self is other:
+            return True
+        #Comparing hashes first avoids walking the whole of unequal trees
+        return self.__class__ is other.__class__ and hash(self) == hash(other) and self._key() == other._key()
+    def __ne__(self,other):
+        return not self.__eq__(other)
+    def __hash__(self):
+        #Nodes are never changed once built, so the hash only needs working out once
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash=hash((self.__class__.__name__,self._key()))
+            return self._hash
+    def __getstate__(self):
+        #String hashes differ between processes, so the cached hash isn't
+        #pickled
+        state=dict(getattr(self,'__dict__',()))
+        for cls in self.__class__.__mro__:
+            for name in cls.__dict__.get('__slots__',()):
+                if name != '_hash' and hasattr(self,name):
+                    state[name]=getattr(self,name)
+        return state
+    def __setstate__(self,state):
+        for name,value in state.items():
+            setattr(self,name,_intern(value))
+        #Children are unpickled first, so this never recurses
+        self.__hash__()
+    def __reduce_ex__(self,protocol):
+        if self.depth <= _pickle_recursion_depth:
+            return object.__reduce_ex__(self,protocol)
+        records,roots=_flatten([self])
+        return (_unflattenRoot,(records,))
+    def _key(self):
+        """
+        Returns:
+            Tuple that uniquely identifies the node, used for comparisons
+        """
+        raise NotImplementedError
+
+class Leaf(Node):
+    """
+    A noun in the expression. The value of the leaf is resolved through the
+    getVal/getSet function of the expression, or through the function of the
+    sub expression the leaf was found in.
+
+    Args:
+        name        String with the noun as it was found in the expression
+        subexpr     String with the name of the sub expression the noun was
+                    found in, or None
+    """
+    __slots__=('name','subexpr')
+    def __init__(self,name,subexpr=None):
+        self.name=_intern(name)
+        self.subexpr=subexpr
+    def _key(self):
+        return (self.name,self.subexpr)
+    def __repr__(self):
+        if self.subexpr:
+            return "{}({!r},subexpr={!r})".format(self.__class__.__name__,self.name,self.subexpr)
+        return "{}({!r})".format(self.__class__.__name__,self.name)
+
+class Not(Node):
+    """
+    Negates the result of its child node
+
+    Args:
+        child       Node to negate
+        subexpr     String with the name of the sub expression the negation
+                    was found in, or None. Set expressions use it to find the
+                    superset to negate against.
+    """
+    __slots__=('child','subexpr','depth')
+    def __init__(self,child,subexpr=None):
+        self.child=child
+        self.subexpr=subexpr
+        self.depth=child.depth+1
+        if not self.depth % _hash_interval:
+            self.__hash__()
+    def _key(self):
+        return (self.child,self.subexpr)
+    def __repr__(self):
+        if self.subexpr:
+            return "Not({!r},subexpr={!r})".format(self.child,self.subexpr)
+        return "Not({!r})".format(self.child)
+
+class BoolOp(Node):
+    """
+    This is a base class for nodes that combine all of their children with
+    the same operator.
+
+    Args:
+        children    List of Nodes to combine
+    """
+    __slots__=('children','depth')
+    def __init__(self,children):
+        self.children=tuple(children)
+        self.depth=max(c.depth for c in self.children)+1
+        if not self.depth % _hash_interval:
+            self.__hash__()
+    def _key(self):
+        return self.children
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__,list(self.children))
+
+class And(BoolOp):
+    """
+    All of the children must be true
+    """
+    __slots__=()
+
+class Or(BoolOp):
+    """
+    Any of the children must be true
+    """
+    __slots__=()
+
+def fold(node,func):
+    """
+    Work out a value for every node of a tree from the values of its
+    children, bottom up. This uses a stack instead of recursing, so there is
+    no limit on how deep the tree can be.
+
+    Args:
+        node        Root Node of the tree
+        func        Function taking a node and a List with the values of its
+                    children (empty for leaves), that returns the value of
+                    the node
+
+    Returns:
+        The value of the root node
+    """
+    if node.depth <= _fold_recursion_depth:
+        return _foldRecursive(node,func)
+    values={}
+    stack=[(node,False)]
+    while stack:
+        n,ready=stack.pop()
+        if isinstance(n,Leaf):
+            children=()
+        elif isinstance(n,Not):
+            children=(n.child,)
+        else:
+            children=n.children
+        if children and not ready:
+            stack.append((n,True))
+            stack.extend((c,False) for c in children if id(c) not in values)
+            continue
+        values[id(n)]=func(n,[ values[id(c)] for c in children ])
+    return values[id(node)]
+
+def _foldRecursive(node,func):
+    if isinstance(node,Leaf):
+        return func(node,[])
+    if isinstance(node,Not):
+        return func(node,[_foldRecursive(node.child,func)])
+    return func(node,[ _foldRecursive(c,func) for c in node.children ])
+
+def iter_leaves(node):
+    """
+    Walk a compiled expression tree and yield every Leaf in it, in the order
+    they are evaluated.
+
+    Args:
+        node        Node to start walking from
+
+    Returns:
+        Generator of Leaf objects
+    """
+    stack=[node]
+    while stack:
+        n=stack.pop()
+        if isinstance(n,Leaf):
+            yield n
+        elif isinstance(n,Not):
+            stack.append(n.child)
+        elif isinstance(n,BoolOp):
+            stack.extend(reversed(n.children))
+
+def _flatten(roots):
+    """
+    Turn trees into a flat list of every node in them, that can be pickled
+    without recursing through every level of them. Nodes shared between the
+    trees, or within them, are only listed once.
+
+    Args:
+        roots       List of root Nodes
+
+    Returns:
+        Tuple of the List of records for _unflatten, children before their
+        parents, and a List with the index of every root in it. Records of
+        nodes up to _pickle_recursion_depth deep are the nodes themselves,
+        the others are tuples of the class and the pickled state of the
+        node, with the indexes of the children in place of the children.
+    """
+    index={}
+    records=[]
+    for root in roots:
+        stack=[(root,False)]
+        while stack:
+            n,ready=stack.pop()
+            if id(n) in index:
+                continue
+            if isinstance(n,Leaf):
+                children=()
+            elif isinstance(n,Not):
+                children=(n.child,)
+            else:
+                children=n.children
+            if children and not ready:
+                stack.append((n,True))
+                stack.extend((c,False) for c in reversed(children) if id(c) not in index)
+                continue
+            index[id(n)]=len(records)
+            if n.depth <= _pickle_recursion_depth:
+                #Its children are pickled before it, so pickle doesn't
+                #recurse into them
+                records.append(n)
+                continue
+            state=n.__getstate__()
+            if isinstance(n,Not):
+                state['child']=index[id(n.child)]
+            else:
+                state['children']=tuple(index[id(c)] for c in children)
+            records.append((n.__class__,state))
+    return (records,[ index[id(root)] for root in roots ])
+
+def _unflatten(records):
+    """
+    Args:
+        records     List of records from _flatten
+
+    Returns:
+        List of the Nodes, in the same order as the records
+    """
+    nodes=[]
+    for record in records:
+        if isinstance(record,Node):
+            nodes.append(record)
+            continue
+        cls,state=record
+        state=dict(state)
+        if 'child' in state:
+            state['child']=nodes[state['child']]
+        else:
+            state['children']=tuple(nodes[i] for i in state['children'])
+        node=cls.__new__(cls)
+        node.__setstate__(state)
+        nodes.append(node)
+    return nodes
+
+def _unflattenRoot(records):
+    #The root is the last record, as parents come after their children
+    return _unflatten(records)[-1]
+
+class CompiledExpression(object):
+    """
+    An expression that has been parsed once into a tree of nodes, and can
+    be evaluated any number of times without tokenizing the expression again.
+
+    Args:
+        expression  String with the original expression
+        root        Root Node of the parsed expression
+        evaluator   The expression object used to evaluate the tree
+    """
+    def __init__(self,expression,root,evaluator):
+        self.expression=expression
+        self.root=root
+        self.evaluator=evaluator
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__,self.expression)
+    def __getstate__(self):
+        #Generated functions can't be pickled, they are generated again
+        state=self.__dict__.copy()
+        state.pop('_function',None)
+        return state
+    def as_function(self):
+        """
+        Generate a Python function that evaluates the expression, see
+        BaseConditionalExpression._function. The function is only generated
+        once.
+
+        Returns:
+            Function taking the data to evaluate against and returning a Bool
+        """
+        try:
+            return self._function
+        except AttributeError:
+            function=self._function=self.evaluator._function(self.root)
+            return function
+    def evaluate(self,data=None,budget=None):
+        """
+        Evaluate the compiled expression.
+
+        Args:
+            data        Data to evaluate the leaves against, IE the flat
+                        dictionary for a FlatDictExpression. When None the
+                        data the evaluator was created with is used.
+            budget      Optional Budget (see expressionizer.budget) limiting
+                        the time or number of nodes the evaluation may take
+
+        Returns:
+            The result of the expression
+
+        Raises:
+            EvaluationTimeout when the budget runs out
+        """
+        if budget is not None:
+            return self.evaluator._evalBudgeted(self.root,data,budget)
+        return self.evaluator._evaluate(self.root,data)
+    def evaluate_async(self,data=None,concurrency=None):
+        """
+        Asyncio version of evaluate, see expressionizer.aio. Lookup functions
+        may be coroutine functions, and are all resolved concurrently.
+
+        Args:
+            data            Data to evaluate the leaves against
+            concurrency     Int with the max number of lookups to run at once
+
+        Returns:
+            Coroutine that returns the result of the expression
+        """
+        from .aio import evaluate_async
+        return evaluate_async(self,data,concurrency)
+    def _evaluator(self):
+        """
+        Returns:
+            Function taking the data to evaluate against. Batched sub
+            expression nouns don't depend on the data, so they are resolved
+            once here instead of for every item.
+        """
+        evaluator=self.evaluator
+        root=self.root
+        values=evaluator._resolveBatches(root)
+        if values:
+            evalPrefetched=evaluator._evalPrefetched
+            return lambda data: evalPrefetched(root,values,data)
+        if root.depth > evaluator.max_recursion_depth:
+            evalNode=evaluator._evalIterative
+        else:
+            evalNode=evaluator._evalNode
+        return lambda data: evalNode(root,data)
+    def evaluate_many(self,iterable):
+        """
+        Evaluate the compiled expression against every item of an iterable.
+        Items are consumed one at a time, so this works on unbounded
+        iterators.
+
+        Args:
+            iterable    Iterable of data to evaluate against, IE flat dicts
+
+        Returns:
+            Generator of results, one per item
+        """
+        evaluate=self._evaluator()
+        for data in iterable:
+            yield evaluate(data)
+    def filter(self,iterable):
+        """
+        Same as evaluate_many, but yields the items the expression is true
+        for instead of the results.
+
+        Args:
+            iterable    Iterable of data to evaluate against, IE flat dicts
+
+        Returns:
+            Generator of matching items
+        """
+        evaluate=self._evaluator()
+        for data in iterable:
+            if evaluate(data):
+                yield data
+    def leaves(self):
+        """
+        Returns:
+            Generator of every Leaf in the expression
+        """
+        return iter_leaves(self.root)
@@ -1,7 +1,90 @@
 from .base import BaseConditionalExpression
+from .compiled import Leaf, CompiledExpression, _intern
+from .trie import IndexedFlatDict
+from .saferegex import compile_safe
 import logging
 import re
 
+_digits_re=re.compile(r'(\d+)')
+#Cache of human_keys results, cleared when it grows past _human_keys_max
+_human_keys_cache={}
+_human_keys_max=10000
+#FlatDictExpression that compile_function caches its functions in
+_function_expression=None
+
+def _human_keys(astr):
+    """
+    human_keys without the cache, for when many distinct values are keyed at
+    once.
+    """
+    keys=_digits_re.split(astr)
+    #Runs of digits are every other element
+    keys[1::2]=map(int,keys[1::2])
+    keys[::2]=[ k.swapcase() for k in keys[::2] ]
+    return tuple(keys)
+
+def human_keys(astr):
+    """
+    Sorts keys based on human order.. IE 1 is less than 10 etc..
+
+    alist.sort(key=human_keys) sorts in human order
+
+    Results are cached, since the same values tend to be compared over and
+    over again.
+    """
+    try:
+        return _human_keys_cache[astr]
+    except KeyError:
+        pass
+    keys=_human_keys(astr)
+    if len(_human_keys_cache) >= _human_keys_max:
+        _human_keys_cache.clear()
+    _human_keys_cache[astr]=keys
+    return keys
+
+class FlatDictLeaf(Leaf):
+    """
+    A noun from a FlatDictExpression that has already been split into the
+    key name, comparison operator and value by _op_split.
+
+    Args:
+        name        String with the noun as it was found in the expression
+        key         String with the flat dict key to look up
+        op          String with the comparison operator, or None
+        value       String with the value to compare against, or None
+        operand     Precompiled value from FlatDictExpression._compileOperand
+    """
+    __slots__=('key','op','value','operand')
+    def __init__(self,name,key,op=None,value=None,operand=None):
+        Leaf.__init__(self,name)
+        self.key=_intern(key)
+        self.op=op
+        self.value=_intern(value)
+        self.operand=_intern(operand)
+
+class WildcardLeaf(FlatDictLeaf):
+    """
+    A FlatDictLeaf whose key has '*' segments, that match any one segment
+    of a key.
+
+    Args:
+        name        String with the noun as it was found in the expression
+        key         String with the key pattern, without the quantifier
+        pattern     Tuple of the segments of the key pattern
+        quantifier  String, 'any' when one matching key being true is enough,
+                    'all' when every matching key has to be
+        op          String with the comparison operator, or None
+        value       String with the value to compare against, or None
+        operand     Precompiled value from FlatDictExpression._compileOperand
+    """
+    __slots__=('pattern','quantifier','regex')
+    def __init__(self,name,key,pattern,quantifier='any',op=None,value=None,operand=None):
+        FlatDictLeaf.__init__(self,name,key,op,value,operand)
+        self.pattern=tuple(_intern(p) for p in pattern)
+        self.quantifier=quantifier
+        #Matches the same keys as the pattern, for dicts without a KeyTrie
+        self.regex=re.compile(r'\.'.join('[^.]*' if p == '*' else re.escape(p) for p in pattern)+r'\Z')
+
 class FlatDictExpression(BaseConditionalExpression):
     """
     Extends BaseConditionalExpression to check values in
@@ -22,12 +105,33 @@ class FlatDictExpression(BaseConditionalExpression):
     the expression: key2.foo.version>=0.0.4 would result in True
 
     The expression: "key1.subkey2=bob&&key2.foo.enabled: would return True
+
+    A '*' segment in a key matches any one segment, so "key1.*=bob" is true
+    when any key one level under key1 is bob. Prefix the key with "all:" for
+    it to be true only when every matching key is, IE "all:net.*.up". Either
+    way it is False when no key matches.
+
+    Every '*' key is matched against every key of a plain dict, once per
+    evaluation of the leaf. When evaluating many wildcard keys against the
+    same dict, IE a long lived dict or many rules, wrap it in an
+    IndexedFlatDict instead: it keeps a trie of its keys up to date, and the
+    matching keys are looked up in it. RuleSet.match does this on its own for
+    rule sets with many wildcard keys.
+
+    Expressions can also be compiled once and evaluated against any number of
+    flat dictionaries:
+        compiled=FlatDictExpression().compile('key1.subkey2=bob')
+        compiled.evaluate(flat_dict)
     Args:
         flat_dict          A dictionary object that has been flattend
     """
     ops=[ '>=','<=','>','<','!=','=','/','~' ]
+    #Compile the patterns of "~" in safe mode (see expressionizer.saferegex),
+    #rejecting ones that could backtrack catastrophically. Set it before
+    #compiling any expressions.
+    safe_regex=False
 
-    def __init__(self,flat_dict,logger=None):
+    def __init__(self,flat_dict=None,logger=None):
         self.logger = logger or logging.getLogger(self.__class__.__name__)
         self.operators={
             'group_start_char': '(',
@@ -37,8 +141,17 @@ class FlatDictExpression(BaseConditionalExpression):
             'or_operators': ['|'],
             'sub_expressions': {},
         }
+        if flat_dict is None:
+            flat_dict={}
         self.flat_dict=flat_dict
         self.all_name='all'
+    def _nounOps(self):
+        """
+        Returns:
+            List of comparison operators, so "!=" isn't split on the "!"
+            operator
+        """
+        return self.ops
     def _op_split(self,search):
         """
         Takes a flat dictionary search name and splits it into 3 elements:
@@ -66,62 +179,78 @@ class FlatDictExpression(BaseConditionalExpression):
                 right=s_split[1]
                 break
         return (left, o, right)
-    def compare_val(self,left_side,op,right_side):
+    def _compileOperand(self,op,right_side):
         """
-        Compares two value strings together.
+        Work out everything about the right hand side of a comparison that
+        doesn't depend on the left hand side, so it can be done once when the
+        expression is compiled.
 
         Args:
-            left        String left hand value
-            op          String with the operators to use for comparing
-            right       String right hand value
+            op          String with the operator to use for comparing
+            right_side  String right hand value
+
+        Returns:
+            Tuple of human_keys for ordered operators, a compiled regular
+            expression for "~", otherwise None
+
+        Raises:
+            ValueError when safe_regex is set and the regular expression
+            isn't safe
+        """
+        if op in ('<','<=','>','>='):
+            return human_keys(right_side)
+        if op == '~':
+            if self.safe_regex:
+                return compile_safe(right_side)
+            return re.compile(right_side)
+        return None
+    def _compareOperand(self,lh,op,rh,operand):
+        """
+        Compares two values together using an operand from _compileOperand.
+
+        Args:
+            lh          Left hand value
+            op          String with the operator to use for comparing
+            rh          String right hand value
+            operand     Result of _compileOperand for op and rh
 
         Returns:
             Bool    True or False
         """
-        def human_keys(astr):
-            """
-            Sorts keys based on human order.. IE 1 is less than 10 etc..
-
-            alist.sort(key=human_keys) sorts in human order
-            """
-            keys=[]
-            for elt in re.split('(\d+)', astr):
-                elt=elt.swapcase()
-                try: elt=int(elt)
-                except ValueError: pass
-                keys.append(elt)
-            return keys
-        lh=left_side
-        rh=right_side
-        sv=sorted([lh,rh],key=human_keys)
-        ret=False
         if op == '=':
-            if lh == rh:
-                ret=True
+            return lh == rh
         elif op == '!=':
-            if lh != rh:
-                ret=True
+            return lh != rh
+        #For ordered operators ties in human order go to the left hand side,
+        #IE 01 is both <= and < 1
         elif op == '<':
-            if lh != rh and lh == sv[0]:
-                ret=True
+            return lh != rh and human_keys(lh) <= operand
         elif op == '<=':
-            if lh == rh or lh == sv[0]:
-                ret=True
+            return lh == rh or human_keys(lh) <= operand
         elif op == '>':
-            if lh != rh and rh == sv[0]:
-                ret=True
+            return lh != rh and operand < human_keys(lh)
         elif op == '>=':
-            if lh == rh or rh == sv[0]:
-                ret=True
+            return lh == rh or operand < human_keys(lh)
         elif op == '/':
-            if rh in lh:
-                ret=True
+            return rh in lh
         elif op == '~':
-            if re.match(rh,lh):
-                ret=True
-        else:
-          raise ValueError('Unknown operator: %s' %(op))
-        self.logger.debug("compare_val: lhs={} op={} rhs={} . Result={}".format(lh,op,rh,ret))
+            return operand.match(lh) is not None
+        raise ValueError('Unknown operator: %s' %(op))
+    def compare_val(self,left_side,op,right_side):
+        """
+        Compares two value strings together.
+
+        Args:
+            left        String left hand value
+            op          String with the operators to use for comparing
+            right       String right hand value
+
+        Returns:
+            Bool    True or False
+        """
+        ret=self._compareOperand(left_side,op,right_side,self._compileOperand(op,right_side))
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("compare_val: lhs={} op={} rhs={} . Result={}".format(left_side,op,right_side,ret))
         return ret
     def getVal(self,name):
         """
@@ -139,6 +268,8 @@ class FlatDictExpression(BaseConditionalExpression):
             key2.foo.version>=0.0.1 Would return true if key2.foo.version is greater than or equal to 0.0.1
 
         """
+        if '*' in name:
+            return self._leafVal(self._compileLeaf(name))
         op_data=self._op_split(name)
         kname=op_data[0]
         kop=op_data[1]
@@ -161,4 +292,392 @@ class FlatDictExpression(BaseConditionalExpression):
                 if value:
                     result=True
         return result
+    def _compileLeaf(self,name,subExprName=None):
+        """
+        Split the noun with _op_split up front, so it only happens once per
+        compile instead of on every evaluation.
+
+        Args:
+            name            String with the noun
+            subExprName     String with the name of the sub expression the
+                            noun was found in, or None
+
+        Returns:
+            Leaf
+        """
+        if subExprName:
+            return Leaf(name,subexpr=subExprName)
+        op_data=self._op_split(name)
+        leaf=None
+        if '*' in op_data[0]:
+            leaf=self._compileWildcard(name,op_data)
+        if leaf is None:
+            leaf=FlatDictLeaf(name,op_data[0],op_data[1],op_data[2])
+        if leaf.op:
+            leaf.operand=self._compileOperand(leaf.op,leaf.value)
+        return leaf
+    def _compileWildcard(self,name,op_data):
+        """
+        Args:
+            name            String with the noun
+            op_data         Tuple from _op_split
+
+        Returns:
+            WildcardLeaf, or None when the key has no '*' segments
+        """
+        key=op_data[0]
+        quantifier='any'
+        for q in ('any:','all:'):
+            if key.startswith(q):
+                quantifier=q[:-1]
+                key=key[len(q):]
+                break
+        pattern=key.split('.')
+        if '*' not in pattern:
+            return None
+        return WildcardLeaf(name,key,pattern,quantifier,op_data[1],op_data[2])
+    def _wildcardKeys(self,leaf,data):
+        """
+        Args:
+            leaf    WildcardLeaf
+            data    Flat dict
+
+        Returns:
+            List of the keys of the flat dict that match the pattern of the
+            leaf
+        """
+        if isinstance(data,IndexedFlatDict):
+            return data.trie.match(leaf.pattern)
+        match=leaf.regex.match
+        return [ k for k in data if isinstance(k,str) and match(k) ]
+    def _leafKey(self,leaf):
+        """
+        Args:
+            leaf    Leaf node
+
+        Returns:
+            String with the flat dict key the leaf needs to be true, or None
+        """
+        if leaf.subexpr or isinstance(leaf,WildcardLeaf):
+            return None
+        return leaf.key
+    def _leafDependsOn(self,leaf,key):
+        if isinstance(leaf,WildcardLeaf):
+            return isinstance(key,str) and leaf.regex.match(key) is not None
+        return BaseConditionalExpression._leafDependsOn(self,leaf,key)
+    def _leafLookup(self,leaf):
+        #Flat dict keys are resolved locally, only sub expressions need lookups
+        if leaf.subexpr:
+            return self._lookupSubExpr
+        return None
+    #Source of each comparison for _leafSource, formatted with the key, value
+    #and operand names
+    _op_sources={
+        '=': '{k} in d and d[{k}] == {v}',
+        '!=': '{k} in d and d[{k}] != {v}',
+        '<': '{k} in d and d[{k}] != {v} and {hk}(d[{k}]) <= {o}',
+        '<=': '{k} in d and (d[{k}] == {v} or {hk}(d[{k}]) <= {o})',
+        '>': '{k} in d and d[{k}] != {v} and {o} < {hk}(d[{k}])',
+        '>=': '{k} in d and (d[{k}] == {v} or {o} < {hk}(d[{k}]))',
+        '/': '{k} in d and {v} in d[{k}]',
+        '~': '{k} in d and {o}.match(d[{k}]) is not None',
+    }
+    def _leafSource(self,leaf,namespace):
+        """
+        Inline the flat dict lookup and comparison of a leaf, the same way
+        _leafVal does them.
+
+        Args:
+            leaf        Leaf node
+            namespace   Dict of the globals for the generated source
+
+        Returns:
+            String with a Python expression that evaluates to a Bool
+        """
+        if leaf.subexpr or isinstance(leaf,WildcardLeaf):
+            return BaseConditionalExpression._leafSource(self,leaf,namespace)
+        k=repr(leaf.key)
+        if not leaf.op:
+            return '(d.get({}) is True)'.format(k)
+        try:
+            source=self._op_sources[leaf.op]
+        except KeyError:
+            #Operator added by a subclass
+            source='{k} in d and {cmp}(d[{k}],{op},{v},{o})'
+        names={'k': k,'v': repr(leaf.value),'op': repr(leaf.op)}
+        if '{o}' in source:
+            names['o']=self._sourceName(namespace,leaf.operand)
+        if '{hk}' in source:
+            names['hk']=self._sourceName(namespace,human_keys)
+        if '{cmp}' in source:
+            names['cmp']=self._sourceName(namespace,self._compareOperand)
+        return '({})'.format(source.format(**names))
+    def _leafVal(self,leaf,data=None):
+        """
+        Resolve the value of a Leaf against a flat dict, the same way getVal
+        does.
+
+        Args:
+            leaf    Leaf node
+            data    Flat dict to evaluate against, defaults to self.flat_dict
+
+        Returns:
+            Bool
+        """
+        if leaf.subexpr:
+            return self._cached(self._lookupSubExpr,leaf.subexpr,leaf.name)
+        if data is None:
+            data=self.flat_dict
+        if isinstance(leaf,WildcardLeaf):
+            return self._wildcardVal(leaf,data)
+        try:
+            value=data[leaf.key]
+        except KeyError:
+            return False
+        if leaf.op:
+            return self._compareOperand(value,leaf.op,leaf.value,leaf.operand)
+        #No comparison, see if the value is a bool
+        return value is True
+    def _wildcardVal(self,leaf,data):
+        """
+        Args:
+            leaf    WildcardLeaf
+            data    Flat dict
+
+        Returns:
+            Bool, True when any (or all) of the matching keys are true
+        """
+        keys=self._wildcardKeys(leaf,data)
+        if not keys:
+            return False
+        want=leaf.quantifier == 'any'
+        for k in keys:
+            if leaf.op:
+                result=self._compareOperand(data[k],leaf.op,leaf.value,leaf.operand)
+            else:
+                result=data[k] is True
+            if bool(result) is want:
+                return want
+        return not want
+
+class NestedDictLeaf(FlatDictLeaf):
+    """
+    A FlatDictLeaf with the key already split into the path through a nested
+    dictionary.
+
+    Args:
+        name        String with the noun as it was found in the expression
+        key         String with the dotted key
+        path        Tuple of Strings with the key split on the separator
+        op          String with the comparison operator, or None
+        value       String with the value to compare against, or None
+        operand     Precompiled value from FlatDictExpression._compileOperand
+    """
+    __slots__=('path',)
+    def __init__(self,name,key,path,op=None,value=None,operand=None):
+        FlatDictLeaf.__init__(self,name,key,op,value,operand)
+        self.path=tuple(_intern(p) for p in path)
+
+class NestedDictExpression(FlatDictExpression):
+    """
+    Extends FlatDictExpression to evaluate directly against a nested
+    dictionary, IE a parsed JSON document, instead of a flattened one. Only
+    the paths the expression uses are looked up, so the document never has
+    to be flattened.
+
+    For example:
+    Given a dictionary of:
+        {
+            'key1': {'subkey2': 'bob'},
+            'key2': {'foo': {'version': '0.0.4', 'enabled': True}},
+            'hosts': [{'name': 'web1'}, {'name': 'web2'}]
+        }
+    The expression: "key1.subkey2=bob&key2.foo.enabled&hosts.1.name=web2"
+    would result in True. Numbers in a path index into lists.
+
+    Comparisons and bool values work exactly like FlatDictExpression, and a
+    path that doesn't exist is False. Keys that contain the separator can't
+    be used in expressions.
+
+    Args:
+        document        Nested dictionary to evaluate against
+        separator       String the keys of the path are separated by
+    """
+    separator='.'
+
+    def __init__(self,document=None,logger=None,separator=None):
+        FlatDictExpression.__init__(self,document,logger=logger)
+        if separator:
+            self.separator=separator
+    def _resolvePath(self,data,path):
+        """
+        Args:
+            data    Nested dictionary
+            path    Tuple of keys
+
+        Returns:
+            The value at the end of the path
+
+        Raises:
+            KeyError when the path doesn't exist, or ends at a dictionary or
+            list like it would in the flattened dictionary
+        """
+        value=data
+        for k in path:
+            try:
+                value=value[k]
+            except (TypeError,IndexError):
+                #Lists are indexed by number, anything else is a dead end
+                if not isinstance(value,(list,tuple)) or not k.isdigit():
+                    raise KeyError(k)
+                try:
+                    value=value[int(k)]
+                except IndexError:
+                    raise KeyError(k)
+        if isinstance(value,(dict,list,tuple)):
+            #Not a key of the flattened dictionary, only the values in it are
+            raise KeyError(path[-1])
+        return value
+    def getVal(self,name):
+        """
+        Same as FlatDictExpression.getVal, but looks the key up as a path
+        through the nested dictionary.
+
+        Args:
+            name        String, representing a dotted path with an optional
+                        operator for comparisons.
+
+        Returns:
+            Bool
+        """
+        return self._leafVal(self._compileLeaf(name))
+    def _compileLeaf(self,name,subExprName=None):
+        """
+        Same as FlatDictExpression._compileLeaf, and also splits the key into
+        its path.
 
+        Args:
+            name            String with the noun
+            subExprName     String with the name of the sub expression the
+                            noun was found in, or None
+
+        Returns:
+            Leaf
+        """
+        if subExprName:
+            return Leaf(name,subexpr=subExprName)
+        op_data=self._op_split(name)
+        leaf=NestedDictLeaf(name,op_data[0],tuple(op_data[0].split(self.separator)),op_data[1],op_data[2])
+        if leaf.op:
+            leaf.operand=self._compileOperand(leaf.op,leaf.value)
+        return leaf
+    def _leafSource(self,leaf,namespace):
+        #Paths are resolved by _leafVal, rather than inlined
+        return BaseConditionalExpression._leafSource(self,leaf,namespace)
+    def _leafKey(self,leaf):
+        """
+        Args:
+            leaf    Leaf node
+
+        Returns:
+            String with the top level key the leaf needs to be true, or None
+        """
+        if leaf.subexpr:
+            return None
+        return leaf.path[0]
+    def _leafVal(self,leaf,data=None):
+        """
+        Resolve the value of a Leaf against a nested dict, the same way
+        getVal does.
+
+        Args:
+            leaf    Leaf node
+            data    Nested dict to evaluate against, defaults to the one the
+                    expression was created with
+
+        Returns:
+            Bool
+        """
+        if leaf.subexpr:
+            return self._cached(self._lookupSubExpr,leaf.subexpr,leaf.name)
+        if data is None:
+            data=self.flat_dict
+        try:
+            value=self._resolvePath(data,leaf.path)
+        except KeyError:
+            return False
+        if leaf.op:
+            return self._compareOperand(value,leaf.op,leaf.value,leaf.operand)
+        #No comparison, see if the value is a bool
+        return value is True
+
+def compile(expression):
+    """
+    Compile a FlatDictExpression expression, so it can be evaluated against
+    any number of flat dictionaries.
+
+    Args:
+        expression      String representing an expression to compile
+
+    Returns:
+        CompiledExpression
+    """
+    return FlatDictExpression().compile(expression)
+
+def compile_function(expression):
+    """
+    Compile a FlatDictExpression expression into a generated Python function
+    (see BaseConditionalExpression.compileFunction). Functions are cached per
+    expression string.
+
+    Args:
+        expression      String representing an expression to compile
+
+    Returns:
+        Function taking a flat dictionary and returning a Bool
+    """
+    global _function_expression
+    if _function_expression is None:
+        _function_expression=FlatDictExpression()
+    return _function_expression.compileFunction(expression)
+
+def _compiled(expression):
+    """
+    Args:
+        expression      String or CompiledExpression
+
+    Returns:
+        CompiledExpression
+    """
+    if isinstance(expression,CompiledExpression):
+        return expression
+    return compile(expression)
+
+def evaluate_many(expression,flat_dicts):
+    """
+    Evaluate one expression against many flat dictionaries. The expression is
+    only parsed once, and flat_dicts is consumed lazily so it can be an
+    unbounded iterator.
+
+    Args:
+        expression      String or CompiledExpression to evaluate
+        flat_dicts      Iterable of flat dictionaries
+
+    Returns:
+        Generator of Bools, one per flat dictionary
+    """
+    return _compiled(expression).evaluate_many(flat_dicts)
+
+def filter_many(expression,flat_dicts):
+    """
+    Same as evaluate_many, but yields only the flat dictionaries that the
+    expression is true for.
+
+    Args:
+        expression      String or CompiledExpression to evaluate
+        flat_dicts      Iterable of flat dictionaries
+
+    Returns:
+        Generator of matching flat dictionaries
+    """
+    return _compiled(expression).filter(flat_dicts)
@@ -0,0 +1,235 @@
+"""
+Parallel evaluation of large batches of data, with a pool of worker
+processes.
+
+The compiled expression (or RuleSet) is pickled and sent to every worker
+once, when the worker starts. After that only chunks of data and their
+results travel between processes.
+
+For example:
+    compiled=expressionizer.compile('env=prod&role=web')
+    with ParallelEvaluator(compiled,processes=32,chunksize=5000) as pool:
+        for flat_dict in pool.filter(read_records()):
+            print(flat_dict)
+
+Lookup functions (getVal, sub expression functions) are called in the
+workers, so they have to be picklable, IE module level functions rather than
+lambdas or closures.
+"""
+import collections
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from .compiled import CompiledExpression
+from .rules import RuleSet
+
+#What the worker process evaluates, the loader of each item and whether to
+#skip items that fail, set by _initWorker
+_target=None
+_loader=None
+_skip_errors=False
+
+def _initWorker(payload):
+    global _target, _loader, _skip_errors
+    _target,_loader,_skip_errors=pickle.loads(payload)
+
+def _evaluateChunk(chunk):
+    """
+    Runs in the worker processes.
+
+    Args:
+        chunk       List of data to evaluate against
+
+    Returns:
+        List of results, one per item of the chunk
+    """
+    if isinstance(_target,RuleSet):
+        evaluate=_target.match
+    else:
+        evaluate=_target._evaluator()
+    if _loader is None and not _skip_errors:
+        return [ evaluate(data) for data in chunk ]
+    results=[]
+    for item in chunk:
+        try:
+            data=item if _loader is None else _loader(item)
+            results.append(None if data is None else evaluate(data))
+        except Exception:
+            if not _skip_errors:
+                raise
+            results.append(None)
+    return results
+
+class ParallelEvaluator(object):
+    """
+    Evaluates a compiled expression or RuleSet against every item of an
+    iterable, spread over a pool of worker processes.
+
+    Args:
+        target          CompiledExpression or RuleSet to evaluate, or a String
+                        with a FlatDictExpression expression
+        processes       Int with the number of worker processes, defaults to
+                        the number of CPUs
+        chunksize       Int with the number of items sent to a worker at a
+                        time. Bigger chunks cost less overhead per item.
+        ordered         Bool, True to yield results in the order of the input.
+                        When False the results of a chunk are yielded as soon
+                        as it is done, so a slow chunk doesn't hold up the
+                        ones after it.
+        max_pending     Int with the max number of chunks being evaluated or
+                        waiting for a worker, defaults to twice the number of
+                        processes. The input is only read when there is room
+                        for another chunk, so memory use stays bounded for
+                        unbounded iterators.
+        mp_context      multiprocessing context used to start the workers
+        loader          Optional function the workers call on every item to
+                        get the data to evaluate against, IE json.loads so
+                        parsing is done in parallel as well. Items it returns
+                        None for are skipped and get a result of None.
+        skip_errors     Bool, True to give items that the loader or the
+                        evaluation raises an exception for a result of None,
+                        instead of failing the whole chunk
+    """
+    def __init__(self,target,processes=None,chunksize=1000,ordered=True,max_pending=None,mp_context=None,loader=None,skip_errors=False):
+        if isinstance(target,str):
+            from .expressions import compile
+            target=compile(target)
+        if not isinstance(target,(CompiledExpression,RuleSet)):
+            raise TypeError("Can only evaluate a CompiledExpression or RuleSet in parallel: {!r}".format(target))
+        if chunksize < 1:
+            raise ValueError("chunksize must be at least 1: {}".format(chunksize))
+        self.target=target
+        self.processes=processes or os.cpu_count() or 1
+        self.chunksize=chunksize
+        self.ordered=ordered
+        self.max_pending=max_pending or self.processes*2
+        #Pickled up front so anything unpicklable fails here, rather than in
+        #the workers
+        payload=pickle.dumps((target,loader,skip_errors),pickle.HIGHEST_PROTOCOL)
+        self._executor=ProcessPoolExecutor(self.processes,mp_context=mp_context,initializer=_initWorker,initargs=(payload,))
+    def __enter__(self):
+        return self
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+    def close(self):
+        """
+        Shut down the worker processes
+        """
+        self._executor.shutdown()
+    def _chunks(self,iterable):
+        chunk=[]
+        for data in iterable:
+            chunk.append(data)
+            if len(chunk) >= self.chunksize:
+                yield chunk
+                chunk=[]
+        if chunk:
+            yield chunk
+    def evaluate_chunks(self,iterable):
+        """
+        Evaluate against every item of an iterable, a chunk at a time. This
+        is what evaluate_many and filter are built on, for callers that need
+        the items along with their results, IE to count them.
+
+        Args:
+            iterable    Iterable of data to evaluate against
+
+        Returns:
+            Generator of tuples, first element is a List with a chunk of the
+            items, second is a List with their results
+        """
+        submit=self._executor.submit
+        max_pending=self.max_pending
+        if self.ordered:
+            pending=collections.deque()
+            try:
+                for chunk in self._chunks(iterable):
+                    pending.append((chunk,submit(_evaluateChunk,chunk)))
+                    if len(pending) >= max_pending:
+                        chunk,future=pending.popleft()
+                        yield (chunk,future.result())
+                while pending:
+                    chunk,future=pending.popleft()
+                    yield (chunk,future.result())
+            finally:
+                for chunk,future in pending:
+                    future.cancel()
+        else:
+            pending={}
+            try:
+                for chunk in self._chunks(iterable):
+                    pending[submit(_evaluateChunk,chunk)]=chunk
+                    if len(pending) < max_pending:
+                        continue
+                    done=wait(pending,return_when=FIRST_COMPLETED)[0]
+                    for future in done:
+                        yield (pending.pop(future),future.result())
+                while pending:
+                    done=wait(pending,return_when=FIRST_COMPLETED)[0]
+                    for future in done:
+                        yield (pending.pop(future),future.result())
+            finally:
+                for future in pending:
+                    future.cancel()
+    def evaluate_many(self,iterable):
+        """
+        Evaluate against every item of an iterable.
+
+        Args:
+            iterable    Iterable of data to evaluate against, IE flat dicts
+
+        Returns:
+            Generator of results, one per item. For a RuleSet each result is
+            the List match returns.
+        """
+        for chunk,results in self.evaluate_chunks(iterable):
+            for result in results:
+                yield result
+    def filter(self,iterable):
+        """
+        Same as evaluate_many, but yields the items the expression is true
+        for (or that match any rule) instead of the results.
+
+        Args:
+            iterable    Iterable of data to evaluate against, IE flat dicts
+
+        Returns:
+            Generator of matching items
+        """
+        for chunk,results in self.evaluate_chunks(iterable):
+            for data,result in zip(chunk,results):
+                if result:
+                    yield data
+
+def evaluate_parallel(target,iterable,**kwargs):
+    """
+    Evaluate against every item of an iterable with a pool of worker
+    processes that is shut down when done. See ParallelEvaluator for the
+    keyword arguments.
+
+    Args:
+        target      CompiledExpression, RuleSet or String with an expression
+        iterable    Iterable of data to evaluate against, IE flat dicts
+
+    Returns:
+        Generator of results, one per item
+    """
+    with ParallelEvaluator(target,**kwargs) as pool:
+        for result in pool.evaluate_many(iterable):
+            yield result
+
+def filter_parallel(target,iterable,**kwargs):
+    """
+    Same as evaluate_parallel, but yields the matching items instead of the
+    results.
+
+    Args:
+        target      CompiledExpression, RuleSet or String with an expression
+        iterable    Iterable of data to evaluate against, IE flat dicts
+
+    Returns:
+        Generator of matching items
+    """
+    with ParallelEvaluator(target,**kwargs) as pool:
+        for data in pool.filter(iterable):
+            yield data
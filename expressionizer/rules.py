@@ -0,0 +1,602 @@
+import collections
+from .compiled import Leaf, Not, And, fold, _flatten, _unflatten
+from .expressions import FlatDictExpression, WildcardLeaf
+from .trie import IndexedFlatDict
+from .trace import TracerChain, traced
+
+def _children(node):
+    if isinstance(node,Leaf):
+        return ()
+    if isinstance(node,Not):
+        return (node.child,)
+    return node.children
+
+class RuleSet(object):
+    """
+    A collection of expressions (rules) that are all evaluated against the
+    same input, IE a flat dict.
+
+    Rules are compiled together, and identical leaves and sub trees are shared
+    between all of the rules. Each distinct node is evaluated at most once
+    per input, no matter how many rules use it.
+
+    For example:
+        rules=RuleSet({'prod-web': 'env=prod&role=web', 'prod': 'env=prod'})
+        rules.match({'env': 'prod', 'role': 'db'})
+    Would return ['prod'], with env=prod only being compared once.
+
+    Rules are also indexed by the keys they require (see requiredKeys), so
+    only the rules that could possibly be true for the keys in the input are
+    evaluated.
+
+    Args:
+        rules           Dict of rule id to expression, or an iterable of
+                        (rule id, expression) tuples
+        expression      Conditional expression object used to compile and
+                        evaluate the rules. Defaults to a FlatDictExpression
+    """
+    #Number of distinct wildcard keys (IE net.*.up) from which match indexes
+    #the keys of a plain dict once, as an IndexedFlatDict, rather than have
+    #every wildcard check every key. Indexing costs about as much as
+    #checking every key 8 times.
+    index_wildcards=8
+    #Tracer attached with setTracer
+    _tracer=None
+    def __init__(self,rules=None,expression=None):
+        if expression is None:
+            expression=FlatDictExpression()
+        self.expression=expression
+        self._reset()
+        if rules:
+            if isinstance(rules,dict):
+                rules=rules.items()
+            for rule_id,rule in rules:
+                self.add(rule_id,rule)
+    def __len__(self):
+        return len(self.rules)
+    def __contains__(self,rule_id):
+        return rule_id in self.rules
+    def _reset(self):
+        """
+        Start out with no rules, and nothing indexed from them
+        """
+        self.rules={}
+        #Canonical copy of every distinct node in the rule set, and how many
+        #parents and rules use each one
+        self._nodes={}
+        self._refs={}
+        #Order rules were added in, and the keys each rule needs
+        self._order={}
+        self._required={}
+        #Index of a single required key to the rules it was picked for, the
+        #key picked for each rule, and rules that have no required keys
+        self._index={}
+        self._anchors={}
+        self._unindexed=set()
+        self._seq=0
+        #Number of distinct wildcard leaves
+        self._wildcards=0
+    def __getstate__(self):
+        #A traced _evalNode is a closure, and can't be pickled, so tracing
+        #stops with pickling
+        state=self.__dict__.copy()
+        state.pop('_evalNode',None)
+        state.pop('_tracer',None)
+        #The nodes are pickled once each as a flat list, which trees of any
+        #depth can be pickled as, and everything _reset starts out is built
+        #from them again when unpickling
+        blank=object.__new__(self.__class__)
+        blank._reset()
+        for name in blank.__dict__:
+            del state[name]
+        order=sorted(self.rules,key=self._order.__getitem__)
+        records,indexes=_flatten([ self.rules[rule_id] for rule_id in order ])
+        state['_flattened']=(records,[ (rule_id,index,self._required[rule_id]) for rule_id,index in zip(order,indexes) ])
+        return state
+    def __setstate__(self,state):
+        state=dict(state)
+        records,rules=state.pop('_flattened')
+        self.__dict__.update(state)
+        self._reset()
+        nodes=_unflatten(records)
+        self._setNodes(nodes)
+        for rule_id,index,required in rules:
+            self._addRoot(rule_id,nodes[index],required)
+    def _intern(self,node):
+        """
+        Swap a node, and everything under it, for the canonical copy that is
+        shared with the other rules.
+
+        Args:
+            node    Node to intern
+
+        Returns:
+            Node
+        """
+        nodes=self._nodes
+        def intern(n,children):
+            if isinstance(n,Not):
+                n=Not(children[0],n.subexpr)
+            elif not isinstance(n,Leaf):
+                n=n.__class__(children)
+            try:
+                return nodes[n]
+            except KeyError:
+                self._track(n)
+                return n
+        return fold(node,intern)
+    def _track(self,node):
+        """
+        Add a node to the canonical copies, its children must be there
+        already.
+
+        Args:
+            node    Node no rule uses yet
+        """
+        self._nodes[node]=node
+        self._refs[node]=0
+        for c in _children(node):
+            self._refs[c]+=1
+        if isinstance(node,WildcardLeaf):
+            self._wildcards+=1
+    def _setNodes(self,nodes):
+        """
+        Use nodes that have been interned already as the canonical copies, IE
+        the nodes of a bundle, so adding their rules doesn't intern them
+        again.
+
+        Args:
+            nodes   List of every node of the rules about to be added,
+                    children before their parents
+        """
+        for n in nodes:
+            self._track(n)
+    def _release(self,root):
+        """
+        Drop a root that lost a user once nothing uses it, and the same for
+        everything under it.
+
+        Args:
+            root    Interned Node
+        """
+        refs=self._refs
+        stack=[root]
+        while stack:
+            n=stack.pop()
+            refs[n]-=1
+            if refs[n]:
+                continue
+            del refs[n]
+            del self._nodes[n]
+            if isinstance(n,WildcardLeaf):
+                self._wildcards-=1
+            self._dropped(n)
+            stack.extend(_children(n))
+    def _dropped(self,node):
+        """
+        Called for every node that is no longer used by any rule, for
+        subclasses that keep more about nodes.
+
+        Args:
+            node    Node that was dropped
+        """
+        pass
+    def add(self,rule_id,expression):
+        """
+        Compile an expression and add it to the rule set. Adding a rule id
+        that already exists replaces it.
+
+        Args:
+            rule_id     Hashable id of the rule, returned by match
+            expression  String with the expression of the rule
+        """
+        self._addRoot(rule_id,self.expression._parse(expression))
+    def _addRoot(self,rule_id,root,required=None):
+        """
+        Add a rule that has already been parsed, IE loaded from a bundle.
+
+        Args:
+            rule_id     Hashable id of the rule
+            root        Root Node of the parsed expression
+            required    Set of the keys the rule requires, when already known
+        """
+        if self._nodes.get(root) is not root:
+            root=self._intern(root)
+        #Used before the rule it replaces is removed, so nodes the two have
+        #in common are kept
+        self._refs[root]+=1
+        if rule_id in self.rules:
+            self.remove(rule_id)
+        self.rules[rule_id]=root
+        self._order[rule_id]=self._seq
+        self._seq+=1
+        if required is None:
+            required=self.expression.requiredKeys(root)
+        self._required[rule_id]=required
+        if required:
+            #Index on the key with the fewest rules, to keep lookups narrow
+            key=min(required,key=lambda k: len(self._index.get(k,())))
+            self._index.setdefault(key,set()).add(rule_id)
+            self._anchors[rule_id]=key
+        else:
+            self._unindexed.add(rule_id)
+    def remove(self,rule_id):
+        """
+        Remove a rule from the rule set.
+
+        Args:
+            rule_id     Id of the rule to remove
+        """
+        root=self.rules.pop(rule_id)
+        del self._order[rule_id]
+        self._required.pop(rule_id)
+        self._unindexed.discard(rule_id)
+        key=self._anchors.pop(rule_id,None)
+        if key is not None:
+            rule_ids=self._index[key]
+            rule_ids.discard(rule_id)
+            if not rule_ids:
+                del self._index[key]
+        self._release(root)
+    def candidates(self,data):
+        """
+        Find the rules that could be true for the keys in the input, IE every
+        key they require is present.
+
+        Args:
+            data    Data to evaluate against, IE a flat dict
+
+        Returns:
+            List of rule ids, in the order they were added
+        """
+        index=self._index
+        required=self._required
+        found=list(self._unindexed)
+        if len(data) < len(index):
+            keys=[ k for k in data if k in index ]
+        else:
+            keys=[ k for k in index if k in data ]
+        for key in keys:
+            for rule_id in index[key]:
+                if all(k in data for k in required[rule_id]):
+                    found.append(rule_id)
+        found.sort(key=self._order.__getitem__)
+        return found
+    def nodeCount(self):
+        """
+        Returns:
+            Int with the number of distinct nodes shared by the rules
+        """
+        return len(self._nodes)
+    def setTracer(self,tracer):
+        """
+        Attach a tracer (see expressionizer.trace) that is told about every
+        node evaluated by match. Nodes shared between rules are only reported
+        once per input, like they are only evaluated once, except with a
+        budget.
+
+        Args:
+            tracer      Tracer object, or None to stop tracing
+        """
+        if tracer is None:
+            self.__dict__.pop('_evalNode',None)
+            self.__dict__.pop('_tracer',None)
+            return
+        self._tracer=tracer
+        evaluate=RuleSet._evalNode.__get__(self)
+        traced_evaluate=traced(evaluate,tracer)
+        def _evalNode(node,data,memo):
+            if id(node) in memo:
+                return memo[id(node)]
+            return traced_evaluate(node,data,memo)
+        self._evalNode=_evalNode
+    def _evalNode(self,node,data,memo):
+        """
+        Evaluate a node, reusing the result when the node has already been
+        evaluated for this input.
+
+        Args:
+            node    Node to evaluate
+            data    Data the leaves are evaluated against
+            memo    Dict of id(node) to the result for this input
+
+        Returns:
+            Bool
+        """
+        key=id(node)
+        try:
+            return memo[key]
+        except KeyError:
+            pass
+        if isinstance(node,Leaf):
+            result=bool(self.expression._leafVal(node,data))
+        elif isinstance(node,Not):
+            result=not self._evalNode(node.child,data,memo)
+        elif isinstance(node,And):
+            result=True
+            for c in node.children:
+                if not self._evalNode(c,data,memo):
+                    result=False
+                    break
+        else:
+            result=False
+            for c in node.children:
+                if self._evalNode(c,data,memo):
+                    result=True
+                    break
+        memo[key]=result
+        return result
+    def match(self,data=None,budget=None):
+        """
+        Evaluate every rule against the input.
+
+        Args:
+            data    Data to evaluate against, IE a flat dict
+            budget  Optional Budget (see expressionizer.budget) for the whole
+                    match. With a budget every node is charged for, so
+                    results aren't shared between rules.
+
+        Returns:
+            List of the ids of the rules that are true, in the order they
+            were added
+
+        Raises:
+            EvaluationTimeout when the budget runs out
+        """
+        if data is None:
+            data=self.expression.flat_dict
+        if self._wildcards >= self.index_wildcards and type(data) is dict:
+            data=IndexedFlatDict(data)
+        if budget is not None:
+            budget.start()
+            tracer=budget
+            if self._tracer is not None:
+                tracer=TracerChain(budget,self._tracer)
+            evalIterative=self.expression._evalIterative
+            rules=self.rules
+            return [ rule_id for rule_id in self.candidates(data) if evalIterative(rules[rule_id],data,tracer) ]
+        memo={}
+        evaluate=self._evalNode
+        rules=self.rules
+        max_depth=self.expression.max_recursion_depth
+        matched=[]
+        for rule_id in self.candidates(data):
+            root=rules[rule_id]
+            if root.depth > max_depth:
+                #Too deep to recurse, evaluated without sharing results
+                if self.expression._evalIterative(root,data):
+                    matched.append(rule_id)
+            elif evaluate(root,data,memo):
+                matched.append(rule_id)
+        return matched
+
+class WatchedRuleSet(RuleSet):
+    """
+    A RuleSet that is kept evaluated against a single long lived flat dict,
+    and re-evaluates only what a change to the dict affects.
+
+    The result of every distinct node is kept, along with the number of its
+    children that are true, and the leaves are indexed by the key they
+    depend on (see requiredKeys). An update re-evaluates the leaves of the
+    changed keys, and only walks up from the leaves whose result flipped, so
+    the cost depends on the size of the change instead of the number of
+    rules.
+
+    For example:
+        rules=WatchedRuleSet({'old': 'key2.foo.version<0.0.5'},data=flat_dict)
+        rules.subscribe(lambda rule_id,result: print(rule_id,result))
+        rules.update({'key2.foo.version': '0.0.5'})
+    Would return [('old', False)], and call the subscriber with the same.
+
+    Leaves of sub expressions don't depend on the dict, and are only
+    evaluated when a rule is added.
+
+    Args:
+        rules           Dict of rule id to expression, or an iterable of
+                        (rule id, expression) tuples
+        expression      Conditional expression object used to compile and
+                        evaluate the rules. Defaults to a FlatDictExpression
+        data            Dict to evaluate against, it is copied
+    """
+    def __init__(self,rules=None,expression=None,data=None):
+        if isinstance(data,IndexedFlatDict):
+            self.data=data.copy()
+        else:
+            self.data=dict(data or {})
+        self._subscribers=[]
+        RuleSet.__init__(self,rules,expression)
+    def _reset(self):
+        RuleSet._reset(self)
+        #Result of every node, the number of true children of And/Or/Not
+        #nodes, and the nodes each node is a child of
+        self._values={}
+        self._counts={}
+        self._parents={}
+        #Leaves that depend on each key, leaves that don't depend on a single
+        #key (IE wildcards), and the rules each root belongs to
+        self._leaves={}
+        self._unkeyed=set()
+        self._roots={}
+    def _combine(self,node,count):
+        """
+        Args:
+            node    And, Or or Not node
+            count   Int with the number of true children
+
+        Returns:
+            Bool result of the node
+        """
+        if isinstance(node,And):
+            return count == len(node.children)
+        if isinstance(node,Not):
+            return count == 0
+        return count > 0
+    def _attach(self,root):
+        """
+        Start tracking a node, and everything under it that isn't tracked
+        already.
+
+        Args:
+            root    Interned Node
+        """
+        values=self._values
+        expression=self.expression
+        stack=[(root,False)]
+        while stack:
+            n,ready=stack.pop()
+            if n in values:
+                continue
+            children=_children(n)
+            if not ready:
+                stack.append((n,True))
+                stack.extend((c,False) for c in children if c not in values)
+                continue
+            if isinstance(n,Leaf):
+                values[n]=bool(expression._leafVal(n,self.data))
+                key=expression._leafKey(n)
+                if key is not None:
+                    self._leaves.setdefault(key,set()).add(n)
+                elif not n.subexpr:
+                    self._unkeyed.add(n)
+            else:
+                count=0
+                for c in children:
+                    self._parents.setdefault(c,[]).append(n)
+                    if values[c]:
+                        count+=1
+                self._counts[n]=count
+                values[n]=self._combine(n,count)
+    def _dropped(self,node):
+        #Stop tracking a node no rule uses anymore
+        del self._values[node]
+        if isinstance(node,Leaf):
+            key=self.expression._leafKey(node)
+            if key is not None:
+                leaves=self._leaves[key]
+                leaves.discard(node)
+                if not leaves:
+                    del self._leaves[key]
+            else:
+                self._unkeyed.discard(node)
+            return
+        del self._counts[node]
+        for c in _children(node):
+            parents=self._parents[c]
+            parents.remove(node)
+            if not parents:
+                del self._parents[c]
+    def _addRoot(self,rule_id,root,required=None):
+        RuleSet._addRoot(self,rule_id,root,required)
+        root=self.rules[rule_id]
+        self._attach(root)
+        self._roots.setdefault(root,set()).add(rule_id)
+    def remove(self,rule_id):
+        root=self.rules[rule_id]
+        rule_ids=self._roots[root]
+        rule_ids.discard(rule_id)
+        if not rule_ids:
+            del self._roots[root]
+        RuleSet.remove(self,rule_id)
+    def subscribe(self,callback):
+        """
+        Have a function called for every rule whose result flips on update.
+
+        Args:
+            callback    Function taking the rule id and the new Bool result
+        """
+        self._subscribers.append(callback)
+    def unsubscribe(self,callback):
+        """
+        Args:
+            callback    Function passed to subscribe
+        """
+        self._subscribers.remove(callback)
+    def result(self,rule_id):
+        """
+        Args:
+            rule_id     Id of a rule
+
+        Returns:
+            Bool with the current result of the rule
+        """
+        return self._values[self.rules[rule_id]]
+    def results(self):
+        """
+        Returns:
+            List of the ids of the rules that are currently true, in the
+            order they were added
+        """
+        values=self._values
+        rules=self.rules
+        return [ rule_id for rule_id in sorted(rules,key=self._order.__getitem__) if values[rules[rule_id]] ]
+    def match(self,data=None,budget=None):
+        """
+        Same as RuleSet.match, but evaluates against the watched dict when no
+        data is given. results returns the same without evaluating anything.
+        """
+        if data is None:
+            data=self.data
+        return RuleSet.match(self,data,budget)
+    def update(self,changes=None,removed=None):
+        """
+        Change keys of the dict, and re-evaluate what depends on them.
+
+        Args:
+            changes     Dict of keys to set to new values
+            removed     Iterable of keys to remove from the dict
+
+        Returns:
+            List of (rule id, Bool result) tuples for the rules whose result
+            flipped, in the order the rules were added
+        """
+        data=self.data
+        index=self._leaves
+        dependsOn=self.expression._leafDependsOn
+        leaves=set()
+        keys=[]
+        if changes:
+            for key,value in changes.items():
+                data[key]=value
+                keys.append(key)
+        if removed:
+            for key in removed:
+                data.pop(key,None)
+                keys.append(key)
+        for key in keys:
+            leaves.update(index.get(key,()))
+            if self._unkeyed:
+                leaves.update(l for l in self._unkeyed if dependsOn(l,key))
+        values=self._values
+        counts=self._counts
+        parents=self._parents
+        roots=self._roots
+        #Every flip of a node, with its new result. A node can flip more than
+        #once before the update settles, so each flip is passed on separately.
+        queue=collections.deque()
+        for leaf in leaves:
+            value=bool(self.expression._leafVal(leaf,data))
+            if value != values[leaf]:
+                values[leaf]=value
+                queue.append((leaf,value))
+        before={}
+        while queue:
+            n,value=queue.popleft()
+            if n in roots and n not in before:
+                before[n]=not value
+            delta=1 if value else -1
+            for p in parents.get(n,()):
+                counts[p]+=delta
+                p_value=self._combine(p,counts[p])
+                if p_value != values[p]:
+                    values[p]=p_value
+                    queue.append((p,p_value))
+        flipped=[]
+        for root,value in before.items():
+            if values[root] != value:
+                for rule_id in roots[root]:
+                    flipped.append((rule_id,values[root]))
+        flipped.sort(key=lambda f: self._order[f[0]])
+        for callback in self._subscribers:
+            for rule_id,value in flipped:
+                callback(rule_id,value)
+        return flipped
@@ -0,0 +1,337 @@
+"""
+Regular expressions for the "~" operator that can't backtrack
+catastrophically, used when FlatDictExpression.safe_regex is set.
+
+When the re2 module (google-re2) is installed, patterns are compiled with it,
+which matches in linear time and rejects what it can't do that way, IE
+backreferences. Otherwise patterns are checked when they are compiled, and
+rejected with a ValueError when they use:
+    - Backreferences, IE (a)\\1
+    - Lookahead or lookbehind, IE (?=a)
+    - A repeat inside a repeat, when either can repeat a varying number of
+      times, IE (a+)+, (a{2})*, (a{1,20}){1,20}, (a{1,20}){20} or (a?){25}
+    - Alternatives inside a repeat, unless each starts, or ends, with its own
+      literal, IE (a|aa)*, (a|a)* or (ab|ab){10}
+    - Repeats of a varying number of times in a row that can match the same
+      text, without a literal only the first can't match between them, IE
+      .*a.*b, \\d*\\d+ or \\w{0,1000}\\w{0,1000}. Bounded repeats count
+      as well, since a run of them backtracks polynomially in their bounds.
+These are the constructs that make the backtracking of the re module
+exponential or polynomial. Repeats inside repeats are allowed when every
+repetition has to start, or end, with a literal that nothing else in it can
+match, IE (\\.[0-9]+)*, (foo|bar)+ or ([0-9]{1,3}\\.){3}, since the
+repetitions can't overlap. Everything else is compiled with the re module as
+usual.
+"""
+import re
+
+try:
+    from re import _parser as _sre_parse
+    from re import _constants as _sre
+except ImportError:
+    import sre_parse as _sre_parse
+    import sre_constants as _sre
+
+try:
+    import re2
+except ImportError:
+    re2=None
+
+_repeats=set(getattr(_sre,name) for name in ('MAX_REPEAT','MIN_REPEAT','POSSESSIVE_REPEAT') if hasattr(_sre,name))
+_lookarounds=(_sre.ASSERT,_sre.ASSERT_NOT)
+_backrefs=(_sre.GROUPREF,_sre.GROUPREF_EXISTS)
+
+_categories={}
+
+def _categoryMatches(category,char):
+    try:
+        regex=_categories[category]
+    except KeyError:
+        name=str(category).upper()
+        negate='NOT_' in name
+        if 'DIGIT' in name:
+            source='\\d'
+        elif 'SPACE' in name:
+            source='\\s'
+        elif 'WORD' in name:
+            source='\\w'
+        else:
+            #Line breaks, assume anything
+            source='(?s).'
+            negate=False
+        if negate:
+            source=source.upper()
+        regex=_categories[category]=re.compile(source)
+    return regex.match(char) is not None
+
+def _canMatch(items,code):
+    """
+    Args:
+        items       Parsed sub pattern
+        code        Int with the code of a character
+
+    Returns:
+        Bool, False only when no part of the sub pattern can match the
+        character, in either case
+    """
+    char=chr(code)
+    codes=set((code,ord(char.lower()[0]),ord(char.upper()[0])))
+    for op,av in items:
+        if op == _sre.LITERAL:
+            if av in codes:
+                return True
+        elif op == _sre.NOT_LITERAL:
+            if codes != set((av,)):
+                return True
+        elif op == _sre.IN:
+            negate=False
+            found=False
+            for in_op,in_av in av:
+                if in_op == _sre.NEGATE:
+                    negate=True
+                elif in_op == _sre.LITERAL:
+                    found=found or in_av in codes
+                elif in_op == _sre.RANGE:
+                    found=found or any(in_av[0] <= c <= in_av[1] for c in codes)
+                elif in_op == _sre.CATEGORY:
+                    found=found or any(_categoryMatches(in_av,chr(c)) for c in codes)
+                else:
+                    return True
+            if found != negate:
+                return True
+        elif op == _sre.AT:
+            continue
+        elif op in _repeats:
+            if _canMatch(av[2],code):
+                return True
+        elif op == _sre.SUBPATTERN:
+            if _canMatch(av[-1],code):
+                return True
+        elif op == _sre.BRANCH:
+            if any(_canMatch(b,code) for b in av[1]):
+                return True
+        else:
+            return True
+    return False
+
+def _startsWith(items):
+    """
+    Args:
+        items       Parsed sub pattern
+
+    Returns:
+        Tuple of the code of the literal character the sub pattern has to
+        start with, and the parsed rest of it. None when it doesn't have to
+        start with a literal.
+    """
+    if not len(items):
+        return None
+    op,av=items[0]
+    rest=list(items[1:])
+    if op == _sre.LITERAL:
+        return (av,rest)
+    if op == _sre.SUBPATTERN:
+        first=_startsWith(av[-1])
+        if first is not None:
+            return (first[0],first[1]+rest)
+    return None
+
+def _endsWith(items):
+    """
+    Args:
+        items       Parsed sub pattern
+
+    Returns:
+        Tuple of the code of the literal character the sub pattern has to
+        end with, and the parsed rest of it. None when it doesn't have to
+        end with a literal.
+    """
+    if not len(items):
+        return None
+    op,av=items[-1]
+    rest=list(items[:-1])
+    if op == _sre.LITERAL:
+        return (av,rest)
+    if op == _sre.SUBPATTERN:
+        last=_endsWith(av[-1])
+        if last is not None:
+            return (last[0],rest+last[1])
+    return None
+
+def _distinctLiterals(ends):
+    """
+    Args:
+        ends        List of the results of _startsWith or _endsWith for every
+                    alternative of a sub pattern
+
+    Returns:
+        Bool, True when every alternative has its own literal, that no part
+        of any alternative can match
+    """
+    if None in ends:
+        return False
+    literals=[ e[0] for e in ends ]
+    if len(set(literals)) != len(literals):
+        return False
+    for literal in literals:
+        for e in ends:
+            if _canMatch(e[1],literal):
+                return False
+    return True
+
+def _separated(items):
+    """
+    Whether every match of a repeated sub pattern starts, or ends, with its
+    own literal, that nothing else in it can match. Repeats of such a sub
+    pattern can't backtrack into each other.
+
+    Args:
+        items       Parsed sub pattern
+
+    Returns:
+        Bool
+    """
+    if len(items) == 1 and items[0][0] == _sre.BRANCH:
+        branches=items[0][1][1]
+    elif len(items) == 1 and items[0][0] == _sre.SUBPATTERN:
+        return _separated(items[0][1][-1])
+    else:
+        branches=[items]
+    return _distinctLiterals([ _startsWith(b) for b in branches ]) or _distinctLiterals([ _endsWith(b) for b in branches ])
+
+#Characters tried when checking if two repeats can match the same text
+_sample_codes=list(range(128))+[0xe9,0x3b1,0x4e00]
+
+def _overlaps(first,second):
+    """
+    Args:
+        first       Parsed sub pattern of a repeat
+        second      Parsed sub pattern of a later repeat
+
+    Returns:
+        Bool, True when the first repeat can match what the second one
+        starts with, so text between them could go to either
+    """
+    end=_endsWith(first)
+    if end is not None and not _canMatch(second,end[0]):
+        #The first repeat ends at the last of its literal, which the second
+        #can't match
+        return False
+    start=_startsWith(second)
+    if start is not None:
+        return _canMatch(first,start[0])
+    return any(_canMatch(first,c) and _canMatch(second,c) for c in _sample_codes)
+
+def _varies(items):
+    """
+    Args:
+        items       Parsed sub pattern
+
+    Returns:
+        Bool, True when the sub pattern has a repeat that can repeat a
+        varying number of times
+    """
+    for op,av in items:
+        if op in _repeats:
+            if av[0] != av[1] or _varies(av[2]):
+                return True
+        elif op == _sre.SUBPATTERN:
+            if _varies(av[-1]):
+                return True
+        elif op == _sre.BRANCH:
+            if any(_varies(b) for b in av[1]):
+                return True
+        elif isinstance(av,_sre_parse.SubPattern):
+            if _varies(av):
+                return True
+    return False
+
+def _unsafe(items,repeat,repeated=False):
+    """
+    Args:
+        items       Parsed sub pattern
+        repeat      None when not inside a repeat whose repetitions can
+                    overlap, otherwise Bool, True when the innermost repeat
+                    can repeat a varying number of times
+        repeated    Bool, True when inside any repeat
+
+    Returns:
+        String with the reason the sub pattern is unsafe, or None
+    """
+    #Repeats earlier in the sequence that text could still be split with
+    pending=[]
+    for op,av in items:
+        reason=None
+        if op in _backrefs:
+            return 'backreferences'
+        if op in _lookarounds:
+            return 'lookaround'
+        if op in _repeats:
+            low,high,sub=av
+            varies=low != high
+            #An optional repeat inside a counted one still varies, IE (a?){25}
+            if repeat is not None and (repeat and high > 1 or varies):
+                return 'a repeat inside a repeat'
+            #Even a counted repeat has to be checked, IE (a?){25}a{25}
+            for p in pending:
+                if _overlaps(p,sub):
+                    return 'repeats that can match the same text'
+            if varies or _varies(sub):
+                pending.append(sub)
+            if high <= 1:
+                reason=_unsafe(sub,repeat,repeated)
+            elif _separated(sub):
+                reason=_unsafe(sub,None,True)
+            else:
+                reason=_unsafe(sub,varies,True)
+        elif op == _sre.LITERAL:
+            #Text can't be split across a literal the repeat can't match
+            pending=[ p for p in pending if _canMatch(p,av) ]
+        elif op == _sre.BRANCH:
+            #The parser moves what alternatives start with in common out of
+            #them, IE (a|a) is parsed as a followed by two empty ones
+            if repeat or (repeated and not _separated([(op,av)])):
+                return 'alternatives inside a repeat that can match the same way'
+            for b in av[1]:
+                reason=reason or _unsafe(b,repeat,repeated)
+        elif op == _sre.SUBPATTERN:
+            reason=_unsafe(av[-1],repeat,repeated)
+        elif isinstance(av,_sre_parse.SubPattern):
+            #IE atomic groups
+            reason=_unsafe(av,repeat,repeated)
+        if reason:
+            return reason
+    return None
+
+def check_pattern(pattern):
+    """
+    Check that a pattern can't backtrack catastrophically.
+
+    Args:
+        pattern     String with the regular expression
+
+    Raises:
+        ValueError when the pattern uses one of the constructs that can
+    """
+    reason=_unsafe(_sre_parse.parse(pattern),None)
+    if reason:
+        raise ValueError("Regular expression uses {}, which isn't allowed in safe mode: {}".format(reason,pattern))
+
+def compile_safe(pattern):
+    """
+    Args:
+        pattern     String with the regular expression
+
+    Returns:
+        Compiled pattern object with a match method
+
+    Raises:
+        ValueError when the pattern isn't safe
+    """
+    if re2 is not None:
+        try:
+            return re2.compile(pattern)
+        except re2.error as e:
+            raise ValueError("Regular expression isn't supported in safe mode ({}): {}".format(e,pattern))
+    check_pattern(pattern)
+    return re.compile(pattern)
@@ -0,0 +1,114 @@
+"""
+Tracing of compiled expression evaluation.
+
+A tracer is attached with setTracer() on an expression (or RuleSet), and is
+called with every node that gets evaluated. When no tracer is attached the
+evaluator runs exactly the same code as without tracing support, so it costs
+nothing.
+
+For example:
+    tracer=StatsTracer()
+    expression.setTracer(tracer)
+    expression.processExpression('key1.subkey2=bob&key2.foo.enabled')
+    for stat in tracer.report(10):
+        print(stat)
+"""
+import time
+
+_clock=time.perf_counter
+
+class Tracer(object):
+    """
+    This is a base class for others to inherit from for receiving the result
+    of every node evaluated.
+    """
+    def record(self,node,result,elapsed):
+        """
+        Called after a node has been evaluated.
+
+        Args:
+            node        Node that was evaluated, a Leaf or a group (And, Or, Not)
+            result      The result of evaluating the node
+            elapsed     Float with the wall time in seconds spent evaluating
+                        the node, including any of its children
+        """
+        raise NotImplementedError
+
+class StatsTracer(Tracer):
+    """
+    Collects call counts, true counts and wall time per node, to find the
+    hot or slow parts of an expression or rule set.
+    """
+    def __init__(self):
+        #Node -> [calls, true results, total time]
+        self.stats={}
+    def record(self,node,result,elapsed):
+        try:
+            stat=self.stats[node]
+        except KeyError:
+            stat=self.stats[node]=[0,0,0.0]
+        stat[0]+=1
+        if result:
+            stat[1]+=1
+        stat[2]+=elapsed
+    def reset(self):
+        """
+        Throw away everything collected so far
+        """
+        self.stats={}
+    def report(self,top=None):
+        """
+        Args:
+            top     Int with the max number of nodes to report on
+
+        Returns:
+            List of dicts with the node, calls, true count, total time and
+            mean time, slowest total time first
+        """
+        report=[]
+        for node,stat in self.stats.items():
+            report.append({
+                'node': node,
+                'calls': stat[0],
+                'true': stat[1],
+                'total_time': stat[2],
+                'mean_time': stat[2]/stat[0],
+            })
+        report.sort(key=lambda r: r['total_time'],reverse=True)
+        if top is not None:
+            report=report[:top]
+        return report
+
+class TracerChain(Tracer):
+    """
+    Passes every node on to several tracers, in order. A tracer that raises
+    stops the ones after it from getting the node.
+
+    Args:
+        tracers     Tracer objects
+    """
+    def __init__(self,*tracers):
+        self.tracers=tracers
+    def record(self,node,result,elapsed):
+        for tracer in self.tracers:
+            tracer.record(node,result,elapsed)
+
+def traced(evaluate,tracer):
+    """
+    Wrap a node evaluation function, so the tracer gets the result and wall
+    time of every node it evaluates.
+
+    Args:
+        evaluate    Function taking a node as the first argument
+        tracer      Tracer
+
+    Returns:
+        Function with the same signature as evaluate
+    """
+    record=tracer.record
+    def traced_evaluate(node,*args):
+        start=_clock()
+        result=evaluate(node,*args)
+        record(node,result,_clock()-start)
+        return result
+    return traced_evaluate
@@ -0,0 +1,136 @@
+"""
+Prefix trie of flat dict keys, used to find the keys that match a wildcard
+key path like "net.*.up" without scanning every key.
+
+For example:
+    flat_dict=IndexedFlatDict({'net.eth0.up': True, 'net.eth1.up': False})
+    flat_dict['net.eth2.up']=True
+    FlatDictExpression().compile('net.*.up').evaluate(flat_dict)
+Would result in True, after looking at just the keys under "net".
+"""
+
+class KeyTrie(object):
+    """
+    A trie of keys split into their segments. Every node is a Dict of
+    segment to child node, and a node a whole key ends at holds the key under
+    None.
+
+    Args:
+        keys        Iterable of keys to add up front
+        separator   String the segments of a key are separated by
+    """
+    def __init__(self,keys=None,separator='.'):
+        self.separator=separator
+        self._root={}
+        if keys:
+            for key in keys:
+                self.add(key)
+    def add(self,key):
+        """
+        Args:
+            key     String key to add
+        """
+        node=self._root
+        for segment in key.split(self.separator):
+            try:
+                node=node[segment]
+            except KeyError:
+                child=node[segment]={}
+                node=child
+        node[None]=key
+    def discard(self,key):
+        """
+        Remove a key, if it is in the trie. Nodes left without any keys under
+        them are removed as well.
+
+        Args:
+            key     String key to remove
+        """
+        path=[]
+        node=self._root
+        for segment in key.split(self.separator):
+            try:
+                child=node[segment]
+            except KeyError:
+                return
+            path.append((node,segment))
+            node=child
+        if node.pop(None,None) is None:
+            return
+        for parent,segment in reversed(path):
+            if parent[segment]:
+                break
+            del parent[segment]
+    def clear(self):
+        self._root={}
+    def match(self,pattern):
+        """
+        Find the keys that match a pattern.
+
+        Args:
+            pattern     Tuple of segments, where '*' matches any one segment
+
+        Returns:
+            List of the matching keys
+        """
+        nodes=[self._root]
+        for segment in pattern:
+            if segment == '*':
+                nodes=[ child for n in nodes for s,child in n.items() if s is not None ]
+            else:
+                nodes=[ n[segment] for n in nodes if segment in n ]
+            if not nodes:
+                return []
+        return [ n[None] for n in nodes if None in n ]
+
+class IndexedFlatDict(dict):
+    """
+    A flat dict that keeps a KeyTrie of its keys up to date, so wildcard
+    key paths are resolved through the trie instead of a scan over every
+    key. It can be used anywhere a flat dict is.
+
+    Keys that aren't Strings are stored, but not indexed.
+
+    Args:
+        Same as dict
+    """
+    def __init__(self,*args,**kwargs):
+        dict.__init__(self,*args,**kwargs)
+        self.trie=KeyTrie(k for k in self if isinstance(k,str))
+    def __reduce__(self):
+        #The trie is rebuilt rather than pickled
+        return (self.__class__,(dict(self),))
+    def __setitem__(self,key,value):
+        if isinstance(key,str) and key not in self:
+            self.trie.add(key)
+        dict.__setitem__(self,key,value)
+    def __delitem__(self,key):
+        dict.__delitem__(self,key)
+        if isinstance(key,str):
+            self.trie.discard(key)
+    def update(self,*args,**kwargs):
+        for key,value in dict(*args,**kwargs).items():
+            self[key]=value
+    def setdefault(self,key,default=None):
+        if key not in self:
+            self[key]=default
+        return self[key]
+    def pop(self,key,*default):
+        if key not in self:
+            return dict.pop(self,key,*default)
+        value=self[key]
+        del self[key]
+        return value
+    def popitem(self):
+        key,value=dict.popitem(self)
+        if isinstance(key,str):
+            self.trie.discard(key)
+        return (key,value)
+    def __ior__(self,other):
+        self.update(other)
+        return self
+    def clear(self):
+        dict.clear(self)
+        self.trie.clear()
+    def copy(self):
+        return self.__class__(self)
@@ -1,9 +1,15 @@
-from distutils.core import setup
+from setuptools import setup
 setup(
     name='expressionizer',
     version='0.2.1',
     description='Library for creating complicated expressions based on some input.',
     author='Dan Farnsworth',
     author_email='absltkaos@gmail.com',
-    packages=['expressionizer']
+    packages=['expressionizer'],
+    python_requires='>=3.7',
+    entry_points={
+        'console_scripts': [
+            'expressionizer=expressionizer.cli:main',
+        ],
+    },
 )
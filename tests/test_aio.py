@@ -0,0 +1,90 @@
+import asyncio
+import contextvars
+import unittest
+from expressionizer import BaseSetExpression, FlatDictExpression
+from expressionizer.base import _prefetched
+
+SETS={
+    'red': {
+        'all': set(range(1,9)),
+        'a': set([1,2,5,6]),
+        'b': set([2,3,6,7]),
+        'c': set([5,6,7,8]),
+    },
+    'blue': {
+        'all': set(range(1,9)),
+        'a': set([3,4]),
+        'b': set([4,8]),
+        'c': set([1]),
+    },
+}
+tenant=contextvars.ContextVar('tenant',default='red')
+
+class PlainSetExpression(BaseSetExpression):
+    def getSet(self,name):
+        return set(SETS[tenant.get()][name])
+
+class AsyncSetExpression(BaseSetExpression):
+    def __init__(self):
+        BaseSetExpression.__init__(self)
+        self.running=0
+        self.max_running=0
+        self.calls=0
+    async def getSet(self,name):
+        self.calls+=1
+        self.running+=1
+        self.max_running=max(self.max_running,self.running)
+        try:
+            #Let the other lookups start
+            await asyncio.sleep(0.001)
+            return set(SETS[tenant.get()][name])
+        finally:
+            self.running-=1
+
+EXPRESSIONS=['a&!b','a|b|c','!(a|c)&b','(a&b)|(!c&a)','!a']
+
+class AsyncTest(unittest.TestCase):
+    def test_same_as_sync(self):
+        plain=PlainSetExpression()
+        expression=AsyncSetExpression()
+        for e in EXPRESSIONS:
+            self.assertEqual(asyncio.run(expression.processExpressionAsync(e)),plain.processExpression(e),e)
+    def test_concurrency_bound(self):
+        expression=AsyncSetExpression()
+        asyncio.run(expression.processExpressionAsync('a|b|c|!a',concurrency=2))
+        self.assertEqual(expression.max_running,2)
+        expression=AsyncSetExpression()
+        expression.async_concurrency=1
+        asyncio.run(expression.processExpressionAsync('a|b|c'))
+        self.assertEqual(expression.max_running,1)
+    def test_concurrent_evaluations_are_isolated(self):
+        #Every evaluation sees the lookups of its own context, even when
+        #they run at the same time on the same expression
+        plain=PlainSetExpression()
+        expected={}
+        for name in SETS:
+            token=tenant.set(name)
+            expected[name]=[ plain.processExpression(e) for e in EXPRESSIONS ]
+            tenant.reset(token)
+        expression=AsyncSetExpression()
+        async def run(name):
+            tenant.set(name)
+            return await asyncio.gather(*[ expression.processExpressionAsync(e) for e in EXPRESSIONS ])
+        async def main():
+            return await asyncio.gather(run('red'),run('blue'),run('red'))
+        red,blue,red_again=asyncio.run(main())
+        self.assertEqual(red,expected['red'])
+        self.assertEqual(blue,expected['blue'])
+        self.assertEqual(red_again,expected['red'])
+        self.assertGreater(expression.max_running,1)
+    def test_prefetched_values_do_not_leak(self):
+        expression=AsyncSetExpression()
+        async def main():
+            await expression.processExpressionAsync('a&b')
+            return _prefetched.get()
+        self.assertIsNone(asyncio.run(main()))
+        self.assertIsNone(_prefetched.get())
+    def test_compiled_evaluate_async(self):
+        compiled=FlatDictExpression().compile('a=1&!b')
+        self.assertTrue(asyncio.run(compiled.evaluate_async({'a': '1'})))
+        self.assertFalse(asyncio.run(compiled.evaluate_async({'a': '1', 'b': True})))
@@ -0,0 +1,78 @@
+import asyncio
+import unittest
+from expressionizer import BaseSetExpression, FlatDictExpression, LookupCache
+
+SETS={
+    'all': set(range(1,9)),
+    'a': set([1,2]),
+    'b': set([2,3]),
+}
+TAGS={
+    'tag_all': set(range(1,9)),
+    'x': set([1,5]),
+    'y': set([2,5,6]),
+    'z': set([7]),
+}
+
+class TagExpression(BaseSetExpression):
+    def __init__(self,batched):
+        operators=dict(BaseSetExpression.default_operators,sub_expressions={})
+        BaseSetExpression.__init__(self,operators=operators)
+        self.calls=[]
+        if batched:
+            self.addSubExpression('t','{','}',None,'tag_all',batch=self.tagBatch)
+        else:
+            self.addSubExpression('t','{','}',self.tag,'tag_all')
+    def getSet(self,name):
+        return set(SETS[name])
+    def tag(self,name):
+        self.calls.append(name)
+        return set(TAGS[name])
+    def tagBatch(self,names):
+        self.calls.append(sorted(names))
+        return dict((name,set(TAGS[name])) for name in names)
+
+EXPRESSIONS=['{x}&a','{x|y}','{!z}&!b','({x}|{y})&({y}|{z})','a|{x&!y}']
+
+class BatchTest(unittest.TestCase):
+    def test_same_as_single_lookups(self):
+        single=TagExpression(False)
+        batched=TagExpression(True)
+        for e in EXPRESSIONS:
+            batched.calls=[]
+            self.assertEqual(batched.processExpression(e),single.processExpression(e),e)
+            #One call with every noun, each once
+            self.assertEqual(len(batched.calls),1,e)
+            self.assertEqual(len(batched.calls[0]),len(set(batched.calls[0])),e)
+    def test_cached_nouns_are_not_batched_again(self):
+        batched=TagExpression(True)
+        batched.setCache(LookupCache())
+        batched.processExpression('{x&y}')
+        batched.processExpression('{x|z}')
+        batched.processExpression('{x|z}')
+        self.assertEqual(batched.calls,[['x','y'],['z']])
+    def test_missing_result(self):
+        batched=TagExpression(True)
+        batched.addSubExpression('t','{','}',None,'tag_all',batch=lambda names: {})
+        with self.assertRaises(ValueError):
+            batched.processExpression('{x}')
+    def test_async(self):
+        batched=TagExpression(True)
+        single=TagExpression(False)
+        for e in EXPRESSIONS:
+            batched.calls=[]
+            self.assertEqual(asyncio.run(batched.processExpressionAsync(e)),single.processExpression(e),e)
+            self.assertEqual(len(batched.calls),1,e)
+
+class FlatDictBatchTest(unittest.TestCase):
+    def test_resolved_once_for_many(self):
+        calls=[]
+        def enabled(names):
+            calls.append(sorted(names))
+            return dict((name,name in ('on','yes')) for name in names)
+        expression=FlatDictExpression()
+        expression.addSubExpression('flag','[',']',None,'all',batch=enabled)
+        compiled=expression.compile('[on]&a=1|[off]')
+        rows=[{'a': '1'},{'a': '2'},{}]
+        self.assertEqual(list(compiled.evaluate_many(rows)),[True,False,False])
+        self.assertEqual(calls,[['off','on']])
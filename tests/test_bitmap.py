@@ -0,0 +1,72 @@
+import random
+import unittest
+from expressionizer import BaseSetExpression, BitmapSetExpression
+from expressionizer.bitmap import Bitmap, MemberIndex
+
+SETS={
+    'all': set('host{}'.format(i) for i in range(200)),
+}
+random.seed(11)
+for name in ('a','b','c','d'):
+    SETS[name]=set(random.sample(sorted(SETS['all']),random.randint(0,120)))
+
+class PlainSetExpression(BaseSetExpression):
+    def getSet(self,name):
+        return set(SETS[name])
+
+class NamesBitmapExpression(BitmapSetExpression):
+    def getSet(self,name):
+        return SETS[name]
+
+class BitmapsBitmapExpression(BitmapSetExpression):
+    def getSet(self,name):
+        if name == self.all_name:
+            return self.index.universe()
+        return self.index.bitmap(SETS[name])
+
+class BitmapTest(unittest.TestCase):
+    def test_operations(self):
+        a=Bitmap.fromIds([0,3,64,200])
+        b=Bitmap.fromIds([3,5,200])
+        self.assertEqual(list(a),[0,3,64,200])
+        self.assertEqual(len(a),4)
+        self.assertIn(64,a)
+        self.assertNotIn(5,a)
+        self.assertEqual(list(a & b),[3,200])
+        self.assertEqual(list(a | b),[0,3,5,64,200])
+        self.assertEqual(list(a-b),[0,64])
+        self.assertEqual(list(a ^ b),[0,5,64])
+        self.assertFalse(Bitmap())
+        self.assertEqual(Bitmap.fromIds([]),Bitmap())
+    def test_index(self):
+        index=MemberIndex(['x','y'])
+        bitmap=index.bitmap(['y','z'])
+        self.assertEqual(len(index),3)
+        self.assertEqual(index.names(bitmap),set(['y','z']))
+        self.assertEqual(index.names(index.universe()),set(['x','y','z']))
+
+class BitmapSetExpressionTest(unittest.TestCase):
+    def test_same_as_sets(self):
+        random.seed(13)
+        def make(depth):
+            if depth == 0 or random.random() < 0.3:
+                term=random.choice(['a','b','c','d','all'])
+            else:
+                op=random.choice('&|')
+                term='('+op.join(make(depth-1) for i in range(random.randint(2,3)))+')'
+            if random.random() < 0.3:
+                term='!'+term
+            return term
+        plain=PlainSetExpression()
+        #The index fills up as names are looked up, or is given up front
+        expressions=[NamesBitmapExpression(),NamesBitmapExpression(index=MemberIndex(sorted(SETS['all']))),
+                     BitmapsBitmapExpression(index=MemberIndex(sorted(SETS['all'])))]
+        for i in range(200):
+            e=make(3)
+            for expression in expressions:
+                self.assertEqual(expression.processExpression(e),plain.processExpression(e),(expression.__class__.__name__,e))
+    def test_bitmap_result(self):
+        expression=BitmapsBitmapExpression(index=MemberIndex(sorted(SETS['all'])))
+        bitmap=expression.processExpressionBitmap('a&!b')
+        self.assertIsInstance(bitmap,Bitmap)
+        self.assertEqual(expression.index.names(bitmap),SETS['a']-SETS['b'])
@@ -0,0 +1,32 @@
+import unittest
+from expressionizer import FlatDictExpression, RuleSet, Budget, EvaluationTimeout
+from expressionizer.trace import StatsTracer
+
+class BudgetTest(unittest.TestCase):
+    def calls(self,tracer):
+        return sorted((repr(r['node']),r['calls']) for r in tracer.report())
+    def test_tracer_sees_budgeted_evaluation(self):
+        expression=FlatDictExpression()
+        tracer=StatsTracer()
+        expression.setTracer(tracer)
+        compiled=expression.compile('a&!b')
+        self.assertTrue(compiled.evaluate({'a': True},budget=Budget(operations=100)))
+        budgeted=self.calls(tracer)
+        tracer.reset()
+        compiled.evaluate({'a': True})
+        self.assertEqual(budgeted,self.calls(tracer))
+        self.assertEqual(len(budgeted),4)
+    def test_rules_tracer_sees_budgeted_match(self):
+        rules=RuleSet({'x': 'a&!b', 'y': 'c'})
+        tracer=StatsTracer()
+        rules.setTracer(tracer)
+        self.assertEqual(rules.match({'a': True, 'c': True},budget=Budget(operations=100)),['x','y'])
+        self.assertEqual(sum(r['calls'] for r in tracer.report()),5)
+    def test_budget_still_runs_out(self):
+        expression=FlatDictExpression()
+        tracer=StatsTracer()
+        expression.setTracer(tracer)
+        compiled=expression.compile('a&b&c&d')
+        with self.assertRaises(EvaluationTimeout):
+            compiled.evaluate({'a': True, 'b': True, 'c': True, 'd': True},budget=Budget(operations=2))
+        self.assertEqual(sum(r['calls'] for r in tracer.report()),2)
@@ -0,0 +1,72 @@
+import io
+import unittest
+import expressionizer
+from expressionizer import RuleSet, WatchedRuleSet, save_bundle, load_bundle
+from expressionizer.expressions import FlatDictLeaf
+
+def roundTrip(target,expression=None):
+    f=io.BytesIO()
+    save_bundle(target,f)
+    f.seek(0)
+    return load_bundle(f,expression)
+
+class BundleTest(unittest.TestCase):
+    def test_compiled(self):
+        compiled=roundTrip(expressionizer.compile('a=1&!b'))
+        self.assertTrue(compiled.evaluate({'a': '1'}))
+        self.assertFalse(compiled.evaluate({'a': '1','b': True}))
+        compiled=roundTrip({'x': expressionizer.compile('a'), 'y': expressionizer.compile('!a')})
+        self.assertEqual(sorted(compiled),['x','y'])
+        self.assertFalse(compiled['y'].evaluate({'a': True}))
+    def test_rules(self):
+        rules=roundTrip(RuleSet({'a': 'x=1', 'b': 'x=2|y'}))
+        self.assertIs(rules.__class__,RuleSet)
+        self.assertEqual(rules.match({'x': '1', 'y': True}),['a','b'])
+    def test_watched_rules_keep_their_data(self):
+        rules=WatchedRuleSet({'a': 'x=1', 'b': 'x=2'},data={'x': '1'})
+        loaded=roundTrip(rules)
+        self.assertIs(loaded.__class__,WatchedRuleSet)
+        self.assertEqual(loaded.data,{'x': '1'})
+        self.assertEqual(loaded.results(),['a'])
+        self.assertEqual(loaded.update({'x': '2'}),[('a',False),('b',True)])
+    def test_changed_node_layout(self):
+        f=io.BytesIO()
+        save_bundle(expressionizer.compile('a=1'),f)
+        slots=FlatDictLeaf.__dict__['__slots__']
+        FlatDictLeaf.__slots__=slots+('extra',)
+        try:
+            f.seek(0)
+            with self.assertRaises(ValueError):
+                load_bundle(f)
+        finally:
+            FlatDictLeaf.__slots__=slots
+        f.seek(0)
+        self.assertTrue(load_bundle(f).evaluate({'a': '1'}))
+    def test_damaged(self):
+        f=io.BytesIO()
+        save_bundle(expressionizer.compile('a=1'),f)
+        data=bytearray(f.getvalue())
+        data[-1]^=0xff
+        with self.assertRaises(ValueError):
+            load_bundle(io.BytesIO(bytes(data)))
+    def test_regexes_are_checked_in_safe_mode(self):
+        expression=expressionizer.FlatDictExpression()
+        expression.safe_regex=True
+        f=io.BytesIO()
+        save_bundle(RuleSet({'a': 'k~a{1,30}a{1,30}b', 'b': 'k~x.*'}),f)
+        f.seek(0)
+        with self.assertRaises(ValueError):
+            load_bundle(f,expression)
+        f=io.BytesIO()
+        save_bundle(RuleSet({'b': 'k~x.*'}),f)
+        f.seek(0)
+        self.assertEqual(load_bundle(f,expression).match({'k': 'xyz'}),['b'])
+    def test_deep_trees(self):
+        for expression in ('!('*500+'a'+')'*500,'a&(b|'*500+'c'+')'*500):
+            compiled=roundTrip(expressionizer.compile(expression))
+            self.assertEqual(compiled.evaluate({'a': True}),expressionizer.compile(expression).evaluate({'a': True}))
+            rules=RuleSet({'deep': expression, 'other': 'a&(b|c)'})
+            loaded=roundTrip(rules)
+            self.assertEqual(loaded.nodeCount(),rules.nodeCount())
+            for data in ({'a': True},{'a': True, 'c': True},{'b': True}):
+                self.assertEqual(loaded.match(data),rules.match(data))
@@ -0,0 +1,88 @@
+import unittest
+from expressionizer import BaseSetExpression, LookupCache
+
+class Clock(object):
+    def __init__(self):
+        self.now=0.0
+    def __call__(self):
+        return self.now
+
+class LookupCacheTest(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache=LookupCache(maxsize=2)
+        cache[(None,'a')]=1
+        cache[(None,'b')]=2
+        self.assertEqual(cache[(None,'a')],1)
+        cache[(None,'c')]=3
+        self.assertNotIn((None,'b'),cache)
+        self.assertIn((None,'a'),cache)
+        self.assertEqual(len(cache),2)
+        self.assertEqual(cache.stats()['evictions'],1)
+    def test_ttl(self):
+        clock=Clock()
+        cache=LookupCache(ttl=10,clock=clock)
+        cache[(None,'a')]=1
+        clock.now=9.9
+        self.assertEqual(cache[(None,'a')],1)
+        clock.now=10
+        self.assertNotIn((None,'a'),cache)
+        with self.assertRaises(KeyError):
+            cache[(None,'a')]
+        stats=cache.stats()
+        self.assertEqual((stats['hits'],stats['misses'],stats['expirations'],stats['size']),(1,1,1,0))
+    def test_invalidate(self):
+        cache=LookupCache()
+        for key in ((None,'a'),(None,'b'),('t','a'),('t','b')):
+            cache[key]=key
+        cache.invalidate('a')
+        self.assertEqual(set(cache._data),set([(None,'b'),('t','a'),('t','b')]))
+        cache.invalidateSubExpression('t')
+        self.assertEqual(list(cache._data),[(None,'b')])
+        cache.clear()
+        self.assertEqual(len(cache),0)
+    def test_stats(self):
+        cache=LookupCache()
+        cache[(None,'a')]=1
+        cache[(None,'a')]
+        with self.assertRaises(KeyError):
+            cache[(None,'b')]
+        self.assertEqual(cache.stats()['hit_rate'],0.5)
+        cache.resetStats()
+        self.assertEqual(cache.stats()['hits'],0)
+    def test_maxsize(self):
+        with self.assertRaises(ValueError):
+            LookupCache(maxsize=0)
+
+class CountingSetExpression(BaseSetExpression):
+    sets={
+        'all': set(range(1,9)),
+        'a': set([1,2,5,6]),
+        'b': set([2,3,6,7]),
+    }
+    def __init__(self):
+        BaseSetExpression.__init__(self)
+        self.calls=[]
+    def getSet(self,name):
+        self.calls.append(name)
+        return set(self.sets[name])
+
+class CachedExpressionTest(unittest.TestCase):
+    def test_lookups_are_shared_across_calls(self):
+        plain=CountingSetExpression()
+        cached=CountingSetExpression()
+        cache=LookupCache()
+        cached.setCache(cache)
+        for expression in ('a&!b','a|b','!a','a&!b'):
+            self.assertEqual(cached.processExpression(expression),plain.processExpression(expression),expression)
+        self.assertEqual(sorted(cached.calls),['a','all','b'])
+        self.assertGreater(len(plain.calls),3)
+        cache.invalidate('a')
+        self.assertEqual(cached.processExpression('a'),set([1,2,5,6]))
+        self.assertEqual(sorted(cached.calls),['a','a','all','b'])
+    def test_results_are_not_shared(self):
+        #Evaluating must not change the cached sets
+        cached=CountingSetExpression()
+        cached.setCache(LookupCache())
+        self.assertEqual(cached.processExpression('a|b'),set([1,2,3,5,6,7]))
+        self.assertEqual(cached.processExpression('a'),set([1,2,5,6]))
+        self.assertEqual(cached.processExpression('b'),set([2,3,6,7]))
@@ -0,0 +1,46 @@
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LINES=[
+    b'{"status": 500, "path": "/a", "ok": false}\n',
+    b'{"status": 200, "path": "/b", "ok": true}\n',
+    b'not json\n',
+    b'{"status": null, "path": "/c"}\n',
+    b'{"status": 503.5, "path": "/d"}\n',
+    b'{"status": "404", "path": "/e", "ok": true}\n',
+]
+
+class CliTest(unittest.TestCase):
+    def run_cli(self,*args,lines=LINES):
+        env=dict(os.environ,PYTHONPATH=ROOT)
+        proc=subprocess.run([sys.executable,'-m','expressionizer']+list(args),input=b''.join(lines),stdout=subprocess.PIPE,stderr=subprocess.PIPE,env=env)
+        return (proc.returncode,proc.stdout,proc.stderr)
+    def assertMatches(self,expression,indexes,*args):
+        for jobs in ('1','2'):
+            rc,out,err=self.run_cli('--jobs',jobs,'--chunksize','2',expression,*args)
+            self.assertEqual(err,b'')
+            self.assertEqual(out,b''.join(LINES[i] for i in indexes),(expression,jobs))
+            self.assertEqual(rc,0 if indexes else 1)
+    def test_numbers(self):
+        self.assertMatches('status=500',[0])
+        self.assertMatches('status>=500',[0,4])
+        self.assertMatches('status<500',[1,5])
+    def test_booleans(self):
+        self.assertMatches('ok',[1,5])
+        self.assertMatches('ok&path=/b',[1])
+    def test_stats(self):
+        rc,out,err=self.run_cli('--count','--stats','status>=500')
+        self.assertEqual(out,b'2\n')
+        #The bad line and the null that can't be compared
+        self.assertIn(b'invalid=2',err)
+    def test_deeply_nested_line(self):
+        lines=[b'['*100000+b'\n']+LINES
+        for jobs in ('1','2'):
+            rc,out,err=self.run_cli('--jobs',jobs,'--count','--stats','status>=500',lines=lines)
+            self.assertEqual(rc,0)
+            self.assertEqual(out,b'2\n')
+            self.assertIn(b'invalid=3',err)
@@ -0,0 +1,44 @@
+import random
+import unittest
+from expressionizer import FlatDictExpression
+
+try:
+    import numpy
+    from expressionizer.columnar import evaluate_columns
+except ImportError:
+    numpy=None
+
+@unittest.skipIf(numpy is None,"numpy isn't installed")
+class ColumnarTest(unittest.TestCase):
+    values=['1','2','10','01','007','1.2','1.10','1.2.3','01.2','1..2','.5','5.','','a','B','1a','1.2a','v1.2','1-2','x','١٢',
+            '99999999999999999999','1.99999999999999999999']
+    expressions=['k=1','k!=1','k=1.2','k/1','k/.','k<1','k<=1','k>1','k>=1','k>1.2','k<=1.10','k>=1.2.3','k<1.2a','k>a','k<=1-2',
+                 'k>=0','k<99999999999999999999','k~1.*','k','!k']
+    def assertRowsMatch(self,columns,rows):
+        expression=FlatDictExpression()
+        for e in self.expressions:
+            compiled=expression.compile(e)
+            expected=[ bool(compiled.evaluate(r)) for r in rows ]
+            self.assertEqual(evaluate_columns(compiled,columns).tolist(),expected,e)
+    def test_string_columns(self):
+        random.seed(5)
+        column=[ random.choice(self.values) for i in range(500) ]
+        rows=[ {'k': v} for v in column ]
+        self.assertRowsMatch({'k': numpy.array(column)},rows)
+        self.assertRowsMatch({'k': numpy.array(column,dtype=object)},rows)
+    def test_numbers_and_versions(self):
+        random.seed(6)
+        for make in (lambda: str(random.randint(0,5000)),lambda: '{}.{}'.format(random.randint(0,3),random.randint(0,20))):
+            column=[ make() for i in range(500) ]
+            self.assertRowsMatch({'k': numpy.array(column)},[ {'k': v} for v in column ])
+    def test_masked(self):
+        column=numpy.ma.MaskedArray(['1','2','1.2','a'],mask=[False,True,False,False])
+        rows=[{'k': '1'},{},{'k': '1.2'},{'k': 'a'}]
+        self.assertRowsMatch({'k': column},rows)
+    def test_other_types(self):
+        mask=evaluate_columns('k=1',{'k': numpy.array([1,2])})
+        self.assertEqual(mask.tolist(),[False,False])
+        mask=evaluate_columns('k!=1',{'k': numpy.array([1,'1'],dtype=object)})
+        self.assertEqual(mask.tolist(),[True,False])
+        mask=evaluate_columns('k',{'k': numpy.array([True,False])})
+        self.assertEqual(mask.tolist(),[True,False])
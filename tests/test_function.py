@@ -0,0 +1,36 @@
+import random
+import unittest
+import expressionizer
+from expressionizer import FlatDictExpression
+
+class FunctionTest(unittest.TestCase):
+    def test_matches_evaluate(self):
+        random.seed(19)
+        nouns=['a','b','c=1','c!=1','v>1.2','v<=0.10','k~x.*','c/1']
+        def make(depth):
+            if depth == 0 or random.random() < 0.3:
+                term=random.choice(nouns)
+            else:
+                op=random.choice('&|')
+                term='('+op.join(make(depth-1) for i in range(random.randint(2,3)))+')'
+            if random.random() < 0.3:
+                term='!'+term
+            return term
+        rows=[{},{'a': True},{'a': True, 'b': False, 'c': '1'},{'c': '10', 'v': '1.10', 'k': 'xy'},{'b': True, 'v': '0.2', 'k': 'y'}]
+        for i in range(200):
+            expression=make(3)
+            compiled=expressionizer.compile(expression)
+            function=compiled.as_function()
+            self.assertIsNotNone(function.source)
+            for row in rows:
+                self.assertEqual(function(row),bool(compiled.evaluate(row)),(expression,row))
+    def test_cached(self):
+        self.assertIs(expressionizer.compile_function('a&b'),expressionizer.compile_function('a&b'))
+        self.assertTrue(expressionizer.compile_function('a&!b')({'a': True}))
+    def test_deep_falls_back(self):
+        expression=FlatDictExpression()
+        for depth in (expression.max_recursion_depth+1,20000):
+            function=expression.compileFunction('!('*depth+'a'+')'*depth)
+            self.assertIsNone(function.source)
+            self.assertEqual(function({'a': True}),depth % 2 == 0)
+            self.assertEqual(function({}),depth % 2 == 1)
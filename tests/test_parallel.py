@@ -0,0 +1,24 @@
+import pickle
+import unittest
+import expressionizer
+from expressionizer import RuleSet
+from expressionizer.parallel import ParallelEvaluator
+
+DEEP=['!('*500+'a'+')'*500,'a&(b|'*500+'c'+')'*500]
+DATA=[{'a': True},{'a': True, 'c': True},{'b': True},{}]
+
+class ParallelTest(unittest.TestCase):
+    def test_deep_expression(self):
+        for expression in DEEP:
+            compiled=expressionizer.compile(expression)
+            with ParallelEvaluator(compiled,processes=1,chunksize=2) as pool:
+                self.assertEqual(list(pool.evaluate_many(DATA)),[ compiled.evaluate(d) for d in DATA ])
+    def test_deep_rules(self):
+        rules=RuleSet(dict(zip(('x','y'),DEEP)))
+        with ParallelEvaluator(rules,processes=1,chunksize=2) as pool:
+            self.assertEqual(list(pool.evaluate_many(DATA)),[ rules.match(d) for d in DATA ])
+    def test_pickled_rules_share_nodes(self):
+        rules=RuleSet(dict(zip(('x','y','z'),DEEP+['a&b'])))
+        loaded=pickle.loads(pickle.dumps(rules))
+        self.assertEqual(loaded.nodeCount(),rules.nodeCount())
+        self.assertLess(len(pickle.dumps(rules)),len(pickle.dumps(rules.rules['x']))*10)
@@ -0,0 +1,97 @@
+import time
+import unittest
+import expressionizer
+from expressionizer import FlatDictExpression
+from expressionizer.compiled import Leaf, Not, And, Or
+
+class ParseSemanticsTest(unittest.TestCase):
+    flat_dict={'a': True, 'b': True, 'c': False}
+    def evaluate(self,expression):
+        return FlatDictExpression(self.flat_dict).processExpression(expression)
+    def test_not(self):
+        self.assertFalse(self.evaluate('!a'))
+        self.assertTrue(self.evaluate('!c'))
+        self.assertTrue(self.evaluate('!!a'))
+    def test_or_not(self):
+        self.assertTrue(self.evaluate('a|!c'))
+        self.assertTrue(self.evaluate('a|!a'))
+        self.assertTrue(self.evaluate('c|!c'))
+    def test_not_between_operands_is_and_not(self):
+        self.assertFalse(self.evaluate('b!a'))
+        self.assertTrue(self.evaluate('b!c'))
+        self.assertFalse(self.evaluate('c!a'))
+        self.assertEqual(self.evaluate('b!c'),self.evaluate('b&!c'))
+        self.assertTrue(self.evaluate('a!!b'))
+    def test_not_equal_is_one_comparison(self):
+        #"!=" used to be split on the "!" operator
+        for data,expected in (({'a': '1'},False),({'a': '2'},True),({},False)):
+            expression=FlatDictExpression(data)
+            self.assertEqual(expression.processExpression('a!=1'),expected,data)
+            self.assertEqual(expression.processExpression('!a!=1'),not expected,data)
+        root=FlatDictExpression().compile('b!a!=1').root
+        self.assertIs(root.__class__,And)
+        self.assertEqual(root.children[1].child.op,'!=')
+        self.assertFalse(FlatDictExpression({'a': '2', 'b': True}).processExpression('b!a!=1'))
+    def test_nouns_are_stripped(self):
+        self.assertTrue(self.evaluate(' a '))
+        self.assertTrue(self.evaluate('a & b'))
+    def test_repeated_operator(self):
+        self.assertTrue(self.evaluate('a&&b'))
+        self.assertTrue(self.evaluate('c||a'))
+    def test_malformed(self):
+        for expression in ('a)','(a','a&','a|','a!','&a','|a','(&a)','a&|b','a|&b','a!&b','()','',' '):
+            with self.assertRaises(ValueError,msg=expression):
+                self.evaluate(expression)
+
+class ParseTreeTest(unittest.TestCase):
+    def root(self,expression):
+        return FlatDictExpression().compile(expression).root
+    def test_runs_are_one_node(self):
+        root=self.root('a&b&c')
+        self.assertIs(root.__class__,And)
+        self.assertEqual(len(root.children),3)
+    def test_left_groups_are_flattened(self):
+        root=self.root('(a|b)|c')
+        self.assertIs(root.__class__,Or)
+        self.assertEqual(len(root.children),3)
+    def test_left_to_right(self):
+        #"a|b&c" is "(a|b)&c"
+        root=self.root('a|b&c')
+        self.assertIs(root.__class__,And)
+        self.assertEqual(sorted(c.__class__.__name__ for c in root.children),['FlatDictLeaf','Or'])
+        self.assertFalse(FlatDictExpression({'a': True, 'b': False, 'c': False}).processExpression('a|b&c'))
+    def test_not(self):
+        root=self.root('!a')
+        self.assertIs(root.__class__,Not)
+        self.assertIsInstance(root.child,Leaf)
+    def test_deep_nesting(self):
+        depth=5000
+        compiled=FlatDictExpression().compile('('*depth+'a'+')'*depth)
+        self.assertTrue(compiled.evaluate({'a': True}))
+
+    def test_left_groups_scale_linearly(self):
+        def parse_time(n):
+            expression='('*n+'a'+'&a)'*n
+            best=None
+            for i in range(3):
+                start=time.perf_counter()
+                root=FlatDictExpression().compile(expression).root
+                elapsed=time.perf_counter()-start
+                best=elapsed if best is None else min(best,elapsed)
+            self.assertEqual(len(root.children),n+1)
+            return best
+        small=parse_time(2000)
+        #Quadratic parsing would be 64 times slower
+        self.assertLess(parse_time(16000),small*24)
+
+class ExportsTest(unittest.TestCase):
+    def test_star_import_keeps_builtins(self):
+        namespace={}
+        exec('from expressionizer import *',namespace)
+        self.assertNotIn('compile',namespace)
+        self.assertTrue(callable(expressionizer.compile))
+    def test_parallel_is_imported_lazily(self):
+        import subprocess
+        import sys
+        code='import sys, expressionizer; assert "expressionizer.parallel" not in sys.modules; expressionizer.ParallelEvaluator'
+        subprocess.check_call([sys.executable,'-c',code])
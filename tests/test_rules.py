@@ -0,0 +1,55 @@
+import unittest
+from expressionizer import RuleSet, WatchedRuleSet, Budget, IndexedFlatDict
+
+class WatchedRuleSetTest(unittest.TestCase):
+    def test_match_defaults_to_watched_data(self):
+        rules=WatchedRuleSet({'a': 'x=1', 'b': 'x=2&y'},data={'x': '1'})
+        self.assertEqual(rules.match(),['a'])
+        self.assertEqual(rules.match(budget=Budget(operations=100)),['a'])
+        rules.update({'x': '2','y': True})
+        self.assertEqual(rules.match(),['b'])
+        self.assertEqual(rules.match(),rules.results())
+        self.assertEqual(rules.match({'x': '1'}),['a'])
+
+class WildcardRuleSetTest(unittest.TestCase):
+    def test_plain_and_indexed_dicts_match_the_same(self):
+        rules=dict(('r{}'.format(i),'net.*.mtu>={}'.format(i*1000)) for i in range(10))
+        rules['up']='all:net.*.up&!net.*.mtu=1500'
+        data={'net.eth0.up': True, 'net.eth1.up': True, 'net.eth0.mtu': '9000', 'net.eth1.mtu': '1500', 'sys.name': 'a'}
+        expected=['r0','r1','r2','r3','r4','r5','r6','r7','r8','r9']
+        for threshold in (1,100):
+            rule_set=RuleSet(rules)
+            rule_set.index_wildcards=threshold
+            self.assertEqual(rule_set.match(data),expected)
+            self.assertEqual(rule_set.match(IndexedFlatDict(data)),expected)
+        data['net.eth1.mtu']='1400'
+        self.assertEqual(RuleSet(rules).match(data),expected+['up'])
+
+class RemoveTest(unittest.TestCase):
+    def churn(self,rules):
+        start=rules.nodeCount()
+        for i in range(50):
+            rules.add('tmp','net.*.mtu>={0}&(x={0}|!y)'.format(i))
+            rules.add('tmp2','x={}'.format(i))
+            rules.remove('tmp')
+            rules.remove('tmp2')
+        self.assertEqual(rules.nodeCount(),start)
+        self.assertEqual(rules._wildcards,0)
+    def test_nodes_are_released(self):
+        rules=RuleSet({'a': 'x=1&y', 'b': 'y|z'})
+        self.churn(rules)
+        self.assertEqual(rules.match({'x': '1', 'y': True}),['a','b'])
+    def test_replaced_rules_keep_shared_nodes(self):
+        rules=RuleSet({'a': 'x=1&y'})
+        count=rules.nodeCount()
+        rules.add('a','x=1&y')
+        self.assertEqual(rules.nodeCount(),count)
+        rules.add('a','x=1')
+        self.assertEqual(rules.nodeCount(),1)
+        self.assertEqual(rules.match({'x': '1'}),['a'])
+    def test_watched_nodes_are_released(self):
+        rules=WatchedRuleSet({'a': 'x=1&y', 'b': 'y|z'},data={'x': '1', 'y': True})
+        values=len(rules._values)
+        self.churn(rules)
+        self.assertEqual(len(rules._values),values)
+        self.assertEqual(rules.update({'y': False}),[('a',False),('b',False)])
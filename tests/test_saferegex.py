@@ -0,0 +1,22 @@
+import unittest
+from expressionizer import FlatDictExpression
+from expressionizer.saferegex import check_pattern
+
+class SafeExpression(FlatDictExpression):
+    safe_regex=True
+
+class CheckPatternTest(unittest.TestCase):
+    def test_unsafe(self):
+        for pattern in ('(a+)+','(a|aa)*','.*a.*b','\\d*\\d+','(?:a{1,20}){1,20}b','(?:a{1,20}){20}b',
+                        'a{1,30}'*10+'b','\\w{0,1000}\\w{0,1000}\\w{0,1000}x','(a)\\1','(?=a)a',
+                        '(a|a)*b','(ab|ab)*c','(a|a){10}b','(a?){25}a{25}','(\\w?){25}\\w{25}'):
+            with self.assertRaises(ValueError,msg=pattern):
+                check_pattern(pattern)
+    def test_safe(self):
+        for pattern in ('\\d{1,3}\\.\\d{1,3}','https?://','colou?r','-?\\d+','(\\.[0-9]+)*','(foo|bar)+',
+                        '([0-9]{1,3}\\.){3}[0-9]{1,3}','a{2}a{3}','^v[0-9]+$','(\\.(com|org))*','foo|bar'):
+            check_pattern(pattern)
+    def test_expression(self):
+        with self.assertRaises(ValueError):
+            SafeExpression().compile('k~a{1,30}a{1,30}b')
+        self.assertTrue(SafeExpression().compile('k~v[0-9]+').evaluate({'k': 'v12'}))
@@ -0,0 +1,96 @@
+import random
+import unittest
+from expressionizer import BaseSetExpression
+from expressionizer.compiled import Leaf, Not, And
+from expressionizer.trace import StatsTracer
+
+class SetExpression(BaseSetExpression):
+    sets={
+        'all': set(range(1,9)),
+        'a': set([1,2,5,6]),
+        'b': set([2,3,6,7]),
+        'c': set([5,6,7,8]),
+    }
+    def getSet(self,name):
+        return set(self.sets[name])
+
+class TracerTest(unittest.TestCase):
+    def notResults(self,expression,iterative):
+        e=SetExpression()
+        tracer=StatsTracer()
+        e.setTracer(tracer)
+        compiled=e.compile(expression)
+        if iterative:
+            e._evalIterative(compiled.root)
+        else:
+            compiled.evaluate()
+        return sorted((repr(r['node']),r['calls'],r['true']) for r in tracer.report() if isinstance(r['node'],Not))
+    def test_negations_are_traced(self):
+        for iterative in (False,True):
+            self.assertEqual(self.notResults('a&!b',iterative),[("Not(Leaf('b'))",1,1)])
+            self.assertEqual(self.notResults('!a|!b',iterative),[("Not(Leaf('a'))",1,1),("Not(Leaf('b'))",1,1)])
+            self.assertEqual(len(self.notResults('!(a|b|c)',iterative)),1)
+
+def subExprSets(name):
+    return set(MixedSetExpression.sub_sets[name])
+
+class MixedSetExpression(BaseSetExpression):
+    sets={
+        'all': set([1,2,3,4]),
+        'a': set([1,2]),
+        'b': set([2,3]),
+    }
+    sub_sets={
+        'sub_all': set([10,11,12]),
+        'y': set([11]),
+        'z': set([11,12]),
+    }
+    def __init__(self):
+        operators=dict(BaseSetExpression.default_operators,sub_expressions={})
+        BaseSetExpression.__init__(self,operators=operators)
+        self.addSubExpression('t','{','}',subExprSets,'sub_all')
+    def getSet(self,name):
+        return set(self.sets[name])
+
+class MixedContextTest(unittest.TestCase):
+    def reference(self,e,node):
+        #Every node exactly as written, without the shortcuts of _evalNode
+        if isinstance(node,Leaf):
+            return e._leafSet(node)
+        if isinstance(node,Not):
+            return e._universe(node.subexpr) - self.reference(e,node.child)
+        results=[ self.reference(e,c) for c in node.children ]
+        if isinstance(node,And):
+            return set.intersection(*results)
+        return set.union(*results)
+    def assertEvaluates(self,expression,expected=None):
+        e=MixedSetExpression()
+        compiled=e.compile(expression)
+        if expected is None:
+            expected=self.reference(e,compiled.root)
+        self.assertEqual(compiled.evaluate(),expected,expression)
+        self.assertEqual(e._evalIterative(compiled.root),expected,expression)
+    def test_or_of_negations(self):
+        self.assertEvaluates('!a|{!y}',set([3,4,10,12]))
+        self.assertEvaluates('{!y}|!a',set([3,4,10,12]))
+        self.assertEvaluates('!a|!b|{!y}|{!z}',set([1,3,4,10,12]))
+    def test_and_with_negations(self):
+        self.assertEvaluates('{y}&!a',set())
+        self.assertEvaluates('a&{!y}',set())
+        self.assertEvaluates('{z}&!a&{!y}',set())
+        self.assertEvaluates('{z}&{!y}',set([12]))
+        self.assertEvaluates('a&!b',set([1]))
+    def test_random(self):
+        random.seed(12)
+        nouns=['a','b','{y}','{z}','{sub_all}','all']
+        def make(depth):
+            if depth == 0 or random.random() < 0.3:
+                term=random.choice(nouns)
+            else:
+                op=random.choice('&|')
+                term='('+op.join(make(depth-1) for i in range(random.randint(2,3)))+')'
+            if random.random() < 0.4:
+                term='!'+term if not term.startswith('{') else '{!'+term[1:]
+            return term
+        for i in range(300):
+            self.assertEvaluates(make(3))